@@ -1,38 +1,142 @@
-import pandas as pd
-from io import StringIO
+import csv
+import re
+import sys
+from collections import deque
 
-bad_lines = []
+INPUT_FILE = "commits_report.csv"
+GOOD_LINES_FILE = "good_lines.csv"
+BAD_LINES_FILE = "bad_lines.csv"
+# a quoted field spanning more physical lines or characters than this is an unbalanced quote
+MAX_RECORD_LINES = 1000
+MAX_RECORD_CHARS = 256 * 2**20
 
 
-def read_csv_with_error_handling(file_path):
-    global bad_lines
-    temp_df = pd.DataFrame()
+class RecordTooLong(Exception):
+    pass
 
-    with open(file_path, "r") as f:
-        header = f.readline().strip().split(",")
-        temp_df = pd.DataFrame(columns=header)
 
-        for i, line in enumerate(f):
-            try:
-                temp_line_df = pd.read_csv(StringIO(line), header=None)
+# physical lines of the file for csv.reader, remembering the lines of the current record so
+# a broken one can be read again from any of its lines
+class RecordLines:
+    def __init__(self, f, max_lines=MAX_RECORD_LINES, max_chars=MAX_RECORD_CHARS):
+        self.f = f
+        self.max_lines = max_lines
+        self.max_chars = max_chars
+        self.line_number = 0
+        self.pushed_back = deque()
+        self.record = []
+        self.record_chars = 0
+
+    def start_record(self):
+        self.record = []
+        self.record_chars = 0
+
+    def push_back(self, lines):
+        self.pushed_back.extendleft(reversed(lines))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.pushed_back:
+            number, line = self.pushed_back.popleft()
+        else:
+            line = self.f.readline()
+            if not line:
+                raise StopIteration
+            self.line_number += 1
+            number = self.line_number
+        self.record.append((number, line))
+        self.record_chars += len(line)
+        if len(self.record) > self.max_lines or self.record_chars > self.max_chars:
+            raise RecordTooLong(
+                f"record spans more than {self.max_lines} lines or "
+                f"{self.max_chars} characters"
+            )
+        return line
 
-                if len(temp_line_df.columns) != len(header):
-                    print(i + 2)
-                    bad_lines.append((i + 2, line.strip()))
-                    continue
 
-                temp_line_df.columns = header
-                temp_df = pd.concat([temp_df, temp_line_df], ignore_index=True)
-            except pd.errors.ParserError:
-                print(i + 2)
-                bad_lines.append((i + 2, line.strip()))
+# read the csv once, quoted fields may span several lines, and write the rows with as many
+# fields as the header to good_lines_file and the others to bad_lines_file as they are read;
+# a record broken by an unbalanced quote is reported up to the next line matching row_start
+# (any line when None), where reading resumes, so it cannot swallow the rest of the file
+def validate_csv(
+    file_path,
+    good_lines_file=GOOD_LINES_FILE,
+    bad_lines_file=BAD_LINES_FILE,
+    row_start=None,
+    max_record_lines=MAX_RECORD_LINES,
+    max_record_chars=MAX_RECORD_CHARS,
+):
+    csv.field_size_limit(max_record_chars)
+    row_start = re.compile(row_start) if isinstance(row_start, str) else row_start
+    good_rows = bad_rows = 0
+
+    with open(file_path, "r", newline="") as f, open(
+        good_lines_file, "w", newline=""
+    ) as good_f, open(bad_lines_file, "w", newline="") as bad_f:
+        lines = RecordLines(f, max_record_lines, max_record_chars)
+        reader = csv.reader(lines)
+        good_writer = csv.writer(good_f)
+        bad_writer = csv.writer(bad_f)
+        bad_writer.writerow(["Line Number", "Content"])
+
+        header = next(reader, None)
+        if header is None:
+            return {"good": 0, "bad": 0}
+        good_writer.writerow(header)
+
+        while True:
+            lines.start_record()
+            try:
+                row = next(reader)
+                error = None
+                if len(lines.record) > 1 and len(row) != len(header):
+                    error = "unbalanced quote"
+            except StopIteration:
+                break
+            except (csv.Error, RecordTooLong) as e:
+                error = str(e)
 
-    bad_lines_df = pd.DataFrame(bad_lines, columns=["Line Number", "Content"])
-    bad_lines_df.to_csv("bad_lines.csv", index=False)
+            if error is not None:
+                record = lines.record
+                # resume at the first line after the first one that starts like a row
+                resume = next(
+                    (
+                        index
+                        for index in range(1, len(record))
+                        if row_start is None or row_start.match(record[index][1])
+                    ),
+                    len(record),
+                )
+                first, last = record[0][0], record[resume - 1][0]
+                print(first if first == last else f"{first}-{last}")
+                bad_writer.writerow(
+                    [
+                        first if first == last else f"{first}-{last}",
+                        "".join(line for _, line in record[:resume]).rstrip("\r\n"),
+                    ]
+                )
+                bad_rows += 1
+                lines.push_back(record[resume:])
+                continue
 
-    return temp_df
+            if not row:
+                continue
+            if len(row) != len(header):
+                print(lines.record[0][0])
+                bad_writer.writerow([lines.record[0][0], ",".join(row)])
+                bad_rows += 1
+                continue
+            good_writer.writerow(row)
+            good_rows += 1
 
+    print(
+        f"{good_rows} good rows written to {good_lines_file}, "
+        f"{bad_rows} bad rows written to {bad_lines_file}"
+    )
+    return {"good": good_rows, "bad": bad_rows}
 
-df = read_csv_with_error_handling("commits_report.csv")
 
-print(df.head())
+if __name__ == "__main__":
+    validate_csv(sys.argv[1] if len(sys.argv) > 1 else INPUT_FILE)
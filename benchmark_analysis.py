@@ -0,0 +1,195 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import time
+from queue import Empty
+
+from bad_lines import validate_csv
+from issue_store import (
+    COMMITS_TABLE,
+    ISSUES_TABLE,
+    IssueStore,
+    convert_commits_report,
+)
+from issues_analysis import analyze_issues
+from synthetic_report import (
+    CHURN_RATE,
+    MALFORMED_FRACTION,
+    generate_commits_report,
+    generate_issue_store,
+)
+
+BENCHMARK_RESULTS_FILE = "benchmark_analysis_results.json"
+# (samples, commits per sample, issues per commit) of each benchmark size
+BENCHMARK_SIZES = [(2, 50, 100), (4, 100, 200), (8, 200, 400)]
+STAGE_POLL_INTERVAL = 1
+
+
+def run_validate(work_dir):
+    return validate_csv(
+        os.path.join(work_dir, "commits_report.csv"),
+        os.path.join(work_dir, "good_lines.csv"),
+        os.path.join(work_dir, "bad_lines.csv"),
+    )
+
+
+def run_convert(work_dir):
+    convert_commits_report(
+        os.path.join(work_dir, "good_lines.csv"),
+        IssueStore(os.path.join(work_dir, "report")),
+    )
+
+
+def run_lifecycle(work_dir, mode):
+    return len(
+        analyze_issues(
+            report_file=os.path.join(work_dir, "good_lines.csv"),
+            store_path=os.path.join(work_dir, "report"),
+            state_file=os.path.join(work_dir, f"lifecycle_state_{mode}.json"),
+            output_file=os.path.join(work_dir, f"analysis_{mode}.csv"),
+            mode=mode,
+        )
+    )
+
+
+STAGES = {
+    "validate_csv": run_validate,
+    "convert_report": run_convert,
+    "lifecycle_incremental": lambda work_dir: run_lifecycle(work_dir, "incremental"),
+    "lifecycle_batch": lambda work_dir: run_lifecycle(work_dir, "batch"),
+}
+
+
+# runs in a fresh process, so its peak RSS belongs to the stage alone
+def run_stage_process(name, work_dir, queue):
+    start = time.perf_counter()
+    try:
+        STAGES[name](work_dir)
+    except Exception as e:
+        queue.put({"error": repr(e)})
+        return
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux, the batch lifecycle has its own workers
+    queue.put(
+        {
+            "seconds": round(elapsed, 3),
+            "peak_rss_mb": round(
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+            ),
+            "children_peak_rss_mb": round(
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1
+            ),
+        }
+    )
+
+
+def run_stage(name, work_dir):
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+    process = context.Process(target=run_stage_process, args=(name, work_dir, queue))
+    process.start()
+    # a stage killed before it sends its result must not hang the benchmark
+    while True:
+        try:
+            result = queue.get(timeout=STAGE_POLL_INTERVAL)
+            break
+        except Empty:
+            if process.exitcode is not None:
+                result = {"error": f"exit code {process.exitcode}"}
+                break
+    process.join()
+    if "error" in result:
+        print(f"Stage {name} failed: {result['error']}")
+    return result
+
+
+def run_benchmark(
+    sizes=BENCHMARK_SIZES,
+    churn=CHURN_RATE,
+    malformed_fraction=MALFORMED_FRACTION,
+    stages=tuple(STAGES),
+):
+    results = []
+    for num_samples, commits_per_sample, issues_per_commit in sizes:
+        work_dir = tempfile.mkdtemp(prefix="issues-benchmark-")
+        try:
+            size = {
+                "samples": num_samples,
+                "commits_per_sample": commits_per_sample,
+                "issues_per_commit": issues_per_commit,
+            }
+            if "validate_csv" in stages or "convert_report" in stages:
+                report_file = os.path.join(work_dir, "commits_report.csv")
+                generate_commits_report(
+                    report_file,
+                    num_samples,
+                    commits_per_sample,
+                    issues_per_commit,
+                    churn,
+                    malformed_fraction,
+                )
+                size["report_mb"] = round(os.path.getsize(report_file) / 2**20, 1)
+            else:
+                # the lifecycle stages alone read a store written without the csv, so
+                # large sizes are not bound by the csv stages
+                store = IssueStore(os.path.join(work_dir, "report"))
+                generate_issue_store(
+                    store, num_samples, commits_per_sample, issues_per_commit, churn
+                )
+                size["store_mb"] = round(
+                    sum(
+                        os.path.getsize(partition_file)
+                        for table in (COMMITS_TABLE, ISSUES_TABLE)
+                        for partition_file in store.get_partition_files(table)
+                    )
+                    / 2**20,
+                    1,
+                )
+            for name in stages:
+                result = dict(size, stage=name, **run_stage(name, work_dir))
+                results.append(result)
+                print(json.dumps(result))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def parse_size(value):
+    num_samples, commits_per_sample, issues_per_commit = map(int, value.split("x"))
+    return num_samples, commits_per_sample, issues_per_commit
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the analysis scripts on synthetic commits reports"
+    )
+    parser.add_argument(
+        "--size",
+        action="append",
+        type=parse_size,
+        help="samples x commits per sample x issues per commit, e.g. 4x100x200",
+    )
+    parser.add_argument("--churn", type=float, default=CHURN_RATE)
+    parser.add_argument("--malformed", type=float, default=MALFORMED_FRACTION)
+    parser.add_argument("--stage", action="append", choices=list(STAGES))
+    parser.add_argument("--output", default=BENCHMARK_RESULTS_FILE)
+    args = parser.parse_args()
+
+    results = run_benchmark(
+        args.size or BENCHMARK_SIZES,
+        args.churn,
+        args.malformed,
+        # the stages after validation read what the previous ones wrote
+        [name for name in STAGES if name in args.stage] if args.stage else STAGES,
+    )
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,424 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from queue import Empty
+
+import pandas as pd
+
+import main as main_pipeline
+import sonarqube_analysis
+from fake_sonarqube import start_fake_server
+from repository_cache import get_mirror_path
+from run_state import RunState
+from sonarqube_ce import get_ce_activity_status
+from issue_store import IssueStore
+from stage_metrics import StageMetrics, report_summary
+from sonarqube_snippets import (
+    SnippetStore,
+    SourceCache,
+    extract_snippets,
+    extract_snippets_by_component,
+)
+
+BENCHMARK_SAMPLE = "benchmark"
+# project scanned by the main.py pipeline, apart from the one of sonarqube_analysis
+MAIN_SAMPLE = "benchmark-main"
+BENCHMARK_RESULTS_FILE = "benchmark_results.json"
+NUM_COMMITS = 50
+FILES_PER_COMMIT = 3
+FETCH_REPEATS = 5
+STAGE_POLL_INTERVAL = 1
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+# synthetic repository whose every commit changes a few source files
+def create_repository(path, num_commits=NUM_COMMITS, files_per_commit=FILES_PER_COMMIT):
+    os.makedirs(path, exist_ok=True)
+    env = dict(
+        os.environ,
+        GIT_AUTHOR_NAME="benchmark",
+        GIT_AUTHOR_EMAIL="benchmark@example.com",
+        GIT_COMMITTER_NAME="benchmark",
+        GIT_COMMITTER_EMAIL="benchmark@example.com",
+    )
+    subprocess.run(["git", "init", "-q", path], check=True)
+    for number in range(num_commits):
+        for file_number in range(files_per_commit):
+            module = (number * files_per_commit + file_number) % 20
+            with open(os.path.join(path, f"module_{module}.py"), "a") as f:
+                f.write(f"value_{number}_{file_number} = {number}\n")
+        # one commit a day, so the analysis dates are increasing
+        date = time.strftime(
+            "%Y-%m-%dT%H:%M:%S+0000", time.gmtime(1704067200 + number * 86400)
+        )
+        subprocess.run(["git", "add", "-A"], cwd=path, check=True)
+        subprocess.run(
+            ["git", "commit", "-q", "-m", f"commit {number}"],
+            cwd=path,
+            check=True,
+            env=dict(env, GIT_AUTHOR_DATE=date, GIT_COMMITTER_DATE=date),
+        )
+
+
+# directory with a sonar-scanner that runs the fake scanner, to put first in PATH
+def create_scanner_bin(path):
+    os.makedirs(path, exist_ok=True)
+    scanner_path = os.path.join(path, "sonar-scanner")
+    with open(scanner_path, "w") as f:
+        f.write("#!/bin/sh\n")
+        f.write(
+            f'PYTHONPATH="{script_dir}" exec "{sys.executable}" '
+            f'"{os.path.join(script_dir, "fake_sonar_scanner.py")}" "$@"\n'
+        )
+    os.chmod(scanner_path, 0o755)
+    return path
+
+
+def get_request_count(server):
+    with server.state.lock:
+        return sum(server.state.request_counts.values())
+
+
+# main.py does not wait for the Compute Engine, its issues are searchable once the
+# queue is drained
+def wait_for_ce_queue(client):
+    while True:
+        status = get_ce_activity_status(client)
+        if status is not None and not status["pending"] + status["inProgress"]:
+            return
+        time.sleep(STAGE_POLL_INTERVAL)
+
+
+def get_max_rss_mb(who):
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+# runs in a forked process, so its peak RSS belongs to the stage alone, and tracemalloc
+# only runs in the memory pass since it slows the timed code down
+def run_stage_process(function, trace_memory, queue):
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        value, error = function(), None
+    except Exception as e:
+        value, error = None, repr(e)
+    elapsed = time.perf_counter() - start
+    result = {
+        "seconds": elapsed,
+        "peak_rss_mb": round(get_max_rss_mb(resource.RUSAGE_SELF), 1),
+        "children_peak_rss_mb": round(get_max_rss_mb(resource.RUSAGE_CHILDREN), 1),
+    }
+    if trace_memory:
+        result["python_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+    queue.put((result, value, error))
+
+
+# run a stage in its own process and record its duration, the requests it sent and its
+# memory peak, the value it returns is sent back to the benchmark
+def run_stage(results, server, name, function, units=None, trace_memory=False):
+    print(f"Running stage {name}")
+    requests_before = get_request_count(server)
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+    process = context.Process(
+        target=run_stage_process, args=(function, trace_memory, queue)
+    )
+    process.start()
+    while True:
+        try:
+            stage_result, value, error = queue.get(timeout=STAGE_POLL_INTERVAL)
+            break
+        except Empty:
+            if process.exitcode is not None:
+                stage_result, value = None, None
+                error = f"exit code {process.exitcode}"
+                break
+    process.join()
+    if error is not None:
+        raise RuntimeError(f"Stage {name} failed: {error}")
+
+    elapsed = stage_result.pop("seconds")
+    num_requests = get_request_count(server) - requests_before
+    result = dict(
+        stage=name,
+        seconds=round(elapsed, 3),
+        requests=num_requests,
+        requests_per_second=round(num_requests / elapsed, 1) if elapsed else 0,
+        **stage_result,
+    )
+    if units is not None:
+        result["commits_per_minute"] = round(units * 60 / elapsed, 1) if elapsed else 0
+    results.append(result)
+    print(json.dumps(result))
+    return value
+
+
+def run_benchmark(
+    num_commits=NUM_COMMITS,
+    fetch_repeats=FETCH_REPEATS,
+    server_options=None,
+    scan_time=0.0,
+    work_dir=None,
+    issue_retrieval="full",
+    trace_memory=False,
+):
+    work_dir = work_dir or tempfile.mkdtemp(prefix="sonarqube-benchmark-")
+    repository_path = os.path.join(work_dir, BENCHMARK_SAMPLE)
+    create_repository(repository_path, num_commits)
+
+    server = start_fake_server(**(server_options or {}))
+    print(f"Fake SonarQube listening on {server.url}")
+    os.environ["PATH"] = (
+        create_scanner_bin(os.path.join(work_dir, "bin"))
+        + os.pathsep
+        + os.environ["PATH"]
+    )
+    os.environ["FAKE_SCANNER_SCAN_TIME"] = str(scan_time)
+
+    # point the pipeline at the fake server and at the benchmark folder
+    sonarqube_analysis.SONAR_URL = server.url
+    sonarqube_analysis.SONAR_LOGIN = "admin"
+    sonarqube_analysis.SONAR_PASSWORD = "admin"
+    sonarqube_analysis.ISSUE_STORE_PATH = os.path.join(work_dir, "issue_store")
+    sonarqube_analysis.RUN_STATE_FILE = os.path.join(work_dir, "run_state.sqlite")
+    sonarqube_analysis.STAGE_EVENTS_FILE = os.path.join(work_dir, "stage_events.jsonl")
+    sonarqube_analysis.ISOLATED_SCANNER_HOMES = False
+    sonarqube_analysis.EXPORT_COMMITS = False
+    sonarqube_analysis.COMMIT_SAMPLING = "all"
+    sonarqube_analysis.ISSUE_RETRIEVAL = issue_retrieval
+    main_pipeline.SONAR_URL = server.url
+    main_pipeline.SONAR_AUTH = ("admin", "admin")
+    main_pipeline.samples_folder = os.path.join(work_dir, "samples")
+    main_pipeline.RUN_STATE_FILE = os.path.join(work_dir, "main_run_state.sqlite")
+    main_pipeline.STAGE_EVENTS_FILE = os.path.join(work_dir, "main_stage_events.jsonl")
+    main_pipeline.ISOLATED_SCANNER_HOMES = False
+    main_pipeline.EXPORT_COMMITS = False
+    main_pipeline.COMMIT_SAMPLING = "all"
+    main_pipeline.WORKTREES_PER_REPOSITORY = 1
+
+    results = []
+    current_dir = os.getcwd()
+    try:
+
+        def prepare_project():
+            sonarqube_analysis.create_sonarqube_project(BENCHMARK_SAMPLE)
+            return sonarqube_analysis.generate_sonarqube_token(BENCHMARK_SAMPLE)
+
+        token = run_stage(
+            results, server, "project", prepare_project, trace_memory=trace_memory
+        )
+
+        def analyze():
+            os.chdir(repository_path)
+            run_state = RunState(sonarqube_analysis.RUN_STATE_FILE)
+            try:
+                sonarqube_analysis.analyze_commits(BENCHMARK_SAMPLE, token, run_state)
+                IssueStore(sonarqube_analysis.ISSUE_STORE_PATH).merge_shards(
+                    [BENCHMARK_SAMPLE]
+                )
+            finally:
+                run_state.close()
+                os.chdir(current_dir)
+
+        metrics = StageMetrics(sonarqube_analysis.STAGE_EVENTS_FILE)
+        run_stage(
+            results,
+            server,
+            "analyze_commits",
+            analyze,
+            units=num_commits,
+            trace_memory=trace_memory,
+        )
+        report_summary(metrics)
+
+        def fetch_issues():
+            issues = None
+            for _ in range(fetch_repeats):
+                issues = sonarqube_analysis.get_issues_detected(BENCHMARK_SAMPLE, token)
+            return issues["issues"]
+
+        issues = run_stage(
+            results, server, "fetch_issues", fetch_issues, trace_memory=trace_memory
+        )
+
+        run_stage(
+            results,
+            server,
+            "snippets_by_issue",
+            lambda: extract_snippets(
+                sonarqube_analysis.get_sonar_client(),
+                [(issue["key"], issue["component"]) for issue in issues],
+                store=SnippetStore(os.path.join(work_dir, "snippets_by_issue")),
+            ),
+            trace_memory=trace_memory,
+        )
+        run_stage(
+            results,
+            server,
+            "snippets_by_component",
+            lambda: extract_snippets_by_component(
+                sonarqube_analysis.get_sonar_client(),
+                [
+                    (
+                        issue["key"],
+                        issue["component"],
+                        issue["project"],
+                        issue.get("textRange"),
+                    )
+                    for issue in issues
+                ],
+                store=SnippetStore(os.path.join(work_dir, "snippets_by_component")),
+                cache=SourceCache(os.path.join(work_dir, "sources")),
+            ),
+            trace_memory=trace_memory,
+        )
+
+        # the main.py pipeline, from the local clone of the repository to the snippets
+        def run_main_git_part():
+            try:
+                main_pipeline.run_git_part(
+                    {"sample_name": MAIN_SAMPLE, "github_address": repository_path}
+                )
+            finally:
+                os.chdir(current_dir)
+
+        metrics = StageMetrics(main_pipeline.STAGE_EVENTS_FILE)
+        run_stage(
+            results,
+            server,
+            "main_git_part",
+            run_main_git_part,
+            units=num_commits,
+            trace_memory=trace_memory,
+        )
+        report_summary(metrics)
+        wait_for_ce_queue(main_pipeline.get_sonar_client())
+
+        def extract_main_issues():
+            os.chdir(work_dir)
+            try:
+                main_pipeline.extract_issues(MAIN_SAMPLE)
+                issues_df = pd.read_csv(
+                    f"data/issues/{MAIN_SAMPLE}_issues.csv",
+                    usecols=["key", "component"],
+                )
+            finally:
+                os.chdir(current_dir)
+            return list(zip(issues_df["key"], issues_df["component"]))
+
+        main_issues = run_stage(
+            results,
+            server,
+            "main_extract_issues",
+            extract_main_issues,
+            trace_memory=trace_memory,
+        )
+
+        # like extract_code_snippets_parallel, the snippets are looked up by component
+        def extract_main_snippets():
+            os.chdir(work_dir)
+            try:
+                for issue_key, component in main_issues:
+                    main_pipeline.extract_code_snippets(issue_key, component)
+            finally:
+                os.chdir(current_dir)
+
+        run_stage(
+            results,
+            server,
+            "main_code_snippets",
+            extract_main_snippets,
+            trace_memory=trace_memory,
+        )
+    finally:
+        server.shutdown()
+        server.server_close()
+        # the mirror of the benchmark repository is kept with the other mirrors
+        shutil.rmtree(get_mirror_path(repository_path), ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pipeline stages against a local fake SonarQube"
+    )
+    parser.add_argument("--commits", type=int, default=NUM_COMMITS)
+    parser.add_argument("--fetch-repeats", type=int, default=FETCH_REPEATS)
+    parser.add_argument(
+        "--issues", type=int, default=200, help="open issues per analysis"
+    )
+    parser.add_argument("--churn", type=float, default=0.05)
+    parser.add_argument(
+        "--move-rate",
+        type=float,
+        default=0.1,
+        help="fraction of the open issues moved with the code by each analysis",
+    )
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--ce-latency", type=float, default=0.2)
+    parser.add_argument("--scan-time", type=float, default=0.0)
+    parser.add_argument("--issue-retrieval", choices=("full", "delta"), default="full")
+    parser.add_argument("--output", default=BENCHMARK_RESULTS_FILE)
+    parser.add_argument("--keep", action="store_true", help="keep the work folder")
+    parser.add_argument(
+        "--python-memory",
+        action="store_true",
+        help="also measure the Python allocation peak of each stage in a separate run",
+    )
+    args = parser.parse_args()
+
+    # the Python allocation peaks come from a second pass, so tracing them does not
+    # slow down the timed one
+    passes = [False, True] if args.python_memory else [False]
+    pass_results = []
+    for trace_memory in passes:
+        work_dir = tempfile.mkdtemp(prefix="sonarqube-benchmark-")
+        try:
+            pass_results.append(
+                run_benchmark(
+                    num_commits=args.commits,
+                    fetch_repeats=args.fetch_repeats,
+                    server_options={
+                        "latency": args.latency,
+                        "failure_rate": args.failure_rate,
+                        "issues_per_analysis": args.issues,
+                        "issue_churn": args.churn,
+                        "issue_move_rate": args.move_rate,
+                        "ce_latency": args.ce_latency,
+                    },
+                    scan_time=args.scan_time,
+                    work_dir=work_dir,
+                    issue_retrieval=args.issue_retrieval,
+                    trace_memory=trace_memory,
+                )
+            )
+        finally:
+            if not args.keep:
+                shutil.rmtree(work_dir, ignore_errors=True)
+    results = pass_results[0]
+    if args.python_memory:
+        python_peaks = {
+            result["stage"]: result["python_peak_mb"] for result in pass_results[1]
+        }
+        for result in results:
+            result["python_peak_mb"] = python_peaks.get(result["stage"])
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import subprocess
+
+RECORD_SEPARATOR = "\x1e"
+FIELD_SEPARATOR = "\x1f"
+# hash, parents, tree, author date and the short committer date the reports use
+LOG_FORMAT = (
+    f"{RECORD_SEPARATOR}%H{FIELD_SEPARATOR}%P{FIELD_SEPARATOR}%T"
+    f"{FIELD_SEPARATOR}%aI{FIELD_SEPARATOR}%cs"
+)
+
+
+# one commit of the history, without the pydriller Commit object overhead
+class CommitRecord:
+    __slots__ = ("hash", "parents", "tree", "author_date", "date", "changed_paths")
+
+    def __init__(self, hash, parents, tree, author_date, date, changed_paths):
+        self.hash = hash
+        self.parents = parents
+        self.tree = tree
+        self.author_date = author_date
+        self.date = date
+        self.changed_paths = changed_paths
+
+    def __repr__(self):
+        return f"CommitRecord({self.hash}, {self.date})"
+
+
+def parse_commit_record(header, paths):
+    commit_hash, parents, tree, author_date, date = header.split(FIELD_SEPARATOR)
+    return CommitRecord(
+        commit_hash,
+        tuple(parents.split()),
+        tree,
+        author_date,
+        date,
+        tuple(paths),
+    )
+
+
+# stream the history with a single git log, oldest commit first
+def iter_commit_log(repository_path=".", revisions=("--all",), changed_paths=True):
+    args = [
+        "git",
+        "-c",
+        "core.quotePath=false",
+        "log",
+        "--reverse",
+        f"--format={LOG_FORMAT}",
+        *revisions,
+    ]
+    if changed_paths:
+        # merges list no paths, like git log without -m
+        args.append("--name-only")
+    process = subprocess.Popen(
+        args, cwd=repository_path, stdout=subprocess.PIPE, text=True
+    )
+
+    header = None
+    paths = []
+    try:
+        for line in process.stdout:
+            line = line.rstrip("\n")
+            if line.startswith(RECORD_SEPARATOR):
+                if header is not None:
+                    yield parse_commit_record(header, paths)
+                header = line[1:]
+                paths = []
+            elif line:
+                paths.append(line)
+        if header is not None:
+            yield parse_commit_record(header, paths)
+    finally:
+        process.stdout.close()
+        process.wait()
@@ -0,0 +1,136 @@
+import datetime
+
+from repository_cache import run_git
+
+SAMPLE_EVERY_N = 10
+BISECT_CHECKPOINTS = 20
+
+
+# author timestamp of every commit of the repository, in one git call
+def get_commit_timestamps(repository_path):
+    result = run_git(["log", "--all", "--format=%H %at"], cwd=repository_path)
+    return {
+        commit_hash: int(timestamp)
+        for commit_hash, timestamp in (
+            line.split() for line in result.stdout.splitlines() if line
+        )
+    }
+
+
+def get_tagged_commits(repository_path):
+    result = run_git(
+        ["for-each-ref", "refs/tags", "--format=%(objectname) %(*objectname)"],
+        cwd=repository_path,
+    )
+    # annotated tags point to a tag object, the peeled commit comes second
+    return {line.split()[-1] for line in result.stdout.splitlines() if line}
+
+
+def get_first_parent_commits(repository_path, revision="HEAD"):
+    result = run_git(
+        ["rev-list", "--first-parent", "--reverse", revision], cwd=repository_path
+    )
+    return result.stdout.splitlines()
+
+
+def get_period(timestamp, period):
+    date = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).date()
+    if period == "week":
+        return date.isocalendar()[:2]
+    return date
+
+
+# every nth commit, always ending with the latest one
+def sample_every_nth(commits, every=SAMPLE_EVERY_N):
+    sampled = list(commits[::every])
+    if commits and sampled[-1] != commits[-1]:
+        sampled.append(commits[-1])
+    return sampled
+
+
+# the last commit of each day or week
+def sample_by_period(commits, timestamps, period="day"):
+    last_commits = {}
+    for commit_hash in commits:
+        if commit_hash in timestamps:
+            last_commits[get_period(timestamps[commit_hash], period)] = commit_hash
+    selected = set(last_commits.values())
+    return [commit_hash for commit_hash in commits if commit_hash in selected]
+
+
+# the commits to scan with a static strategy, in the order of commits
+def sample_commits(repository_path, commits, strategy="all", every=SAMPLE_EVERY_N):
+    if strategy == "all":
+        return list(commits)
+    if strategy == "nth":
+        sampled = sample_every_nth(commits, every)
+    elif strategy in ("day", "week"):
+        sampled = sample_by_period(
+            commits, get_commit_timestamps(repository_path), strategy
+        )
+    elif strategy == "tags":
+        tagged_commits = get_tagged_commits(repository_path)
+        sampled = [
+            commit_hash for commit_hash in commits if commit_hash in tagged_commits
+        ]
+    elif strategy == "first_parent":
+        first_parent_commits = set(get_first_parent_commits(repository_path))
+        sampled = [
+            commit_hash
+            for commit_hash in commits
+            if commit_hash in first_parent_commits
+        ]
+    else:
+        raise ValueError(f"Unknown commit sampling strategy: {strategy}")
+    print(f"Sampled {len(sampled)} of {len(commits)} commits with '{strategy}'")
+    return sampled
+
+
+# evenly spaced positions, always including the first and the latest commit
+def get_checkpoint_positions(num_commits, num_checkpoints=BISECT_CHECKPOINTS):
+    if num_commits <= num_checkpoints:
+        return list(range(num_commits))
+    return sorted(
+        {
+            round(index * (num_commits - 1) / (num_checkpoints - 1))
+            for index in range(num_checkpoints)
+        }
+    )
+
+
+# scan coarse checkpoints first, then bisect between neighbouring scanned commits
+# whose issue sets differ, until the commits that changed the issues are found
+def bisect_commits(
+    commits, analyze_commit, get_issue_keys, num_checkpoints=BISECT_CHECKPOINTS
+):
+    # issue keys of each scanned position, None when the scan failed
+    issue_keys = {}
+    positions = get_checkpoint_positions(len(commits), num_checkpoints)
+    round_number = 0
+    while positions:
+        round_number += 1
+        print(f"Bisection round {round_number}: scanning {len(positions)} commits")
+        for position in positions:
+            issue_keys[position] = (
+                get_issue_keys(commits[position])
+                if analyze_commit(position, commits[position])
+                else None
+            )
+
+        scanned = sorted(
+            position for position, keys in issue_keys.items() if keys is not None
+        )
+        positions = sorted(
+            {
+                (before + after) // 2
+                for before, after in zip(scanned, scanned[1:])
+                if after - before > 1 and issue_keys[before] != issue_keys[after]
+            }
+            - set(issue_keys)
+        )
+
+    scanned = sorted(
+        position for position, keys in issue_keys.items() if keys is not None
+    )
+    print(f"Bisection scanned {len(issue_keys)} of {len(commits)} commits")
+    return [commits[position] for position in scanned]
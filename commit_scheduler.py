@@ -0,0 +1,256 @@
+import heapq
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from repository_cache import create_working_copy, remove_working_copy
+from sonarqube_ce import get_ce_activity_status
+from stage_metrics import SUMMARY_INTERVAL, report_summary
+
+# stop submitting new commits while the CE queue has this many pending tasks
+MAX_CE_PENDING = 8
+CE_STATUS_INTERVAL = 2
+# working copies kept by each worker, the least recently used one is removed
+WORKING_COPIES_PER_WORKER = 4
+# times the task of a dead worker is queued again before it counts as failed
+MAX_TASK_RETRIES = 1
+
+
+# worker process: pulls (sample, commit) tasks from its own queue and analyzes them
+def run_worker(worker_id, task_queue, result_queue, analyze_task, workers_folder):
+    working_copies = OrderedDict()
+    worker_folder = os.path.join(workers_folder, f"worker-{worker_id}")
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+
+        key = task["sample"]
+        try:
+            if key not in working_copies:
+                work_path = os.path.join(worker_folder, task["repository_name"])
+                if not create_working_copy(task["mirror_path"], work_path):
+                    raise RuntimeError(f"Failed to create working copy {work_path}")
+                working_copies[key] = (task["mirror_path"], work_path)
+                if len(working_copies) > WORKING_COPIES_PER_WORKER:
+                    _, (mirror_path, old_path) = working_copies.popitem(last=False)
+                    remove_working_copy(mirror_path, old_path)
+            working_copies.move_to_end(key)
+
+            os.chdir(working_copies[key][1])
+            ok = analyze_task(task)
+        except Exception as e:
+            print(f"Worker {worker_id} failed on {key} {task['commit_hash']}: {e}")
+            ok = False
+        result_queue.put((worker_id, task["sample"], task["position"], ok))
+
+    os.chdir(workers_folder)
+    for mirror_path, work_path in working_copies.values():
+        remove_working_copy(mirror_path, work_path)
+
+
+# schedules the commits of every sample over a pool of workers
+class CommitScheduler:
+    def __init__(
+        self,
+        analyze_task,
+        workers_folder,
+        num_workers=None,
+        client=None,
+        max_ce_pending=MAX_CE_PENDING,
+        metrics=None,
+        prometheus_file=None,
+        summary_interval=SUMMARY_INTERVAL,
+    ):
+        self.analyze_task = analyze_task
+        self.workers_folder = workers_folder
+        self.num_workers = num_workers or os.cpu_count()
+        self.client = client
+        self.max_ce_pending = max_ce_pending
+        self.ce_pending = 0
+        self.ce_checked_at = 0
+        # commits waiting for the previous commit of their sample, by sample
+        self.pending = {}
+        # next commit of each sample that can run now, longest remaining sample first
+        self.ready = []
+        # StageMetrics reading the events of the workers, summarized every interval
+        self.metrics = metrics
+        self.prometheus_file = prometheus_file
+        self.summary_interval = summary_interval
+        self.summary_at = time.monotonic()
+        # times the task of each (sample, position) was lost with a dead worker
+        self.attempts = {}
+
+    # tasks must be in commit order, each one a dict with sample, position and commit_hash
+    def add_sample(self, sample, tasks):
+        if not tasks:
+            return
+        self.pending[sample] = deque(tasks)
+        self.push_next(sample)
+
+    def push_next(self, sample):
+        tasks = self.pending.get(sample)
+        if not tasks:
+            self.pending.pop(sample, None)
+            return
+        task = tasks.popleft()
+        heapq.heappush(self.ready, (-len(tasks), sample, task["position"], task))
+
+    # the server is saturated when its CE queue has too many pending tasks
+    def is_ce_saturated(self):
+        if self.client is None or not self.max_ce_pending:
+            return False
+        now = time.monotonic()
+        if now - self.ce_checked_at >= CE_STATUS_INTERVAL:
+            status = get_ce_activity_status(self.client)
+            self.ce_pending = status.get("pending", 0) if status else 0
+            self.ce_checked_at = now
+        return self.ce_pending >= self.max_ce_pending
+
+    def get_queue_depths(self, in_flight):
+        return {
+            "ready": len(self.ready),
+            "waiting": sum(len(tasks) for tasks in self.pending.values()),
+            "in_flight": in_flight,
+            "ce_pending": self.ce_pending,
+        }
+
+    def report_progress(self, in_flight, force=False):
+        if self.metrics is None:
+            return
+        now = time.monotonic()
+        if not force and now - self.summary_at < self.summary_interval:
+            return
+        self.summary_at = now
+        report_summary(
+            self.metrics, self.get_queue_depths(in_flight), self.prometheus_file
+        )
+
+    def start_worker(self, worker_id, result_queue):
+        task_queue = multiprocessing.Queue()
+        worker = multiprocessing.Process(
+            target=run_worker,
+            args=(
+                worker_id,
+                task_queue,
+                result_queue,
+                self.analyze_task,
+                self.workers_folder,
+            ),
+        )
+        worker.start()
+        return worker, task_queue
+
+    # restart the workers killed by the OOM killer or a crash, which never send their
+    # result, queue their task again and return the number of tasks given up
+    def restart_dead_workers(self, workers, idle, assigned, result_queue):
+        lost = 0
+        for worker_id, (worker, _) in list(workers.items()):
+            if worker.is_alive():
+                continue
+            print(f"Worker {worker_id} died with exit code {worker.exitcode}")
+            workers[worker_id] = self.start_worker(worker_id, result_queue)
+            if worker_id not in idle:
+                idle.append(worker_id)
+            task = assigned.pop(worker_id, None)
+            if task is None:
+                continue
+            key = (task["sample"], task["position"])
+            self.attempts[key] = self.attempts.get(key, 0) + 1
+            if self.attempts[key] <= MAX_TASK_RETRIES:
+                print(f"Requeuing {task['sample']} {task['commit_hash']}")
+                remaining = len(self.pending.get(task["sample"], ()))
+                heapq.heappush(
+                    self.ready, (-remaining, task["sample"], task["position"], task)
+                )
+            else:
+                print(f"Giving up {task['sample']} {task['commit_hash']}")
+                lost += 1
+                self.push_next(task["sample"])
+        return lost
+
+    def run(self):
+        os.makedirs(self.workers_folder, exist_ok=True)
+        total = sum(len(tasks) for tasks in self.pending.values()) + len(self.ready)
+        print(f"Scheduling {total} commits of {len(self.pending)} samples")
+        if self.metrics is not None:
+            self.metrics.total_commits = total
+
+        # every worker has its own task queue, so the task of a dead worker is known
+        result_queue = multiprocessing.Queue()
+        workers = {
+            worker_id: self.start_worker(worker_id, result_queue)
+            for worker_id in range(self.num_workers)
+        }
+        idle = list(workers)
+        assigned = {}
+
+        done = failed = 0
+        try:
+            while self.ready or assigned:
+                # only as many tasks as idle workers are queued, so backpressure applies right away
+                while self.ready and idle and not self.is_ce_saturated():
+                    _, _, _, task = heapq.heappop(self.ready)
+                    worker_id = idle.pop()
+                    workers[worker_id][1].put(task)
+                    assigned[worker_id] = task
+
+                self.report_progress(len(assigned))
+                lost = self.restart_dead_workers(workers, idle, assigned, result_queue)
+                done += lost
+                failed += lost
+                try:
+                    worker_id, sample, position, ok = result_queue.get(
+                        timeout=CE_STATUS_INTERVAL
+                    )
+                except queue.Empty:
+                    continue
+                task = assigned.get(worker_id)
+                # the late result of a task already given up with its dead worker
+                if task is None or (task["sample"], task["position"]) != (
+                    sample,
+                    position,
+                ):
+                    continue
+                del assigned[worker_id]
+                idle.append(worker_id)
+                done += 1
+                failed += not ok
+                self.push_next(sample)
+                if done % 100 == 0:
+                    print(
+                        f"Analyzed {done}/{total} commits, {failed} failed, "
+                        f"{len(assigned)} running, CE pending {self.ce_pending}"
+                    )
+        finally:
+            for _, task_queue in workers.values():
+                task_queue.put(None)
+            for worker, _ in workers.values():
+                worker.join()
+
+        self.report_progress(len(assigned), force=True)
+        print(f"Analyzed {done} commits, {failed} failed")
+        return done, failed
+
+
+# lets concurrent threads run a step strictly in sequence order
+class OrderedGate:
+    def __init__(self):
+        self.next_sequence = 0
+        self.condition = threading.Condition()
+
+    @contextmanager
+    def turn(self, sequence):
+        with self.condition:
+            self.condition.wait_for(lambda: self.next_sequence == sequence)
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.next_sequence += 1
+                self.condition.notify_all()
@@ -0,0 +1,130 @@
+from repository_cache import run_git
+
+# suffixes of the paths that can change the result of a scan, per scanned language
+LANGUAGE_EXTENSIONS = {
+    "csharp": (
+        ".cs",
+        ".csx",
+        ".vb",
+        ".razor",
+        ".cshtml",
+        ".csproj",
+        ".vbproj",
+        ".sln",
+        ".props",
+        ".targets",
+        "packages.config",
+        "nuget.config",
+        "global.json",
+    ),
+    "java": (
+        ".java",
+        ".kt",
+        ".kts",
+        ".scala",
+        ".groovy",
+        ".jsp",
+        "pom.xml",
+        ".gradle",
+    ),
+    "python": (".py", ".pyi", ".ipynb"),
+    "javascript": (
+        ".js",
+        ".jsx",
+        ".mjs",
+        ".cjs",
+        ".ts",
+        ".tsx",
+        ".vue",
+        ".html",
+        ".htm",
+        ".css",
+        ".scss",
+        ".less",
+    ),
+    "other": (
+        ".go",
+        ".rb",
+        ".php",
+        ".c",
+        ".cc",
+        ".cpp",
+        ".h",
+        ".hpp",
+        ".swift",
+        ".rs",
+        ".sql",
+        ".tf",
+        ".bicep",
+        "dockerfile",
+    ),
+}
+SOURCE_EXTENSIONS = tuple(
+    extension for extensions in LANGUAGE_EXTENSIONS.values() for extension in extensions
+)
+
+
+# tree hash of every commit of the repository, in one git call
+def get_tree_hashes(repository_path):
+    result = run_git(["log", "--all", "--format=%H %T"], cwd=repository_path)
+    return dict(line.split() for line in result.stdout.splitlines() if line)
+
+
+def get_changed_paths(repository_path, from_hash, to_hash):
+    result = run_git(
+        ["-c", "core.quotePath=false", "diff", "--name-only", from_hash, to_hash],
+        cwd=repository_path,
+    )
+    return result.stdout.splitlines()
+
+
+# the paths a commit of the log changed are its diff when its only parent was the last scan
+def get_changes_since(repository_path, from_hash, to_hash, records=None):
+    record = records.get(to_hash) if records is not None else None
+    if record is not None and record.parents == (from_hash,):
+        return record.changed_paths
+    return get_changed_paths(repository_path, from_hash, to_hash)
+
+
+def has_source_changes(paths, extensions=SOURCE_EXTENSIONS):
+    return any(path.lower().endswith(extensions) for path in paths)
+
+
+# map each commit that does not need a scan to the scanned commit it inherits the result of
+# records maps the hashes to their CommitRecord from the commit log when available
+def select_commits(
+    repository_path, commits, extensions=SOURCE_EXTENSIONS, records=None
+):
+    if records is not None:
+        tree_hashes = {
+            commit_hash: record.tree for commit_hash, record in records.items()
+        }
+    else:
+        tree_hashes = get_tree_hashes(repository_path)
+    # first commit scanned with each tree, a revert or a no-op merge reuses its result
+    analyzed_trees = {}
+    inherited_commits = {}
+    last_scanned = None
+
+    for commit_hash in commits:
+        tree_hash = tree_hashes.get(commit_hash)
+        if tree_hash in analyzed_trees:
+            inherited_commits[commit_hash] = analyzed_trees[tree_hash]
+            continue
+        if last_scanned is not None and not has_source_changes(
+            get_changes_since(repository_path, last_scanned, commit_hash, records),
+            extensions,
+        ):
+            inherited_commits[commit_hash] = last_scanned
+            if tree_hash:
+                analyzed_trees[tree_hash] = last_scanned
+            continue
+        last_scanned = commit_hash
+        if tree_hash:
+            analyzed_trees[tree_hash] = commit_hash
+
+    print(
+        f"{len(commits) - len(inherited_commits)} of {len(commits)} commits "
+        f"have source changes to scan"
+    )
+    return inherited_commits
@@ -0,0 +1,183 @@
+import glob
+import os
+import sqlite3
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+MERGE_CHUNK_SIZE = 50000
+# keys already merged and the input files merged so far, next to the dataset parts
+MERGE_INDEX_FILE = "_merge_index.sqlite"
+# SQLite limits the number of parameters of a query
+KEY_LOOKUP_BATCH = 500
+
+
+# on-disk index of the merged keys, the parts and the input files they come from
+class MergeIndex:
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS keys (key TEXT PRIMARY KEY, source TEXT)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS parts (path TEXT PRIMARY KEY, source TEXT)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime REAL)"
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def is_merged(self, file_path):
+        row = self.connection.execute(
+            "SELECT mtime FROM files WHERE path = ?", (os.path.abspath(file_path),)
+        ).fetchone()
+        return row is not None and row[0] >= os.path.getmtime(file_path)
+
+    # remove the parts and keys merged from a previous version of the file, so its
+    # current rows replace them
+    def remove_source(self, file_path):
+        source = os.path.abspath(file_path)
+        part_paths = [
+            row[0]
+            for row in self.connection.execute(
+                "SELECT path FROM parts WHERE source = ?", (source,)
+            )
+        ]
+        if not part_paths:
+            return 0
+        # the parts go first, a crash leaves keys that the next merge removes again
+        for part_path in part_paths:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+        with self.connection:
+            self.connection.execute("DELETE FROM parts WHERE source = ?", (source,))
+            self.connection.execute("DELETE FROM keys WHERE source = ?", (source,))
+        return len(part_paths)
+
+    def mark_merged(self, file_path):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO files (path, mtime) VALUES (?, ?)",
+            (os.path.abspath(file_path), os.path.getmtime(file_path)),
+        )
+        self.connection.commit()
+
+    def get_existing_keys(self, keys):
+        existing_keys = set()
+        for start in range(0, len(keys), KEY_LOOKUP_BATCH):
+            batch = keys[start : start + KEY_LOOKUP_BATCH]
+            existing_keys.update(
+                row[0]
+                for row in self.connection.execute(
+                    f"SELECT key FROM keys WHERE key IN ({', '.join('?' * len(batch))})",
+                    batch,
+                )
+            )
+        return existing_keys
+
+    # keys are only committed with the parts they were written to
+    def add_keys(self, keys, file_path):
+        source = os.path.abspath(file_path)
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO keys (key, source) VALUES (?, ?)",
+            ((key, source) for key in keys),
+        )
+
+    def add_part(self, part_path, file_path):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO parts (path, source) VALUES (?, ?)",
+            (part_path, os.path.abspath(file_path)),
+        )
+
+
+def iter_chunks(file_path, chunk_size=MERGE_CHUNK_SIZE):
+    if file_path.endswith(".parquet"):
+        for batch in pq.ParquetFile(file_path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+        return
+    # every column as text, so the parts of the dataset share their types
+    for chunk in pd.read_csv(file_path, chunksize=chunk_size, dtype=str):
+        yield chunk.drop(
+            columns=[column for column in chunk if column.startswith("Unnamed:")]
+        )
+
+
+def write_part(dataset_path, sample, frame):
+    partition_path = os.path.join(dataset_path, f"sample={sample}")
+    os.makedirs(partition_path, exist_ok=True)
+    file_name = f"part-{time.time_ns()}-{os.getpid()}.parquet"
+    tmp_path = os.path.join(partition_path, f".{file_name}.tmp")
+    pq.write_table(pa.Table.from_pandas(frame, preserve_index=False), tmp_path)
+    # rename so a crash never leaves a half written part in the dataset
+    part_path = os.path.join(partition_path, file_name)
+    os.replace(tmp_path, part_path)
+    return os.path.abspath(part_path)
+
+
+# stream the rows of the input files newer than their last merge into a parquet dataset
+# partitioned by the sample column; a file merged again replaces the rows of its previous
+# version, while a key already merged from another file keeps its first row
+def merge_exports(
+    file_paths, dataset_path, key_columns, sample_column, chunk_size=MERGE_CHUNK_SIZE
+):
+    index = MergeIndex(os.path.join(dataset_path, MERGE_INDEX_FILE))
+    merged_files = merged_rows = skipped_rows = replaced_parts = 0
+    try:
+        for file_path in file_paths:
+            if index.is_merged(file_path):
+                continue
+            replaced_parts += index.remove_source(file_path)
+            for chunk in iter_chunks(file_path, chunk_size):
+                chunk = chunk.dropna(subset=[*key_columns, sample_column])
+                keys = chunk[key_columns].astype(str).agg("|".join, axis=1)
+                # the first row of a key wins, also inside a chunk
+                is_new = ~keys.duplicated() & ~keys.isin(
+                    index.get_existing_keys(keys.unique().tolist())
+                )
+                skipped_rows += int((~is_new).sum())
+                chunk, keys = chunk[is_new], keys[is_new]
+                if chunk.empty:
+                    continue
+                for sample, frame in chunk.groupby(sample_column, sort=False):
+                    index.add_part(write_part(dataset_path, sample, frame), file_path)
+                index.add_keys(keys.tolist(), file_path)
+                index.connection.commit()
+                merged_rows += len(chunk)
+            index.mark_merged(file_path)
+            merged_files += 1
+    finally:
+        index.close()
+
+    print(
+        f"Merged {merged_rows} rows of {merged_files} files into {dataset_path}, "
+        f"{skipped_rows} duplicated rows skipped, "
+        f"{replaced_parts} parts of previous versions replaced"
+    )
+    return merged_rows
+
+
+def read_merged_dataset(dataset_path, samples=None, columns=None):
+    if samples is None:
+        part_files = glob.glob(os.path.join(dataset_path, "sample=*", "*.parquet"))
+    else:
+        part_files = [
+            part_file
+            for sample in samples
+            for part_file in glob.glob(
+                os.path.join(dataset_path, f"sample={sample}", "*.parquet")
+            )
+        ]
+    # parts of different inputs may have different columns
+    frames = [
+        pq.read_table(part_file, columns=columns).to_pandas()
+        for part_file in sorted(part_files)
+    ]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
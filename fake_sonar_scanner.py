@@ -0,0 +1,67 @@
+import os
+import sys
+import time
+
+import requests
+
+from sonarqube_ce import REPORT_TASK_FILE
+
+# seconds a fake scan takes, to stand in for the scanner CPU time
+SCAN_TIME = float(os.environ.get("FAKE_SCANNER_SCAN_TIME", "0"))
+# fraction of the scans that fail before submitting a report
+SCAN_FAILURE_RATE = float(os.environ.get("FAKE_SCANNER_FAILURE_RATE", "0"))
+
+
+# the -Dkey=value arguments of a sonar-scanner command line
+def parse_properties(args):
+    properties = {}
+    for arg in args:
+        if arg.startswith("-D") and "=" in arg:
+            key, value = arg[2:].split("=", 1)
+            properties[key] = value
+    return properties
+
+
+def get_failure_roll(properties):
+    # the same commit fails on every attempt, like a real broken build would
+    seed = properties.get("sonar.projectVersion", "")
+    return (sum(seed.encode()) % 1000) / 1000
+
+
+# submit an analysis to the fake server and write the report-task.txt a real scan leaves
+def run_scan(args, work_dir="."):
+    properties = parse_properties(args)
+    host_url = properties.get("sonar.host.url", "http://127.0.0.1:9000").rstrip("/")
+    project_key = properties["sonar.projectKey"]
+    time.sleep(SCAN_TIME)
+    if get_failure_roll(properties) < SCAN_FAILURE_RATE:
+        print("ERROR: Fake scanner failure")
+        return 1
+
+    response = requests.post(
+        f"{host_url}/api/ce/submit",
+        data={
+            "projectKey": project_key,
+            "projectVersion": properties.get("sonar.projectVersion", ""),
+            "projectDate": properties.get("sonar.projectDate", ""),
+        },
+        headers={"Authorization": f"Bearer {properties.get('sonar.token', '')}"},
+    )
+    if response.status_code != 200:
+        print(f"ERROR: Failed to submit the analysis: {response.text}")
+        return 1
+    task_id = response.json()["taskId"]
+
+    report_task_path = os.path.join(work_dir, REPORT_TASK_FILE)
+    os.makedirs(os.path.dirname(report_task_path), exist_ok=True)
+    with open(report_task_path, "w") as f:
+        f.write(f"projectKey={project_key}\n")
+        f.write(f"serverUrl={host_url}\n")
+        f.write(f"ceTaskId={task_id}\n")
+        f.write(f"ceTaskUrl={host_url}/api/ce/task?id={task_id}\n")
+    print("INFO: ANALYSIS SUCCESSFUL")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run_scan(sys.argv[1:]))
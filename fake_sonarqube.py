@@ -0,0 +1,595 @@
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# local stand-in for the SonarQube Web API endpoints used by the pipelines, for offline benchmarks
+FAKE_SONAR_HOST = "127.0.0.1"
+FAKE_SONAR_PORT = 9000
+# seconds added to every request, and the random part added on top of it
+REQUEST_LATENCY = 0.0
+REQUEST_JITTER = 0.0
+# fraction of the requests answered with a 503, retried by the client
+FAILURE_RATE = 0.0
+# seconds a submitted analysis stays in the CE queue, and the fraction that fails
+CE_LATENCY = 0.2
+CE_FAILURE_RATE = 0.0
+# open issues after each analysis, and the fraction of them fixed by the next one
+ISSUES_PER_ANALYSIS = 200
+ISSUE_CHURN = 0.05
+# fraction of the open issues that move with the code, SonarQube updates their line,
+# textRange and hash without bumping their updateDate
+ISSUE_MOVE_RATE = 0.1
+FILES_PER_PROJECT = 50
+LINES_PER_FILE = 200
+NUM_RULES = 40
+SEARCH_LIMIT = 10000
+MAX_PAGE_SIZE = 500
+
+SONAR_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
+SORT_DATE_FIELDS = {"CREATION_DATE": "creationDate", "UPDATE_DATE": "updateDate"}
+SEVERITIES = ("INFO", "MINOR", "MAJOR", "CRITICAL", "BLOCKER")
+SOFTWARE_QUALITIES = ("MAINTAINABILITY", "RELIABILITY", "SECURITY")
+ISSUE_TYPES = ("CODE_SMELL", "BUG", "VULNERABILITY")
+
+
+def format_sonar_date(value):
+    return value.strftime(SONAR_DATE_FORMAT)
+
+
+def parse_sonar_date(value):
+    # the + of the offset arrives as a space when it was not url encoded
+    return datetime.strptime(value.replace(" ", "+"), SONAR_DATE_FORMAT)
+
+
+# projects, tokens and CE tasks of the fake server, shared by the request threads
+class FakeSonarQubeState:
+    def __init__(
+        self,
+        issues_per_analysis=ISSUES_PER_ANALYSIS,
+        issue_churn=ISSUE_CHURN,
+        issue_move_rate=ISSUE_MOVE_RATE,
+        ce_latency=CE_LATENCY,
+        ce_failure_rate=CE_FAILURE_RATE,
+        seed=0,
+    ):
+        self.issues_per_analysis = issues_per_analysis
+        self.issue_churn = issue_churn
+        self.issue_move_rate = issue_move_rate
+        self.ce_latency = ce_latency
+        self.ce_failure_rate = ce_failure_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.projects = {}
+        self.tokens = {}
+        self.tasks = {}
+        self.task_queue = []
+        self.request_counts = {}
+
+    def count_request(self, endpoint):
+        with self.lock:
+            self.request_counts[endpoint] = self.request_counts.get(endpoint, 0) + 1
+
+    def get_project(self, project_key):
+        if project_key not in self.projects:
+            self.projects[project_key] = {
+                "key": project_key,
+                "analyses": [],
+                "issues": {},
+                "next_issue": 0,
+            }
+        return self.projects[project_key]
+
+    def create_project(self, project_key):
+        with self.lock:
+            if project_key in self.projects:
+                return False
+            self.get_project(project_key)
+            return True
+
+    def delete_project(self, project_key):
+        with self.lock:
+            return self.projects.pop(project_key, None) is not None
+
+    def generate_token(self, name):
+        with self.lock:
+            token = f"squ_{self.random.getrandbits(160):040x}"
+            self.tokens[name] = token
+            return token
+
+    def revoke_token(self, name):
+        with self.lock:
+            self.tokens.pop(name, None)
+
+    def submit_analysis(self, project_key, version, date):
+        # the scanner sends the commit day, the API answers with full timestamps
+        if date and len(date) == 10:
+            date = f"{date}T00:00:00+0000"
+        with self.lock:
+            task_id = f"AY{self.random.getrandbits(96):024x}"
+            self.tasks[task_id] = {
+                "id": task_id,
+                "type": "REPORT",
+                "componentKey": project_key,
+                "status": "PENDING",
+                "version": version,
+                "date": date,
+                "ready_at": time.monotonic() + self.ce_latency,
+                "failed": self.random.random() < self.ce_failure_rate,
+            }
+            self.task_queue.append(task_id)
+            return task_id
+
+    # complete the CE tasks that waited long enough, in submission order like the real queue
+    def process_tasks(self):
+        with self.lock:
+            now = time.monotonic()
+            while self.task_queue and self.tasks[self.task_queue[0]]["ready_at"] <= now:
+                task = self.tasks[self.task_queue.pop(0)]
+                if task["failed"]:
+                    task["status"] = "FAILED"
+                    continue
+                self.apply_analysis(task)
+                task["status"] = "SUCCESS"
+
+    def get_task(self, task_id):
+        with self.lock:
+            task = self.tasks.get(task_id)
+            if task is None:
+                return None
+            return {
+                key: value
+                for key, value in task.items()
+                if key not in ("ready_at", "failed", "date")
+            }
+
+    def get_pending_count(self):
+        with self.lock:
+            return len(self.task_queue)
+
+    # fix part of the open issues and open new ones, like a new commit would;
+    # the fixed issues stay searchable with the FIXED status
+    def apply_analysis(self, task):
+        project = self.get_project(task["componentKey"])
+        date = task["date"] or format_sonar_date(datetime.now(timezone.utc))
+        issues = project["issues"]
+        open_keys = sorted(
+            key for key, issue in issues.items() if issue["issueStatus"] == "OPEN"
+        )
+        fixed = self.random.sample(open_keys, int(len(open_keys) * self.issue_churn))
+        for key in fixed:
+            issues[key] = dict(
+                issues[key],
+                status="CLOSED",
+                issueStatus="FIXED",
+                resolution="FIXED",
+                updateDate=date,
+            )
+        surviving = sorted(set(open_keys) - set(fixed))
+        moved = self.random.sample(
+            surviving, int(len(surviving) * self.issue_move_rate)
+        )
+        for key in moved:
+            issues[key] = self.move_issue(issues[key])
+        for _ in range(self.issues_per_analysis - len(open_keys) + len(fixed)):
+            issue = self.create_issue(project, date)
+            issues[issue["key"]] = issue
+        project["analyses"].insert(
+            0,
+            {
+                "key": task["id"],
+                "date": date,
+                "projectVersion": task["version"],
+                "revision": task["version"],
+            },
+        )
+
+    def move_issue(self, issue):
+        start_line = self.random.randint(1, LINES_PER_FILE - 5)
+        text_range = issue["textRange"]
+        return dict(
+            issue,
+            line=start_line,
+            hash=f"{self.random.getrandbits(128):032x}",
+            textRange=dict(
+                text_range,
+                startLine=start_line,
+                endLine=start_line + text_range["endLine"] - text_range["startLine"],
+            ),
+        )
+
+    def create_issue(self, project, date):
+        number = project["next_issue"]
+        project["next_issue"] += 1
+        start_line = self.random.randint(1, LINES_PER_FILE - 5)
+        severity = self.random.choice(SEVERITIES)
+        return {
+            "key": f"{project['key']}-{number:08d}",
+            "rule": f"python:S{100 + self.random.randrange(NUM_RULES)}",
+            "severity": severity,
+            "component": f"{project['key']}:src/module_{self.random.randrange(FILES_PER_PROJECT)}.py",
+            "project": project["key"],
+            "line": start_line,
+            "hash": f"{self.random.getrandbits(128):032x}",
+            "textRange": {
+                "startLine": start_line,
+                "endLine": start_line + self.random.randint(0, 4),
+                "startOffset": 0,
+                "endOffset": 10,
+            },
+            "status": "OPEN",
+            "issueStatus": "OPEN",
+            "message": "Fake issue",
+            "effort": "5min",
+            "debt": "5min",
+            "author": "fake@example.com",
+            "tags": [],
+            "creationDate": date,
+            "updateDate": date,
+            "type": self.random.choice(ISSUE_TYPES),
+            "cleanCodeAttribute": "CONVENTIONAL",
+            "cleanCodeAttributeCategory": "CONSISTENT",
+            "impacts": [
+                {
+                    "softwareQuality": self.random.choice(SOFTWARE_QUALITIES),
+                    "severity": "MEDIUM",
+                }
+            ],
+        }
+
+    def search_issues(self, params):
+        project_key = params.get("componentKeys") or params.get("components")
+        with self.lock:
+            issues = list(self.get_project(project_key)["issues"].values())
+
+        for field, values in (
+            ("severity", params.get("severities")),
+            ("rule", params.get("rules")),
+        ):
+            if values:
+                allowed = set(values.split(","))
+                issues = [issue for issue in issues if issue[field] in allowed]
+        if params.get("impactSoftwareQualities"):
+            allowed = set(params["impactSoftwareQualities"].split(","))
+            issues = [
+                issue
+                for issue in issues
+                if any(
+                    impact["softwareQuality"] in allowed for impact in issue["impacts"]
+                )
+            ]
+        if params.get("createdAfter"):
+            created_after = parse_sonar_date(params["createdAfter"])
+            issues = [
+                issue
+                for issue in issues
+                if parse_sonar_date(issue["creationDate"]) >= created_after
+            ]
+        if params.get("createdBefore"):
+            created_before = parse_sonar_date(params["createdBefore"])
+            issues = [
+                issue
+                for issue in issues
+                if parse_sonar_date(issue["creationDate"]) < created_before
+            ]
+        if params.get("issueStatuses"):
+            allowed = set(params["issueStatuses"].split(","))
+            issues = [issue for issue in issues if issue["issueStatus"] in allowed]
+        date_field = SORT_DATE_FIELDS.get(params.get("s"))
+        if date_field:
+            issues.sort(
+                key=lambda issue: parse_sonar_date(issue[date_field]),
+                reverse=params.get("asc") == "false",
+            )
+        return issues
+
+    def get_facets(self, issues, facets):
+        facet_fields = {
+            "severities": lambda issue: [issue["severity"]],
+            "rules": lambda issue: [issue["rule"]],
+            "types": lambda issue: [issue["type"]],
+            "impactSoftwareQualities": lambda issue: [
+                impact["softwareQuality"] for impact in issue["impacts"]
+            ],
+        }
+        result = []
+        for facet in facets:
+            counts = {}
+            for issue in issues:
+                for value in facet_fields.get(facet, lambda issue: [])(issue):
+                    counts[value] = counts.get(value, 0) + 1
+            result.append(
+                {
+                    "property": facet,
+                    "values": [
+                        {"val": value, "count": count}
+                        for value, count in sorted(
+                            counts.items(), key=lambda item: -item[1]
+                        )
+                    ],
+                }
+            )
+        return result
+
+    def get_component(self, component_key):
+        project_key = component_key.split(":", 1)[0]
+        return {
+            "key": component_key,
+            "project": project_key,
+            "path": component_key.split(":", 1)[-1],
+            "qualifier": "FIL",
+        }
+
+    def get_source_lines(self, component_key, start=1, end=LINES_PER_FILE):
+        with self.lock:
+            analyses = self.get_project(component_key.split(":", 1)[0])["analyses"]
+        revision = analyses[0]["revision"] if analyses else ""
+        return [
+            {
+                "line": line,
+                "code": f"value_{line} = {line}  # {component_key}",
+                "scmRevision": revision,
+                "scmAuthor": "fake@example.com",
+                "scmDate": "2024-01-01T00:00:00+0000",
+                "duplicated": False,
+                "isNew": False,
+            }
+            for line in range(max(1, start), min(LINES_PER_FILE, end) + 1)
+        ]
+
+    def find_issue(self, issue_key):
+        project_key = issue_key.rsplit("-", 1)[0]
+        with self.lock:
+            return self.get_project(project_key)["issues"].get(issue_key)
+
+
+class FakeSonarQubeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_empty(self, status=204):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def get_params(self):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if self.command == "POST":
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length).decode() if length else ""
+            params.update({key: values[-1] for key, values in parse_qs(body).items()})
+        return url.path.strip("/"), params
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_POST(self):
+        self.handle_request()
+
+    def handle_request(self):
+        server = self.server
+        endpoint, params = self.get_params()
+        state = server.state
+        state.count_request(endpoint)
+        if server.latency or server.jitter:
+            time.sleep(server.latency + random.uniform(0, server.jitter))
+        if server.failure_rate and random.random() < server.failure_rate:
+            self.send_json({"errors": [{"msg": "Fake failure"}]}, status=503)
+            return
+
+        state.process_tasks()
+        handler = ENDPOINTS.get(endpoint)
+        if handler is None:
+            self.send_json({"errors": [{"msg": f"Unknown url: {endpoint}"}]}, 404)
+            return
+        handler(self, state, params)
+
+
+def handle_project_create(handler, state, params):
+    project_key = params.get("project")
+    if not state.create_project(project_key):
+        handler.send_json(
+            {
+                "errors": [
+                    {
+                        "msg": f'Could not create Project with key: "{project_key}". A similar key already exists: "{project_key}"'
+                    }
+                ]
+            },
+            status=400,
+        )
+        return
+    handler.send_json(
+        {"project": {"key": project_key, "name": params.get("name", project_key)}}
+    )
+
+
+def handle_project_delete(handler, state, params):
+    project_key = params.get("project")
+    if not state.delete_project(project_key):
+        handler.send_json(
+            {"errors": [{"msg": f"Project '{project_key}' not found"}]}, status=404
+        )
+        return
+    handler.send_empty()
+
+
+def handle_tokens_search(handler, state, params):
+    with state.lock:
+        names = list(state.tokens)
+    handler.send_json({"userTokens": [{"name": name} for name in names]})
+
+
+def handle_tokens_generate(handler, state, params):
+    name = params.get("name", "token")
+    handler.send_json({"name": name, "token": state.generate_token(name)})
+
+
+def handle_tokens_revoke(handler, state, params):
+    state.revoke_token(params.get("name"))
+    handler.send_empty()
+
+
+def handle_issues_search(handler, state, params):
+    page = int(params.get("p", 1))
+    page_size = min(int(params.get("ps", 100)), MAX_PAGE_SIZE)
+    if page * page_size > SEARCH_LIMIT:
+        handler.send_json(
+            {
+                "errors": [
+                    {
+                        "msg": f"Can return only the first {SEARCH_LIMIT} results. "
+                        f"{page * page_size}th result asked."
+                    }
+                ]
+            },
+            status=400,
+        )
+        return
+    issues = state.search_issues(params)
+    facets = [facet for facet in params.get("facets", "").split(",") if facet]
+    handler.send_json(
+        {
+            "total": len(issues),
+            "p": page,
+            "ps": page_size,
+            "paging": {"pageIndex": page, "pageSize": page_size, "total": len(issues)},
+            "issues": issues[(page - 1) * page_size : page * page_size],
+            "components": [],
+            "facets": state.get_facets(issues, facets),
+        }
+    )
+
+
+def handle_issue_snippets(handler, state, params):
+    issue = state.find_issue(params.get("issueKey"))
+    if issue is None:
+        handler.send_json({"errors": [{"msg": "Issue not found"}]}, status=404)
+        return
+    text_range = issue["textRange"]
+    handler.send_json(
+        {
+            issue["component"]: {
+                "component": state.get_component(issue["component"]),
+                "sources": state.get_source_lines(
+                    issue["component"],
+                    text_range["startLine"] - 5,
+                    text_range["endLine"] + 5,
+                ),
+            }
+        }
+    )
+
+
+def handle_source_lines(handler, state, params):
+    handler.send_json(
+        {
+            "sources": state.get_source_lines(
+                params.get("key"),
+                int(params.get("from", 1)),
+                int(params.get("to", LINES_PER_FILE)),
+            )
+        }
+    )
+
+
+def handle_project_analyses(handler, state, params):
+    with state.lock:
+        analyses = list(state.get_project(params.get("project"))["analyses"])
+    page_size = int(params.get("ps", 100))
+    handler.send_json(
+        {
+            "paging": {"pageIndex": 1, "pageSize": page_size, "total": len(analyses)},
+            "analyses": analyses[:page_size],
+        }
+    )
+
+
+def handle_ce_submit(handler, state, params):
+    task_id = state.submit_analysis(
+        params.get("projectKey"),
+        params.get("projectVersion"),
+        params.get("projectDate"),
+    )
+    handler.send_json({"taskId": task_id, "projectId": params.get("projectKey")})
+
+
+def handle_ce_task(handler, state, params):
+    task = state.get_task(params.get("id"))
+    if task is None:
+        handler.send_json({"errors": [{"msg": "No activity found"}]}, status=404)
+        return
+    handler.send_json({"task": task})
+
+
+def handle_ce_activity_status(handler, state, params):
+    handler.send_json(
+        {"pending": state.get_pending_count(), "inProgress": 0, "failing": 0}
+    )
+
+
+ENDPOINTS = {
+    "api/projects/create": handle_project_create,
+    "api/projects/delete": handle_project_delete,
+    "api/user_tokens/search": handle_tokens_search,
+    "api/user_tokens/generate": handle_tokens_generate,
+    "api/user_tokens/revoke": handle_tokens_revoke,
+    "api/issues/search": handle_issues_search,
+    "api/sources/issue_snippets": handle_issue_snippets,
+    "api/sources/lines": handle_source_lines,
+    "api/project_analyses/search": handle_project_analyses,
+    "api/ce/submit": handle_ce_submit,
+    "api/ce/task": handle_ce_task,
+    "api/ce/activity_status": handle_ce_activity_status,
+}
+
+
+class FakeSonarQubeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        host=FAKE_SONAR_HOST,
+        port=FAKE_SONAR_PORT,
+        latency=REQUEST_LATENCY,
+        jitter=REQUEST_JITTER,
+        failure_rate=FAILURE_RATE,
+        **state_options,
+    ):
+        super().__init__((host, port), FakeSonarQubeHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.state = FakeSonarQubeState(**state_options)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+# start a fake server in a background thread, port 0 picks a free port
+def start_fake_server(host=FAKE_SONAR_HOST, port=0, **options):
+    server = FakeSonarQubeServer(host, port, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    server = FakeSonarQubeServer()
+    print(f"Fake SonarQube listening on {server.url}")
+    server.serve_forever()
@@ -0,0 +1,115 @@
+import json
+import os
+import sqlite3
+
+ISSUE_STATE_FILE = "issue_state.sqlite"
+# how an issue changed between two consecutive analyses of a sample
+CHANGE_TYPES = ("opened", "fixed", "reopened", "changed")
+CLOSED_STATUSES = ("FIXED", "CLOSED")
+# fields added by the store, not part of the issue returned by SonarQube
+STORE_FIELDS = ("sample", "commit_hash", "change")
+
+
+def is_closed(issue):
+    return (
+        issue.get("issueStatus") in CLOSED_STATUSES
+        or issue.get("status") in CLOSED_STATUSES
+    )
+
+
+def get_issue_fields(issue):
+    return {key: value for key, value in issue.items() if key not in STORE_FIELDS}
+
+
+# classify the issues changed since the previous analysis against their previous state,
+# an issue returned unchanged is not a change; SonarQube only bumps the updateDate of an
+# issue on functional changes (status, severity, type, assignee...), so an issue whose
+# line, textRange, hash, message or effort moved with the code is not returned and keeps
+# its previous location until the next full snapshot
+def diff_issues(previous_issues, changed_issues):
+    changes = []
+    for issue in changed_issues:
+        previous = previous_issues.get(issue["key"])
+        if previous is None:
+            change = "fixed" if is_closed(issue) else "opened"
+        elif is_closed(issue) != is_closed(previous):
+            change = "fixed" if is_closed(issue) else "reopened"
+        elif get_issue_fields(previous) != get_issue_fields(issue):
+            change = "changed"
+        else:
+            continue
+        changes.append(dict(issue, change=change))
+    return changes
+
+
+# latest issues of every sample, so a delta is classified without reading the history
+class IssueStateIndex:
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS issues ("
+            "sample TEXT, key TEXT, issue TEXT, PRIMARY KEY (sample, key))"
+        )
+        # state_of is the scanned commit whose issues the last commit of the sample holds,
+        # deltas the number of commits recorded as deltas since the last full snapshot
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS samples ("
+            "sample TEXT PRIMARY KEY, last_commit TEXT, state_of TEXT, deltas INTEGER)"
+        )
+        # state files created before a column was added
+        columns = {
+            row[1] for row in self.connection.execute("PRAGMA table_info(samples)")
+        }
+        if "deltas" not in columns:
+            self.connection.execute("ALTER TABLE samples ADD COLUMN deltas INTEGER")
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def get_sample_state(self, sample):
+        row = self.connection.execute(
+            "SELECT last_commit, state_of, deltas FROM samples WHERE sample = ?",
+            (sample,),
+        ).fetchone()
+        if row is None:
+            return None
+        return {"last_commit": row[0], "state_of": row[1], "deltas": row[2] or 0}
+
+    def get_issues(self, sample, keys):
+        issues = {}
+        keys = list(keys)
+        # SQLite limits the number of parameters of a query
+        for start in range(0, len(keys), 500):
+            batch = keys[start : start + 500]
+            for key, issue in self.connection.execute(
+                f"SELECT key, issue FROM issues WHERE sample = ? "
+                f"AND key IN ({', '.join('?' * len(batch))})",
+                [sample, *batch],
+            ):
+                issues[key] = json.loads(issue)
+        return issues
+
+    # record the commit, replacing every issue of the sample when issues is a full snapshot
+    def update(self, sample, commit_hash, state_of, issues=(), full=False):
+        sample_state = self.get_sample_state(sample)
+        deltas = 0 if full or sample_state is None else sample_state["deltas"] + 1
+        with self.connection:
+            if full:
+                self.connection.execute(
+                    "DELETE FROM issues WHERE sample = ?", (sample,)
+                )
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO issues (sample, key, issue) VALUES (?, ?, ?)",
+                (
+                    (sample, issue["key"], json.dumps(get_issue_fields(issue)))
+                    for issue in issues
+                ),
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO samples (sample, last_commit, state_of, deltas) "
+                "VALUES (?, ?, ?, ?)",
+                (sample, commit_hash, state_of, deltas),
+            )
@@ -0,0 +1,373 @@
+import json
+import os
+from functools import lru_cache, partial
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+LIFECYCLE_STATE_FILE = "data/report/lifecycle_state.json"
+
+LIFECYCLE_COLUMNS = [
+    "sample",
+    "open_date",
+    "open_hash",
+    "closed_date",
+    "closed_hash",
+    "latest_open",
+    "latest_open_hash",
+    "next_commit_date",
+    "next_commit_hash",
+    "fix_duration",
+]
+# issue fields copied from the first snapshot the issue appears in
+ISSUE_FIELDS = {
+    "severity": "severity",
+    "rule": "rule",
+    "flows": "flows",
+    "message": "message",
+    "effort": "effort",
+    "debt": "debt",
+    "author": "author",
+    "tags": "tags",
+    "transitions": "transitions",
+    "actions": "actions",
+    "comments": "comments",
+    "impacts": "impacts",
+    "type": "type",
+    "quick_fix_available": "quickFixAvailable",
+    "clean_code_attribute": "cleanCodeAttribute",
+    "clean_code_attributeCategory": "cleanCodeAttributeCategory",
+}
+
+
+@lru_cache(maxsize=4096)
+def parse_date(value):
+    return pd.to_datetime(value)
+
+
+def get_days_between(start, end):
+    return (parse_date(end) - parse_date(start)).days
+
+
+# consumes commit snapshots in commit order and keeps the lifecycle of every issue
+class IssueLifecycle:
+    def __init__(self):
+        self.issues = {}
+        # (sample, hash) -> position of the commit in its sample
+        self.commit_positions = {}
+        # issues whose latest open commit is the last commit seen in the sample
+        self.awaiting_next = {}
+        self.last_commit = {}
+        self.commit_counts = {}
+        # where the next commit of each sample starts in the store, and the issues of the
+        # last commit consumed, which a delta commit after it is applied to
+        self.positions = {}
+        self.last_issues = {}
+
+    def is_processed(self, sample, commit_hash):
+        return (sample, commit_hash) in self.commit_positions
+
+    def process_commit(self, sample, commit_hash, commit_date, issues):
+        if self.is_processed(sample, commit_hash):
+            return False
+        position = self.commit_counts.get(sample, 0)
+        self.commit_positions[(sample, commit_hash)] = position
+        self.commit_counts[sample] = position + 1
+
+        # this commit is the next commit of the issues left open in the previous one
+        for issue_key in self.awaiting_next.pop(sample, ()):
+            state = self.issues[issue_key]
+            fix_duration = get_days_between(state["open_date"], commit_date)
+            if fix_duration < 0:
+                continue
+            state["next_commit_hash"] = commit_hash
+            state["next_commit_date"] = commit_date
+            state["fix_duration"] = fix_duration
+
+        awaiting_next = set()
+        for issue in issues:
+            issue_key = issue["key"]
+            state = self.issues.get(issue_key)
+            if state is None:
+                # presume q a primeira aparicao a issue estara aberta
+                self.issues[issue_key] = self.get_initial_state(
+                    sample, commit_hash, commit_date, issue
+                )
+            elif issue["issueStatus"] == "FIXED" and state["closed_date"] == "":
+                state["closed_date"] = commit_date
+                state["closed_hash"] = commit_hash
+            elif issue["issueStatus"] == "OPEN":
+                state["latest_open"] = commit_date
+                state["latest_open_hash"] = commit_hash
+                state["next_commit_date"] = ""
+                state["next_commit_hash"] = ""
+                state["fix_duration"] = ""
+                awaiting_next.add(issue_key)
+
+        self.awaiting_next[sample] = awaiting_next
+        self.last_commit[sample] = commit_hash
+        return True
+
+    def get_initial_state(self, sample, commit_hash, commit_date, issue):
+        state = {
+            "sample": sample,
+            "open_date": commit_date,
+            "open_hash": commit_hash,
+            "closed_date": "",
+            "closed_hash": "",
+            "latest_open": "",
+            "latest_open_hash": "",
+            "next_commit_date": "",
+            "next_commit_hash": "",
+            "fix_duration": "",
+        }
+        for column, field in ISSUE_FIELDS.items():
+            state[column] = issue.get(field)
+        return state
+
+    # snapshots are (commit row, issues) pairs, as yielded by IssueStore.iter_snapshots
+    def consume(self, snapshots):
+        processed = 0
+        for commit, issues in snapshots:
+            processed += self.process_commit(
+                commit["sample"], commit["commit_hash"], commit["date"], issues
+            )
+        return processed
+
+    # consume the commits appended to the store since the saved positions, the commits
+    # consumed by a previous run are not read again
+    def consume_store(self, store):
+        processed = 0
+        for sample in store.get_samples():
+            for commit, issues, position in store.iter_sample_snapshots(
+                sample, self.positions.get(sample)
+            ):
+                processed += self.process_commit(
+                    sample, commit["commit_hash"], commit["date"], issues
+                )
+                self.positions[sample] = position
+                self.last_issues[sample] = issues
+        return processed
+
+    def to_frame(self):
+        if not self.issues:
+            return pd.DataFrame(
+                columns=["key"] + LIFECYCLE_COLUMNS + list(ISSUE_FIELDS)
+            )
+        return (
+            pd.DataFrame.from_dict(self.issues, orient="index")
+            .reset_index()
+            .rename(columns={"index": "key"})
+        )
+
+    def save(self, state_file=LIFECYCLE_STATE_FILE):
+        os.makedirs(os.path.dirname(state_file) or ".", exist_ok=True)
+        state = {
+            "issues": self.issues,
+            "commit_positions": [
+                [sample, commit_hash, position]
+                for (sample, commit_hash), position in self.commit_positions.items()
+            ],
+            "awaiting_next": {
+                sample: sorted(issue_keys)
+                for sample, issue_keys in self.awaiting_next.items()
+            },
+            "last_commit": self.last_commit,
+            "positions": {
+                sample: dict(
+                    position,
+                    issues=(
+                        [
+                            {"key": issue["key"], "issueStatus": issue["issueStatus"]}
+                            for issue in self.last_issues[sample]
+                        ]
+                        if sample in self.last_issues
+                        else position.get("issues", [])
+                    ),
+                )
+                for sample, position in self.positions.items()
+            },
+        }
+        tmp_file = f"{state_file}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(state, f, default=str)
+        os.replace(tmp_file, state_file)
+
+    @classmethod
+    def load(cls, state_file=LIFECYCLE_STATE_FILE):
+        lifecycle = cls()
+        if not os.path.exists(state_file):
+            return lifecycle
+        with open(state_file, "r") as f:
+            state = json.load(f)
+        lifecycle.issues = state["issues"]
+        lifecycle.commit_positions = {
+            (sample, commit_hash): position
+            for sample, commit_hash, position in state["commit_positions"]
+        }
+        lifecycle.awaiting_next = {
+            sample: set(issue_keys)
+            for sample, issue_keys in state["awaiting_next"].items()
+        }
+        lifecycle.last_commit = state["last_commit"]
+        # state files saved before the positions were read the whole store once
+        lifecycle.positions = state.get("positions", {})
+        for sample, _ in lifecycle.commit_positions:
+            lifecycle.commit_counts[sample] = lifecycle.commit_counts.get(sample, 0) + 1
+        return lifecycle
+
+
+# values of a commits column at the given commit rows, "" where the row is -1
+def take_commit_values(commits, column, rows):
+    values = commits[column].values.take(np.maximum(rows, 0))
+    return np.where(rows >= 0, values, "")
+
+
+# (sample, hash) category codes as one code, -1 when either is missing
+def get_pair_codes(sample_codes, hash_codes, num_hashes):
+    pair_codes = sample_codes.astype(np.int64) * num_hashes + hash_codes
+    pair_codes[(sample_codes < 0) | (hash_codes < 0)] = -1
+    return pair_codes
+
+
+# row of each key code in rows, -1 for the keys not in codes, the first or last row of a
+# repeated key
+def get_key_rows(num_keys, codes, rows, keep):
+    key_rows = np.full(num_keys, -1, dtype=np.int64)
+    if keep == "first":
+        codes, rows = codes[::-1], rows[::-1]
+    # the last assignment of a repeated index wins
+    key_rows[codes] = rows
+    return key_rows
+
+
+# vectorized lifecycle of the (sample, commit, issue key, status) snapshots, same columns as
+# IssueLifecycle; the snapshots are joined to their commits on category codes rather than
+# merged, and the issue fields come from first_issues_df, indexed by key, when given
+def compute_lifecycle_frame(commits_df, issues_df, first_issues_df=None):
+    if commits_df.empty or issues_df.empty:
+        return IssueLifecycle().to_frame()
+
+    commits = commits_df[["sample", "commit_hash", "date"]].reset_index(drop=True)
+    grouped = commits.groupby("sample", sort=False)
+    commits["next_commit_hash"] = grouped["commit_hash"].shift(-1)
+    commits["next_commit_date"] = grouped["date"].shift(-1)
+
+    snapshots = {
+        column: pd.Categorical(issues_df[column])
+        for column in ("sample", "commit_hash", "key", "issueStatus")
+    }
+    # commit row of each snapshot row, joined on the (sample, hash) category codes
+    sample_categories = snapshots["sample"].categories
+    hash_categories = snapshots["commit_hash"].categories
+    commit_pairs = get_pair_codes(
+        pd.Categorical(commits["sample"], categories=sample_categories).codes,
+        pd.Categorical(commits["commit_hash"], categories=hash_categories).codes,
+        len(hash_categories),
+    )
+    # the commits without snapshots get distinct codes below -1, so none is matched
+    commit_pairs = np.where(
+        commit_pairs >= 0, commit_pairs, -2 - np.arange(len(commit_pairs))
+    )
+    commit_rows = pd.Index(commit_pairs).get_indexer(
+        get_pair_codes(
+            snapshots["sample"].codes,
+            snapshots["commit_hash"].codes,
+            len(hash_categories),
+        )
+    )
+    # snapshot rows by sample and commit order, in store order within a commit
+    sample_ranks = pd.factorize(commits["sample"], sort=True)[0]
+    selected = np.flatnonzero(commit_rows >= 0)
+    selected = selected[
+        np.lexsort((commit_rows[selected], sample_ranks[commit_rows[selected]]))
+    ]
+    rows = commit_rows[selected]
+    key_codes = snapshots["key"].codes[selected]
+    statuses = snapshots["issueStatus"].codes[selected]
+    status_categories = snapshots["issueStatus"].categories
+
+    repeated = pd.Series(key_codes).duplicated().values
+    num_keys = len(snapshots["key"].categories)
+
+    def get_status_rows(status, keep):
+        if status not in status_categories:
+            return np.full(num_keys, -1, dtype=np.int64)
+        later = repeated & (statuses == status_categories.get_loc(status))
+        return get_key_rows(num_keys, key_codes[later], rows[later], keep)
+
+    opened_codes = key_codes[~repeated]
+    opened_rows = rows[~repeated]
+    closed_rows = get_status_rows("FIXED", "first")[opened_codes]
+    latest_open_rows = get_status_rows("OPEN", "last")[opened_codes]
+
+    lifecycle_df = pd.DataFrame(
+        {
+            "key": snapshots["key"].categories.values.take(opened_codes),
+            "sample": commits["sample"].values.take(opened_rows),
+            "open_date": commits["date"].values.take(opened_rows),
+            "open_hash": commits["commit_hash"].values.take(opened_rows),
+            "closed_date": take_commit_values(commits, "date", closed_rows),
+            "closed_hash": take_commit_values(commits, "commit_hash", closed_rows),
+            "latest_open": take_commit_values(commits, "date", latest_open_rows),
+            "latest_open_hash": take_commit_values(
+                commits, "commit_hash", latest_open_rows
+            ),
+        }
+    )
+    keys = lifecycle_df["key"]
+
+    next_commit_date = pd.Series(
+        commits["next_commit_date"].values.take(np.maximum(latest_open_rows, 0))
+    ).where(latest_open_rows >= 0)
+    next_commit_hash = pd.Series(
+        commits["next_commit_hash"].values.take(np.maximum(latest_open_rows, 0))
+    ).where(latest_open_rows >= 0)
+    fix_duration = (
+        pd.to_datetime(next_commit_date) - pd.to_datetime(lifecycle_df["open_date"])
+    ).dt.days
+    # a next commit dated before the issue was opened is not a valid fix
+    valid = next_commit_hash.notna() & (fix_duration >= 0)
+    lifecycle_df["next_commit_date"] = next_commit_date.where(valid, "")
+    lifecycle_df["next_commit_hash"] = next_commit_hash.where(valid, "")
+    lifecycle_df["fix_duration"] = (
+        fix_duration.where(valid).astype("Int64").astype(object).where(valid, "")
+    )
+
+    for column, field in ISSUE_FIELDS.items():
+        if first_issues_df is not None:
+            lifecycle_df[column] = first_issues_df[field].reindex(keys).values
+        elif field in issues_df:
+            lifecycle_df[column] = issues_df[field].values.take(selected[~repeated])
+        else:
+            lifecycle_df[column] = [None] * len(lifecycle_df)
+    return lifecycle_df
+
+
+def compute_sample_lifecycle(store_path, sample):
+    # imported here so the workers only load their own sample partitions
+    from issue_store import IssueStore
+
+    store = IssueStore(store_path)
+    # only the status of each issue row, the fields are only read from its first commit
+    issues_df, first_issues_df = store.load_issue_columns(
+        [sample],
+        ["sample", "commit_hash", "key", "issueStatus"],
+        list(ISSUE_FIELDS.values()),
+    )
+    return compute_lifecycle_frame(
+        store.load_commits([sample]), issues_df, first_issues_df
+    )
+
+
+# samples are independent, so each one is computed in its own process
+def compute_lifecycle_parallel(store, processes=None):
+    samples = store.get_samples()
+    if not samples:
+        return IssueLifecycle().to_frame()
+    with Pool(processes=processes or os.cpu_count()) as pool:
+        frames = pool.map(partial(compute_sample_lifecycle, store.path), samples)
+    lifecycle_df = pd.concat(frames, ignore_index=True)
+    # an issue key seen in more than one sample belongs to the first sample
+    return lifecycle_df.drop_duplicates("key", keep="first").reset_index(drop=True)
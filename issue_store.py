@@ -0,0 +1,548 @@
+import ast
+import csv
+import glob
+import json
+import os
+import shutil
+import sys
+from array import array
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from issue_deltas import CHANGE_TYPES, get_issue_fields
+
+ISSUE_STORE_PATH = "data/report"
+COMMITS_TABLE = "commits"
+ISSUES_TABLE = "issues"
+SHARDS_FOLDER = "shards"
+# samples whose last written snapshot is kept in memory for the commits inheriting it
+CACHED_SNAPSHOTS = 8
+# longest JSON of a nested issue value shared between the issues loaded by column
+CANONICAL_JSON_LIMIT = 256
+
+
+# append-only commits and issues tables in JSONL, partitioned by sample
+# a sharded store writes each commit to its own shard until merge_shards is called
+class IssueStore:
+    def __init__(self, path=ISSUE_STORE_PATH, sharded=False):
+        self.path = path
+        self.sharded = sharded
+        # (commit hash, issues) of the last full snapshot written for each sample
+        self.last_snapshots = OrderedDict()
+        # commit rows and issue group byte ranges of each sample partition read so far
+        self.partition_indexes = {}
+
+    def get_partition_path(self, table, sample):
+        return os.path.join(self.path, table, f"sample={sample}", f"{table}.jsonl")
+
+    def get_partition_files(self, table, samples=None):
+        if samples is None:
+            return sorted(
+                glob.glob(os.path.join(self.path, table, "sample=*", f"{table}.jsonl"))
+            )
+        return [
+            self.get_partition_path(table, sample)
+            for sample in samples
+            if os.path.exists(self.get_partition_path(table, sample))
+        ]
+
+    def append_rows(self, table, sample, rows):
+        partition_path = self.get_partition_path(table, sample)
+        os.makedirs(os.path.dirname(partition_path), exist_ok=True)
+        with open(partition_path, "a") as f:
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+
+    def cache_snapshot(self, sample, commit_hash, issues):
+        self.last_snapshots[sample] = (commit_hash, issues)
+        self.last_snapshots.move_to_end(sample)
+        if len(self.last_snapshots) > CACHED_SNAPSHOTS:
+            self.last_snapshots.popitem(last=False)
+
+    # the issues are appended before the commit so a commit row always has its issues
+    def write_snapshot(self, sample, commit_row, issue_rows, position=None):
+        if self.sharded and position is not None:
+            self.write_shard(sample, commit_row, issue_rows, position)
+            return
+        self.append_rows(ISSUES_TABLE, sample, issue_rows)
+        self.append_rows(COMMITS_TABLE, sample, [commit_row])
+
+    def get_shard_folder(self, sample):
+        return os.path.join(self.path, SHARDS_FOLDER, f"sample={sample}")
+
+    def get_shard_files(self, sample, commit_hash="*"):
+        return sorted(
+            glob.glob(
+                os.path.join(self.get_shard_folder(sample), f"*-{commit_hash}.jsonl")
+            )
+        )
+
+    # one file per commit, the commit row first, renamed into place once complete
+    def write_shard(self, sample, commit_row, issue_rows, position):
+        shard_folder = self.get_shard_folder(sample)
+        os.makedirs(shard_folder, exist_ok=True)
+        shard_path = os.path.join(
+            shard_folder, f"{position:010d}-{commit_row['commit_hash']}.jsonl"
+        )
+        with open(f"{shard_path}.tmp", "w") as f:
+            f.write(json.dumps(commit_row) + "\n")
+            for row in issue_rows:
+                f.write(json.dumps(row) + "\n")
+        os.replace(f"{shard_path}.tmp", shard_path)
+
+    # move the shards of each sample into its partitions, in commit order
+    def merge_shards(self, samples=None):
+        if samples is None:
+            samples = [
+                os.path.basename(shard_folder)[len("sample=") :]
+                for shard_folder in glob.glob(
+                    os.path.join(self.path, SHARDS_FOLDER, "sample=*")
+                )
+            ]
+        merged = 0
+        for sample in samples:
+            shard_files = self.get_shard_files(sample)
+            if not shard_files:
+                continue
+            commits_path = self.get_partition_path(COMMITS_TABLE, sample)
+            issues_path = self.get_partition_path(ISSUES_TABLE, sample)
+            os.makedirs(os.path.dirname(commits_path), exist_ok=True)
+            os.makedirs(os.path.dirname(issues_path), exist_ok=True)
+            with open(commits_path, "a") as commits_file, open(
+                issues_path, "a"
+            ) as issues_file:
+                for shard_file in shard_files:
+                    with open(shard_file, "r") as f:
+                        commit_line = f.readline()
+                        shutil.copyfileobj(f, issues_file)
+                    # a shard merged again after a crash is skipped by the readers
+                    issues_file.flush()
+                    commits_file.write(commit_line)
+                    commits_file.flush()
+                    os.remove(shard_file)
+                    merged += 1
+        if merged:
+            print(f"Merged {merged} commit shards into {self.path}")
+        return merged
+
+    def append_commit(
+        self,
+        sample,
+        commit_hash,
+        commit_date,
+        analysis_date,
+        issues_detected,
+        position=None,
+    ):
+        issues = (issues_detected or {}).get("issues", [])
+        self.cache_snapshot(sample, commit_hash, issues)
+        self.write_snapshot(
+            sample,
+            {
+                "sample": sample,
+                "commit_hash": commit_hash,
+                "date": commit_date,
+                "analysis_date": analysis_date,
+                "total": len(issues),
+            },
+            (get_issue_row(sample, commit_hash, issue) for issue in issues),
+            position,
+        )
+
+    # a commit that was not scanned gets a copy of the issues of the commit it inherits,
+    # returns them, None when the store does not hold that commit
+    def append_inherited_commit(
+        self,
+        sample,
+        commit_hash,
+        commit_date,
+        analysis_date,
+        source_hash,
+        position=None,
+    ):
+        issues = self.get_commit_issues(sample, source_hash)
+        if issues is None:
+            return None
+        self.cache_snapshot(sample, commit_hash, issues)
+        self.write_snapshot(
+            sample,
+            {
+                "sample": sample,
+                "commit_hash": commit_hash,
+                "date": commit_date,
+                "analysis_date": analysis_date,
+                "total": len(issues),
+                "inherited_from": source_hash,
+            },
+            (get_issue_row(sample, commit_hash, issue) for issue in issues),
+            position,
+        )
+        return issues
+
+    # only the issues opened, fixed, reopened or changed since previous_hash, the previous
+    # commit, iter_snapshots applies them to the previous issues; when those are cached the
+    # issues of the commit are cached too, so the next delta is not rebuilt from the history
+    def append_delta(
+        self,
+        sample,
+        commit_hash,
+        commit_date,
+        analysis_date,
+        changes,
+        position=None,
+        inherited_from=None,
+        previous_hash=None,
+    ):
+        commit_row = {
+            "sample": sample,
+            "commit_hash": commit_hash,
+            "date": commit_date,
+            "analysis_date": analysis_date,
+            "total": len(changes),
+            "delta": True,
+        }
+        for change in CHANGE_TYPES:
+            commit_row[change] = sum(issue["change"] == change for issue in changes)
+        if inherited_from is not None:
+            commit_row["inherited_from"] = inherited_from
+        cached = self.last_snapshots.get(sample)
+        if (
+            previous_hash is not None
+            and cached is not None
+            and cached[0] == previous_hash
+        ):
+            state = {issue["key"]: issue for issue in cached[1]}
+            for issue in changes:
+                state[issue["key"]] = get_issue_fields(issue)
+            self.cache_snapshot(sample, commit_hash, list(state.values()))
+        self.write_snapshot(
+            sample,
+            commit_row,
+            (get_issue_row(sample, commit_hash, issue) for issue in changes),
+            position,
+        )
+
+    # issues of one commit of a sample, None when the commit is not in the store
+    def get_commit_issues(self, sample, commit_hash):
+        # an inherited commit usually inherits the snapshot written just before it
+        cached = self.last_snapshots.get(sample)
+        if cached is not None and cached[0] == commit_hash:
+            return cached[1]
+
+        shard_files = self.get_shard_files(sample, commit_hash)
+        if shard_files:
+            with open(shard_files[-1], "r") as f:
+                rows = [json.loads(line) for line in f]
+            if not rows[0].get("delta"):
+                return rows[1:]
+            return self.get_delta_commit_issues(sample, commit_hash)
+
+        index = self.get_partition_index(sample)
+        commit = index["commits"].get(commit_hash)
+        if commit is None:
+            return None
+        if commit.get("delta"):
+            return self.get_delta_commit_issues(sample, commit_hash)
+        group = index["groups"].get(commit_hash)
+        if not commit["total"] or group is None:
+            return []
+        issues = {}
+        with open(self.get_partition_path(ISSUES_TABLE, sample), "rb") as f:
+            f.seek(group[1])
+            for line in f.read(group[2] - group[1]).splitlines():
+                issue = json.loads(line)
+                issues[issue["key"]] = issue
+        # get_issue_row overrides the sample and commit_hash of the copied rows
+        return list(issues.values())
+
+    # read the lines appended to the partitions of a sample since the last call, the last
+    # row of a commit and the byte range of its last group of issues win, like in
+    # iter_snapshots, so each partition is parsed once however many commits are looked up
+    def get_partition_index(self, sample):
+        index = self.partition_indexes.get(sample)
+        commits_path = self.get_partition_path(COMMITS_TABLE, sample)
+        issues_path = self.get_partition_path(ISSUES_TABLE, sample)
+        if index is None:
+            index = self.partition_indexes[sample] = {
+                "commits": {},
+                "groups": {},
+                "group": None,
+                "commits_offset": 0,
+                "issues_offset": 0,
+            }
+        if os.path.exists(commits_path):
+            with open(commits_path, "rb") as f:
+                f.seek(index["commits_offset"])
+                for line in f:
+                    # a line still being written is read by the next call
+                    if not line.endswith(b"\n"):
+                        break
+                    index["commits_offset"] += len(line)
+                    commit = json.loads(line)
+                    index["commits"][commit["commit_hash"]] = commit
+        if os.path.exists(issues_path):
+            with open(issues_path, "rb") as f:
+                f.seek(index["issues_offset"])
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    start = index["issues_offset"]
+                    index["issues_offset"] += len(line)
+                    commit_hash = json.loads(line)["commit_hash"]
+                    group = index["group"]
+                    if group is not None and group[0] == commit_hash:
+                        group[2] = index["issues_offset"]
+                    else:
+                        group = [commit_hash, start, index["issues_offset"]]
+                        index["group"] = index["groups"][commit_hash] = group
+        return index
+
+    # a delta only has the changes, the issues are rebuilt from the commits before it
+    def get_delta_commit_issues(self, sample, commit_hash):
+        self.merge_shards([sample])
+        issues = None
+        for commit, commit_issues in self.iter_snapshots([sample]):
+            if commit["commit_hash"] == commit_hash:
+                issues = commit_issues
+        return issues
+
+    def read_table(self, table, samples=None, columns=None):
+        frames = []
+        for partition_file in self.get_partition_files(table, samples):
+            if os.path.getsize(partition_file) == 0:
+                continue
+            frame = pd.read_json(
+                partition_file, lines=True, dtype=False, convert_dates=False
+            )
+            frames.append(frame[columns] if columns else frame)
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(frames, ignore_index=True)
+
+    def get_samples(self):
+        return sorted(
+            os.path.basename(os.path.dirname(partition_file))[len("sample=") :]
+            for partition_file in self.get_partition_files(COMMITS_TABLE)
+        )
+
+    # stream (commit row, issues) pairs of each sample in commit order, one commit in memory,
+    # the issues of a delta commit are those of the previous commit with its changes applied
+    def iter_snapshots(self, samples=None):
+        for sample in samples if samples is not None else self.get_samples():
+            for commit, issues, _ in self.iter_sample_snapshots(sample):
+                yield commit, issues
+
+    # stream (commit row, issues, position) of a sample from a position yielded by a previous
+    # call, the byte offsets of the next commit row and issue group, to which the caller adds
+    # the issues of the last commit it consumed as "issues" when the next one can be a delta
+    def iter_sample_snapshots(self, sample, position=None):
+        commits_path = self.get_partition_path(COMMITS_TABLE, sample)
+        issues_path = self.get_partition_path(ISSUES_TABLE, sample)
+        if not os.path.exists(commits_path):
+            return
+        position = position or {}
+        commits_offset = position.get("commits_offset", 0)
+        issues_offset = position.get("issues_offset", 0)
+        previous_issues = position.get("issues", [])
+        # partitions rewritten since the position was saved are read from the start
+        if commits_offset > os.path.getsize(commits_path) or (
+            os.path.exists(issues_path) and issues_offset > os.path.getsize(issues_path)
+        ):
+            commits_offset = issues_offset = 0
+            previous_issues = []
+        issue_groups = iter_issue_groups(issues_path, issues_offset)
+        # the issue groups read so far end there
+        issues_end = issues_offset
+
+        def read_group():
+            nonlocal issues_end
+            group = next(issue_groups, None)
+            if group is not None:
+                issues_end = group[3]
+            return group
+
+        group = read_group()
+        seen_commits = set()
+        # issues by key of the previous commit, kept while deltas follow it
+        state = None
+        with open(commits_path, "rb") as f:
+            f.seek(commits_offset)
+            for line in f:
+                # a line still being written is read by the next call
+                if not line.endswith(b"\n"):
+                    break
+                commits_offset += len(line)
+                commit = json.loads(line)
+                # a shard merged again after a crash repeats its commit row
+                if commit["commit_hash"] in seen_commits:
+                    continue
+                seen_commits.add(commit["commit_hash"])
+                issues = []
+                if commit["total"]:
+                    # groups without a commit row are left over from an interrupted run
+                    while group is not None and group[0] != commit["commit_hash"]:
+                        group = read_group()
+                    if group is not None:
+                        issues = group[1]
+                        group = read_group()
+                if commit.get("delta"):
+                    if state is None:
+                        state = {issue["key"]: issue for issue in previous_issues}
+                    for issue in issues:
+                        state[issue["key"]] = get_issue_fields(issue)
+                    issues = [
+                        dict(issue, sample=sample, commit_hash=commit["commit_hash"])
+                        for issue in state.values()
+                    ]
+                else:
+                    state = None
+                previous_issues = issues
+                yield commit, issues, {
+                    "commits_offset": commits_offset,
+                    # the next commit reads from the group read ahead
+                    "issues_offset": group[2] if group is not None else issues_end,
+                }
+
+    def load_commits(self, samples=None):
+        commits_df = self.read_table(COMMITS_TABLE, samples)
+        # a commit interrupted before its row was written is analyzed again, keep the last row
+        if len(commits_df):
+            commits_df = commits_df.drop_duplicates(
+                subset=["sample", "commit_hash"], keep="last"
+            ).reset_index(drop=True)
+        return commits_df
+
+    def has_deltas(self, samples=None):
+        commits_df = self.read_table(COMMITS_TABLE, samples)
+        return "delta" in commits_df and bool(commits_df["delta"].fillna(False).any())
+
+    def load_issues(self, samples=None, columns=None):
+        if self.has_deltas(samples):
+            # the deltas are expanded to the full issues of every commit
+            issues_df = pd.DataFrame(
+                [
+                    issue
+                    for _, issues in self.iter_snapshots(samples)
+                    for issue in issues
+                ]
+            )
+            if columns:
+                issues_df = issues_df.reindex(columns=columns)
+        else:
+            issues_df = self.read_table(ISSUES_TABLE, samples, columns)
+        if len(issues_df) and {"sample", "commit_hash", "key"} <= set(issues_df):
+            issues_df = issues_df.drop_duplicates(
+                subset=["sample", "commit_hash", "key"], keep="last"
+            ).reset_index(drop=True)
+        return issues_df
+
+    # the columns of every issue row streamed one commit at a time, as categoricals since
+    # their values repeat from one commit to the next, and the first_columns of each issue
+    # only from the first commit it appears in, so no full issue is kept in memory
+    def load_issue_columns(self, samples=None, columns=None, first_columns=()):
+        columns = list(columns or ("sample", "commit_hash", "key", "issueStatus"))
+        codes = {column: array("i") for column in columns}
+        # a missing value is code -1, the missing category of pandas
+        categories = {column: {None: -1} for column in columns}
+        first_issues = {}
+        canonical_values = {}
+        for _, issues in self.iter_snapshots(samples):
+            for issue in issues:
+                for column in columns:
+                    value = issue.get(column)
+                    column_categories = categories[column]
+                    code = column_categories.get(value)
+                    if code is None:
+                        code = column_categories[value] = len(column_categories) - 1
+                    codes[column].append(code)
+                if first_columns and issue["key"] not in first_issues:
+                    first_issues[issue["key"]] = [
+                        get_canonical_value(canonical_values, issue.get(column))
+                        for column in first_columns
+                    ]
+        issues_df = pd.DataFrame(
+            {
+                column: pd.Categorical.from_codes(
+                    np.frombuffer(codes[column], dtype=np.int32),
+                    categories=pd.Index(list(categories[column])[1:], dtype=object),
+                )
+                for column in columns
+            }
+        )
+        first_issues_df = pd.DataFrame.from_dict(
+            first_issues, orient="index", columns=list(first_columns)
+        )
+        first_issues_df.index.name = "key"
+        return issues_df, first_issues_df
+
+
+# one shared object for the equal values of the issues, such as the severities, the rules
+# or the empty lists, which are otherwise a new object per issue once parsed
+def get_canonical_value(canonical_values, value):
+    if isinstance(value, (list, dict)):
+        value_key = json.dumps(value, sort_keys=True)
+        # long nested values are mostly unique, their JSON would only add to the memory
+        if len(value_key) > CANONICAL_JSON_LIMIT:
+            return value
+    else:
+        value_key = (type(value), value)
+    return canonical_values.setdefault(value_key, value)
+
+
+# group consecutive issue rows of the same commit, keeping the last row of a repeated key,
+# as (commit hash, issues, start offset, end offset) from the given byte offset
+def iter_issue_groups(issues_path, offset=0):
+    if not os.path.exists(issues_path):
+        return
+    commit_hash = None
+    issues = {}
+    start = offset
+    with open(issues_path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            issue = json.loads(line)
+            if issue["commit_hash"] != commit_hash:
+                if issues:
+                    yield commit_hash, list(issues.values()), start, offset
+                commit_hash = issue["commit_hash"]
+                issues = {}
+                start = offset
+            issues[issue["key"]] = issue
+            offset += len(line)
+    if issues:
+        yield commit_hash, list(issues.values()), start, offset
+
+
+def get_issue_row(sample, commit_hash, issue):
+    return dict(issue, sample=sample, commit_hash=commit_hash)
+
+
+# convert a legacy commits_report.csv with the issues dict in a cell into the store
+def convert_commits_report(report_file, store=None):
+    store = store or IssueStore()
+    csv.field_size_limit(sys.maxsize)
+    converted = failed = 0
+    with open(report_file, "r", newline="") as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            try:
+                issues_detected = (
+                    ast.literal_eval(row["Issues"]) if row["Issues"] else None
+                )
+            except (ValueError, SyntaxError):
+                failed += 1
+                continue
+            store.append_commit(
+                row["Sample"],
+                row["Commit Hash"],
+                row["Date"],
+                row["Analysis Date"],
+                issues_detected,
+            )
+            converted += 1
+    print(f"Converted {converted} commits from {report_file}, {failed} failed")
+    return store
@@ -1,14 +1,50 @@
+import ast
 import glob
 from multiprocessing import Pool
 from concurrent.futures import ThreadPoolExecutor
 from os import makedirs
 
 import pandas as pd
-import requests
 import os
+import queue
 import subprocess
-
-from pydriller import Repository
+import threading
+
+from commit_log import iter_commit_log
+from commit_sampling import sample_commits
+from commit_scheduler import OrderedGate
+from commit_selection import (
+    LANGUAGE_EXTENSIONS,
+    SOURCE_EXTENSIONS,
+    get_changes_since,
+    has_source_changes,
+    select_commits,
+)
+from export_merge import merge_exports, read_merged_dataset
+from repository_cache import (
+    create_working_copy,
+    get_repository_name,
+    prepare_repository,
+    remove_working_copy,
+)
+from run_state import RunState
+from scanner_cache import (
+    WARM_UP_PROJECT_KEY,
+    get_scanner_env,
+    harvest_scanner_homes,
+    warm_up_seed_cache,
+)
+from scratch_tree import ScratchTree
+from sonarqube_client import get_client
+from sonarqube_issues import fetch_all_issues
+from sonarqube_snippets import extract_snippets, extract_snippets_by_component
+from stage_metrics import (
+    SUMMARY_INTERVAL,
+    StageMetrics,
+    report_summary,
+    stage_timer,
+    start_summary_reporter,
+)
 
 # import the csv with code samples to be used as dataframe
 
@@ -33,6 +69,55 @@ data_folder_path = os.path.join(
     "SonarQube-analysis",
     "data",
 )
+RUN_STATE_FILE = os.path.join(data_folder_path, "run_state.sqlite")
+# every stage of every commit is appended to this file as a JSON line
+STAGE_EVENTS_FILE = os.path.join(data_folder_path, "metrics", "stage_events.jsonl")
+
+SONAR_URL = "http://localhost:9000"
+SONAR_AUTH = ("admin", "root")
+# analysis token of both scanners
+SONAR_TOKEN = "sqa_8b5b36d0d8f38e528b7e7535a2708229f50fbc21"
+NUM_SNIPPET_THREADS = 124
+# blobless mirrors for huge histories, file contents are fetched at checkout
+PARTIAL_CLONE = False
+# commits of one .NET repository built and analyzed concurrently in their own worktrees, only
+# the scanner end steps, which submit the analyses, run one at a time in commit order;
+# sonar-scanner submits at the end of the scan, so other repositories are scanned in place
+WORKTREES_PER_REPOSITORY = 1
+# "component" fetches each source file once and slices the snippets locally, "issue" calls issue_snippets per issue
+SNIPPETS_MODE = "component"
+# the issues of every sample, de-duplicated by key and partitioned by sample
+ISSUES_DATASET_PATH = "data/issues/dataset"
+# the extracted code snippets, partitioned by sample
+SNIPPETS_MERGED_PATH = "data/code_snippets/merged"
+# scan commits checked out in a worktree in a RAM-backed scratch directory, the working copy is never checked out
+EXPORT_COMMITS = False
+# commits without changes to the sources of the project type, or with a tree already scanned, are not scanned again
+SKIP_UNCHANGED_COMMITS = True
+# "all", "nth", "day", "week", "tags" or "first_parent", only the final issues are extracted so there is no bisection
+COMMIT_SAMPLING = "all"
+# keep obj/ between the commits of a working copy and only restore when the project files change,
+# the builds are never incremental since the analyzers only run when the compiler runs
+INCREMENTAL_DOTNET_BUILD = True
+# packages folder shared by every build, so a package is downloaded once
+NUGET_PACKAGES_FOLDER = os.path.join(
+    os.path.expanduser("~"), ".nuget", "sonarqube-analysis-packages"
+)
+# every worker scans with its own SONAR_USER_HOME, seeded from a warmed ~/.sonar/cache
+ISOLATED_SCANNER_HOMES = True
+# also write the live progress summary to this Prometheus textfile, None disables it
+PROMETHEUS_TEXTFILE = None
+DOTNET_RESTORE_FILES = (
+    ".csproj",
+    ".vbproj",
+    ".sln",
+    ".props",
+    ".targets",
+    "packages.config",
+    "packages.lock.json",
+    "nuget.config",
+    "global.json",
+)
 
 # set the path to the csv file
 
@@ -44,53 +129,142 @@ def get_sample():
         yield row["sample_name"], row["github_address"]
 
 
+# create the helper function to time a stage of a sample or commit into the stage events file
+def time_stage(stage, sample_name=None, commit_hash=None):
+    return stage_timer(stage, sample_name, commit_hash, STAGE_EVENTS_FILE)
+
+
+# create the helper function to get the pooled SonarQube client shared by the threads of this process
+def get_sonar_client():
+    return get_client(SONAR_URL, auth=SONAR_AUTH, pool_size=NUM_SNIPPET_THREADS)
+
+
 # create the helper function to create the Sonarqube project with the sample name with login credentials with optional parameters
 def create_sonarqube_project(sample_name, lang=None):
     print(f"Creating SonarQube project for {sample_name} language: {lang}")
 
-    url = "http://localhost:9000/api/projects/create"
     data = {"name": f"{lang}---{sample_name}", "project": f"{sample_name}"}
-    response = requests.post(url, data=data, auth=("admin", "root"))
+    response = get_sonar_client().post("api/projects/create", data=data)
     print(response.text)
     return response
 
 
-# create the helper function to clone the GitHub repository and cd to the repository
+# create the helper function to delete a Sonarqube project
+def delete_sonarqube_project(project_key):
+    response = get_sonar_client().post(
+        "api/projects/delete", data={"project": project_key}
+    )
+    if not response.ok:
+        print(f"Failed to delete project {project_key}: {response.text}")
+    return response
+
+
+# create the helper function to fill the seed scanner cache with one scan before the workers copy it
+def warm_up_scanner_cache():
+    create_sonarqube_project(WARM_UP_PROJECT_KEY)
+    with time_stage("scanner_warm_up") as event:
+        event["ok"] = warm_up_seed_cache(
+            get_sonar_scanner_command(WARM_UP_PROJECT_KEY, "warm-up"),
+            SOURCE_EXTENSIONS,
+        )
+    delete_sonarqube_project(WARM_UP_PROJECT_KEY)
+    return event["ok"]
+
+
+# create the helper function to check out the GitHub repository from the local mirror cache
 def clone_repository(github_address):
     os.makedirs("samples", exist_ok=True)
-    os.system(
-        f'git clone {github_address} {samples_folder}/{github_address.split("/")[-1].replace(".git", "")}'
+    repository_name = get_repository_name(github_address)
+    return prepare_repository(
+        github_address, f"{samples_folder}/{repository_name}", partial=PARTIAL_CLONE
     )
 
 
 # create the helper function to checkout to specific commit
-def checkout_commit(commit):
-    os.system(f"git checkout  {commit}")
+def checkout_commit(commit, cwd=None):
+    subprocess.run(f"git checkout  {commit}", shell=True, check=False, cwd=cwd)
 
 
-# create the sonar-scanner configuration file
-def create_sonar_scanner_config(sample_name, commit_hash):
-    with open("sonar-project.properties", "w") as f:
-        f.write(
-            f"sonar.projectKey={sample_name}\nsonar.sources=.\nsonar.host.url=http://localhost:9000\nsonar.token=sqa_8b5b36d0d8f38e528b7e7535a2708229f50fbc21\nsonar.projectVersion={commit_hash}"
-        )
+# create the helper function to discard the changes left by the build and the scanner
+# obj/ holds the restore output the next --no-restore build reads
+def clean_working_copy(cwd=None, keep_restore_outputs=False):
+    subprocess.run("git reset --hard", shell=True, check=False, cwd=cwd)
+    if keep_restore_outputs:
+        subprocess.run("git clean -fd -e obj/", shell=True, check=False, cwd=cwd)
+    else:
+        subprocess.run("git clean -fd", shell=True, check=False, cwd=cwd)
 
 
-# create the helper function to run the sonar-scanner
-def run_sonar_scanner():
-    os.system("sonar-scanner")
+# create the helper function to get the environment of a scanner run, scanner_name selects the user home
+def get_scanner_run_env(scanner_name=None):
+    return get_scanner_env(scanner_name) if ISOLATED_SCANNER_HOMES else None
 
 
-# Create a runner for sonnar-scanner in dotnet
-def run_sonar_scanner_dotnet(sample_name, commit_hash, is_latest_commit=False):
-    subprocess.run(
-        f'dotnet-sonarscanner begin /k:"{sample_name}" /d:sonar.host.url="http://localhost:9000" /d:sonar.login="sqa_8b5b36d0d8f38e528b7e7535a2708229f50fbc21" /v:"{commit_hash}"',
-        shell=True,
-        check=False,
-    )
-    result = subprocess.run(
-        "dotnet build", shell=True, check=False, capture_output=True, text=True
+# create the sonar-scanner command, the parameters are passed on the command line so no properties file is shared
+def get_sonar_scanner_command(sample_name, commit_hash):
+    command = (
+        f"sonar-scanner -Dsonar.projectKey={sample_name} -Dsonar.sources=. "
+        f"-Dsonar.host.url={SONAR_URL} "
+        f"-Dsonar.token={SONAR_TOKEN} "
+        f"-Dsonar.projectVersion={commit_hash}"
     )
+    return command
+
+
+# create the helper function to run the sonar-scanner, whether it succeeded
+def run_sonar_scanner(sample_name, commit_hash, cwd=None, scanner_name=None):
+    with time_stage("scanner", sample_name, commit_hash) as event:
+        result = subprocess.run(
+            get_sonar_scanner_command(sample_name, commit_hash),
+            shell=True,
+            check=False,
+            cwd=cwd,
+            env=get_scanner_run_env(scanner_name),
+        )
+        event["ok"] = result.returncode == 0
+    return result.returncode == 0
+
+
+def begin_sonar_scanner_dotnet(sample_name, commit_hash, cwd=None, scanner_name=None):
+    with time_stage("scanner_begin", sample_name, commit_hash) as event:
+        result = subprocess.run(
+            f'dotnet-sonarscanner begin /k:"{sample_name}" /d:sonar.host.url="{SONAR_URL}" /d:sonar.login="{SONAR_TOKEN}" /v:"{commit_hash}"',
+            shell=True,
+            check=False,
+            cwd=cwd,
+            env=get_scanner_run_env(scanner_name),
+        )
+        event["ok"] = result.returncode == 0
+    return result.returncode == 0
+
+
+def get_dotnet_env():
+    if not INCREMENTAL_DOTNET_BUILD:
+        return None
+    return dict(os.environ, NUGET_PACKAGES=NUGET_PACKAGES_FOLDER)
+
+
+def build_dotnet(
+    sample_name, commit_hash, is_latest_commit=False, cwd=None, restore=True
+):
+    with time_stage("build", sample_name, commit_hash) as event:
+        event["restore"] = restore
+        # an incremental build skips CoreCompile for unchanged projects, which then
+        # have no analyzer report and SonarQube would close their issues
+        result = subprocess.run(
+            (
+                "dotnet build --no-incremental"
+                if restore
+                else "dotnet build --no-incremental --no-restore"
+            ),
+            shell=True,
+            check=False,
+            capture_output=True,
+            text=True,
+            cwd=cwd,
+            env=get_dotnet_env(),
+        )
+        event["ok"] = result.returncode == 0
     if result.returncode != 0:
         failed_df = pd.DataFrame()
         failed_df["sample"] = [sample_name]
@@ -104,71 +278,63 @@ def run_sonar_scanner_dotnet(sample_name, commit_hash, is_latest_commit=False):
             index=False,
         )
         print(f"Failed to build {sample_name} at commit {commit_hash}")
-    subprocess.run(
-        'dotnet-sonarscanner end /d:sonar.login="sqa_8b5b36d0d8f38e528b7e7535a2708229f50fbc21"',
+    return result.returncode == 0
+
+
+def end_sonar_scanner_dotnet(cwd=None, scanner_name=None):
+    result = subprocess.run(
+        f'dotnet-sonarscanner end /d:sonar.login="{SONAR_TOKEN}"',
         shell=True,
         check=False,
+        cwd=cwd,
+        env=get_scanner_run_env(scanner_name),
+    )
+    return result.returncode == 0
+
+
+# Create a runner for sonnar-scanner in dotnet, whether the build and the scan succeeded
+def run_sonar_scanner_dotnet(
+    sample_name,
+    commit_hash,
+    is_latest_commit=False,
+    cwd=None,
+    restore=True,
+    scanner_name=None,
+):
+    begun = begin_sonar_scanner_dotnet(
+        sample_name,
+        commit_hash,
+        cwd=cwd,
+        scanner_name=scanner_name,
     )
+    built = build_dotnet(
+        sample_name, commit_hash, is_latest_commit, cwd=cwd, restore=restore
+    )
+    with time_stage("scanner_end", sample_name, commit_hash) as event:
+        ended = end_sonar_scanner_dotnet(cwd=cwd, scanner_name=scanner_name)
+        event["ok"] = ended
+    return built, begun and ended
 
 
 # create the helper function to delete the repository from local machine
-def delete_repository(repository_name):
-    os.system(f"rm -rf {repository_name}")
+def delete_repository(mirror_path, repository_name):
+    remove_working_copy(mirror_path, repository_name)
 
 
-# create the helper function to extract all the issues from the Sonarqube instance based on the page
+# create the helper function to extract all the issues from the Sonarqube instance, partitioning above the 10k search limit
 def extract_issues(sample_name):
     # Ensure that the directory exists
     os.makedirs("data/issues", exist_ok=True)
 
-    url = f"http://localhost:9000/api/issues/search?componentKeys={sample_name}&ps=500"
-    response = requests.get(url, auth=("admin", "root"))
-    total_issues = int(response.json().get("total", 0))
-
-    if total_issues <= 500:
-        print(f"Total issues: {total_issues}")
-        print(f"Extracting issues for single page")
-        current_issues = response.json().get("issues", [])
-        current_df = pd.DataFrame(current_issues)
-        current_df.to_csv(f"data/issues/{sample_name}_issues.csv")
-    elif 500 <= total_issues <= 10000:
-        total_pages = (total_issues // 500) + 1
-        for page in range(1, total_pages + 1):
-            print(f"Extracting issues for page {page}")
-            paged_url = url + f"&p={page}"
-            response = requests.get(paged_url, auth=("admin", "root"))
-            issues = response.json().get("issues", [])
-            issues_df = pd.DataFrame(issues)
-            issues_df.to_csv(f"data/issues/{sample_name}_{page}_issues.csv")
-    else:
-        impact_software_qualities = ("MAINTAINABILITY", "RELIABILITY", "SECURITY")
-        for quality in impact_software_qualities:
-            quality_url = f"{url}&impactSoftwareQualities={quality}"
-            response = requests.get(quality_url, auth=("admin", "root"))
-            total_quality_issues = int(response.json().get("total", 0))
-            if total_quality_issues <= 500:
-                print(f"Total issues for {quality}: {total_quality_issues}")
-                print(f"Extracting issues for single page")
-                current_issues = response.json().get("issues", [])
-                current_df = pd.DataFrame(current_issues)
-                current_df.to_csv(f"data/issues/{sample_name}_{quality}_issues.csv")
-            elif 500 <= total_quality_issues <= 10000:
-                total_pages = (total_issues // 500) + 1
-                for page in range(1, total_pages + 1):
-                    print(f"Extracting {quality} issues for page {page}")
-                    paged_url = quality_url + f"&p={page}"
-                    response = requests.get(paged_url, auth=("admin", "root"))
-                    issues = response.json().get("issues", [])
-                    issues_df = pd.DataFrame(issues)
-                    issues_df.to_csv(
-                        f"data/issues/{sample_name}_{quality}_{page}_issues.csv"
-                    )
-            else:
-                print(f"Total issues for {quality} is greater than 10000")
-
-    # issues_df.to_csv(f'data/issues/{sample_name}_issues.csv')
-
-    # return issues_df
+    params = {"componentKeys": sample_name}
+    with time_stage("issue_fetch", sample_name) as event:
+        response = fetch_all_issues(get_sonar_client(), params)
+        issues = response.get("issues", [])
+        event["issues"] = len(issues)
+    print(f"Total issues for {sample_name}: {len(issues)}")
+    issues_df = pd.DataFrame(issues)
+    with time_stage("write", sample_name):
+        issues_df.to_csv(f"data/issues/{sample_name}_issues.csv")
 
 
 # create the helper function to extract the code snippets based on the issues from the Sonarqube project to a csv file to a csv file
@@ -176,8 +342,9 @@ def extract_code_snippets(issue_key, sample_name):
     # Ensure that the directory exists
     os.makedirs("data/code_snippets", exist_ok=True)
 
-    url = f"http://localhost:9000/api/sources/issue_snippets?issueKey={issue_key}"
-    response = requests.get(url, auth=("admin", "root"))
+    response = get_sonar_client().get(
+        "api/sources/issue_snippets", params={"issueKey": issue_key}
+    )
 
     # print(snippets)
 
@@ -228,43 +395,316 @@ def is_dotnet_project(project_path):
     )
 
 
+# the paths whose changes can change a scan of the repository, checked out at HEAD
+# the dotnet scanner only analyzes the C# projects, sonar-scanner every language
+def get_scan_extensions(repository_path):
+    if is_dotnet_project(repository_path):
+        return LANGUAGE_EXTENSIONS["csharp"]
+    return SOURCE_EXTENSIONS
+
+
+# project type and whether a restore is needed, from the paths changed since the previous
+# build of the same working copy, previous_build being its (commit hash, is dotnet) pair
+def plan_dotnet_build(
+    repository_path, work_path, previous_build, commit_hash, records=None
+):
+    if not INCREMENTAL_DOTNET_BUILD or previous_build is None:
+        return is_dotnet_project(work_path), True
+    previous_hash, is_dotnet = previous_build
+    changed_paths = get_changes_since(
+        repository_path, previous_hash, commit_hash, records
+    )
+    # the project type only changes with a solution or project at the root
+    if any(
+        "/" not in path and path.lower().endswith((".csproj", ".sln"))
+        for path in changed_paths
+    ):
+        is_dotnet = is_dotnet_project(work_path)
+    return is_dotnet, has_source_changes(changed_paths, DOTNET_RESTORE_FILES)
+
+
+# build the commits of one .NET repository concurrently, each one in its own worktree, the
+# analyzers run during the build and the end steps are submitted in commit order
+def scan_commits_in_worktrees(
+    sample_name,
+    mirror_path,
+    repository_name,
+    pending_commits,
+    latest_commit_hash,
+    records=None,
+):
+    worktrees = queue.Queue()
+    worktree_paths = []
+    for index in range(min(WORKTREES_PER_REPOSITORY, len(pending_commits))):
+        worktree_path = f"{samples_folder}/{repository_name}-worktree-{index}"
+        if create_working_copy(mirror_path, worktree_path):
+            worktrees.put(worktree_path)
+            worktree_paths.append(worktree_path)
+    if not worktree_paths:
+        print(f"Failed to create worktrees for {sample_name}")
+        return
+
+    # analyses are submitted in commit order so the SonarQube history stays correct
+    gate = OrderedGate()
+    thread_state = threading.local()
+    # last build of each worktree, a worktree is used by one thread at a time
+    previous_builds = {}
+
+    def scan_commit(sequence, position, commit_hash):
+        with time_stage("commit", sample_name, commit_hash) as event:
+            event["ok"] = scan_commit_stages(sequence, position, commit_hash)
+
+    def scan_commit_stages(sequence, position, commit_hash):
+        if not hasattr(thread_state, "run_state"):
+            thread_state.run_state = RunState(RUN_STATE_FILE)
+        run_state = thread_state.run_state
+        worktree_path = worktrees.get()
+        # concurrent scans of a repository each use the user home of their worktree
+        scanner_name = os.path.basename(worktree_path)
+        prepared = scanned = False
+        try:
+            with time_stage("checkout", sample_name, commit_hash):
+                checkout_commit(commit_hash, cwd=worktree_path)
+            run_state.mark_stage(
+                sample_name, commit_hash, "checked_out", position=position
+            )
+            is_dotnet, restore = plan_dotnet_build(
+                worktree_path,
+                worktree_path,
+                previous_builds.get(worktree_path),
+                commit_hash,
+                records,
+            )
+            previous_builds[worktree_path] = (commit_hash, is_dotnet)
+            if is_dotnet:
+                begun = begin_sonar_scanner_dotnet(
+                    sample_name,
+                    commit_hash,
+                    cwd=worktree_path,
+                    scanner_name=scanner_name,
+                )
+                # a failed build may have left a broken restore, the next one restores again
+                if not build_dotnet(
+                    sample_name,
+                    commit_hash,
+                    commit_hash == latest_commit_hash,
+                    cwd=worktree_path,
+                    restore=restore,
+                ):
+                    previous_builds.pop(worktree_path)
+            prepared = True
+        except Exception as e:
+            print(f"Failed to prepare {sample_name} at commit {commit_hash}: {e}")
+            run_state.mark_error(sample_name, commit_hash, e)
+
+        try:
+            with gate.turn(sequence):
+                if prepared:
+                    print(f"Running SonarQube for commit: {commit_hash}")
+                    if is_dotnet:
+                        with time_stage(
+                            "scanner_end", sample_name, commit_hash
+                        ) as event:
+                            scanned = (
+                                end_sonar_scanner_dotnet(
+                                    cwd=worktree_path, scanner_name=scanner_name
+                                )
+                                and begun
+                            )
+                            event["ok"] = scanned
+                    else:
+                        # a commit from before the .NET projects submits as it scans
+                        scanned = run_sonar_scanner(
+                            sample_name,
+                            commit_hash,
+                            cwd=worktree_path,
+                            scanner_name=scanner_name,
+                        )
+                    # a failed scan is not checkpointed, the next run scans it again
+                    if scanned:
+                        run_state.mark_stage(sample_name, commit_hash, "scanned")
+                    else:
+                        print(f"Failed to scan {sample_name} at commit {commit_hash}")
+                        run_state.mark_error(sample_name, commit_hash, "scanner failed")
+        finally:
+            clean_working_copy(
+                worktree_path, keep_restore_outputs=INCREMENTAL_DOTNET_BUILD
+            )
+            worktrees.put(worktree_path)
+        return scanned
+
+    with ThreadPoolExecutor(max_workers=len(worktree_paths)) as executor:
+        futures = [
+            executor.submit(scan_commit, sequence, position, commit_hash)
+            for sequence, (position, commit_hash) in enumerate(pending_commits)
+        ]
+        for future in futures:
+            future.result()
+
+    for worktree_path in worktree_paths:
+        remove_working_copy(mirror_path, worktree_path)
+
+
 # create the function to run the Git part (create SonarQube project, clone, checkout, run sonar-scanner, delete repository)
 def run_git_part(row):
     sample_name, github_address = row["sample_name"], row["github_address"]
-    create_sonarqube_project(sample_name, lang="C#")
+    run_state = RunState(RUN_STATE_FILE)
+    if run_state.is_sample_finished(sample_name):
+        print(f"Skipping {sample_name}, already analyzed")
+        run_state.close()
+        return
+    run_state.mark_sample_started(sample_name)
+
+    if not run_state.is_project_created(sample_name):
+        response = create_sonarqube_project(sample_name, lang="C#")
+        if response.ok or "already exists" in response.text:
+            run_state.mark_project_created(sample_name)
     print(f"Running SonarQube git clone for {sample_name}")
-    clone_repository(github_address)
+    with time_stage("clone", sample_name) as event:
+        mirror_path = clone_repository(github_address)
+        event["ok"] = mirror_path is not None
+    if mirror_path is None:
+        print(f"Failed to clone {github_address}")
+        run_state.close()
+        return
     repository_name = github_address.split("/")[-1].replace(".git", "")
     # os.chdir(f'{samples_folder}/{repository_name}')
     current_path = f"{samples_folder}/{repository_name}"
 
     # run for all commits in the repository
-    commits_to_checkout = tuple(Repository(current_path).traverse_commits())
-    latest_commit = commits_to_checkout[-1]
-    print(f"Latest commit: {latest_commit.hash}")
-    print(f"Number of commits: {len(commits_to_checkout)}")
-    hashes = [commit.hash for commit in commits_to_checkout]
-    print(f"Commits: {hashes}")
-
-    for commit in commits_to_checkout:
-        os.chdir(f"{samples_folder}/{repository_name}")
-        checkout_commit(commit.hash)
-        is_latest_commit = commit.hash == latest_commit
-        print(f"Running SonarQube for commit: {commit.hash}")
-        # Identify if the commit has a dotnet project to be built
-        if is_dotnet_project(current_path):
-            print("Running SonarQube for dotnet project")
-            run_sonar_scanner_dotnet(sample_name, commit.hash, is_latest_commit)
-        else:
-            print("Running SonarQube for non-dotnet project")
-            create_sonar_scanner_config(sample_name, commit.hash)
-            run_sonar_scanner()
-        os.system("git reset --hard")
-        os.system("git clean -fd")
+    # the history of HEAD, oldest first, like the pydriller traversal it replaces
+    with time_stage("enumerate_commits", sample_name) as event:
+        commits_to_checkout = tuple(iter_commit_log(current_path, ("HEAD",)))
+        if COMMIT_SAMPLING != "all":
+            sampled_hashes = set(
+                sample_commits(
+                    current_path,
+                    [commit.hash for commit in commits_to_checkout],
+                    COMMIT_SAMPLING,
+                )
+            )
+            commits_to_checkout = tuple(
+                commit
+                for commit in commits_to_checkout
+                if commit.hash in sampled_hashes
+            )
+        latest_commit = commits_to_checkout[-1]
+        print(f"Latest commit: {latest_commit.hash}")
+        print(f"Number of commits: {len(commits_to_checkout)}")
+        hashes = [commit.hash for commit in commits_to_checkout]
+        print(f"Commits: {hashes}")
+        records = {commit.hash: commit for commit in commits_to_checkout}
+
+        # skip the commits already scanned by a previous run
+        scanned_commits = run_state.get_commits_at_stage(sample_name, "scanned")
+        print(f"Commits already scanned: {len(scanned_commits)}")
+        if SKIP_UNCHANGED_COMMITS:
+            inherited_commits = select_commits(
+                current_path,
+                hashes,
+                get_scan_extensions(current_path),
+                records=records,
+            )
+            for position, commit_hash in enumerate(hashes):
+                if (
+                    commit_hash in inherited_commits
+                    and commit_hash not in scanned_commits
+                ):
+                    run_state.mark_stage(
+                        sample_name,
+                        commit_hash,
+                        "scanned",
+                        position=position,
+                        inherited_from=inherited_commits[commit_hash],
+                    )
+                    scanned_commits.add(commit_hash)
+        event["commits"] = sum(
+            commit_hash not in scanned_commits for commit_hash in hashes
+        )
+
+    if WORKTREES_PER_REPOSITORY > 1 and not is_dotnet_project(current_path):
+        print(f"Scanning {sample_name} in place, only .NET builds run in worktrees")
+    elif WORKTREES_PER_REPOSITORY > 1:
+        pending_commits = [
+            (position, commit.hash)
+            for position, commit in enumerate(commits_to_checkout)
+            if commit.hash not in scanned_commits
+        ]
+        scan_commits_in_worktrees(
+            sample_name,
+            mirror_path,
+            repository_name,
+            pending_commits,
+            latest_commit.hash,
+            records,
+        )
+        commits_to_checkout = ()
+
+    scratch_tree = (
+        ScratchTree(current_path, f"{repository_name}-{os.getpid()}")
+        if EXPORT_COMMITS
+        else None
+    )
+    previous_build = None
+    for position, commit in enumerate(commits_to_checkout):
+        if commit.hash in scanned_commits:
+            continue
+        with time_stage("commit", sample_name, commit.hash):
+            os.chdir(f"{samples_folder}/{repository_name}")
+            # scan the exported tree, falling back to a checkout when it is above the scratch cap
+            with time_stage("checkout", sample_name, commit.hash):
+                work_path = scratch_tree.export(commit.hash) if scratch_tree else None
+                exported = work_path is not None
+                if not exported:
+                    checkout_commit(commit.hash)
+                    work_path = current_path
+            run_state.mark_stage(
+                sample_name, commit.hash, "checked_out", position=position
+            )
+            is_latest_commit = commit.hash == latest_commit.hash
+            print(f"Running SonarQube for commit: {commit.hash}")
+            # Identify if the commit has a dotnet project to be built
+            is_dotnet, restore = plan_dotnet_build(
+                current_path, work_path, previous_build, commit.hash, records
+            )
+            previous_build = (commit.hash, is_dotnet)
+            if is_dotnet:
+                print("Running SonarQube for dotnet project")
+                built, scanned = run_sonar_scanner_dotnet(
+                    sample_name,
+                    commit.hash,
+                    is_latest_commit,
+                    cwd=work_path,
+                    # the scratch checkout is cleaned of build outputs
+                    restore=restore or exported,
+                )
+                # a failed build may have left a broken restore, the next one restores again
+                if not built:
+                    previous_build = None
+            else:
+                print("Running SonarQube for non-dotnet project")
+                scanned = run_sonar_scanner(sample_name, commit.hash, cwd=work_path)
+            # a failed scan is not checkpointed, the next run scans the commit again
+            if scanned:
+                run_state.mark_stage(sample_name, commit.hash, "scanned")
+            else:
+                print(f"Failed to scan {sample_name} at commit {commit.hash}")
+                run_state.mark_error(sample_name, commit.hash, "scanner failed")
+            if not exported:
+                clean_working_copy(keep_restore_outputs=INCREMENTAL_DOTNET_BUILD)
+    if scratch_tree:
+        scratch_tree.remove()
+
+    # a sample with failed commits is resumed by the next run, scanning is its last stage
+    if run_state.has_completed(sample_name, hashes, "scanned"):
+        run_state.mark_sample_finished(sample_name)
+    else:
+        print(f"{sample_name} has failed commits, left to the next run")
+    run_state.close()
 
     os.chdir(samples_folder)
     print(f"Deleting repository directory: {samples_folder}/{repository_name}")
-    delete_repository(f"{samples_folder}/{repository_name}")
+    delete_repository(mirror_path, f"{samples_folder}/{repository_name}")
 
 
 # create then function to run the SonarQube part (extract issues, extract code snippets)
@@ -274,64 +714,63 @@ def run_sonarqube_issues_part():
         print(f"Extracting issues for {sample_name}")
         extract_issues(sample_name)
 
-    # Merge all the issues into one csv file
-    issues_list = []
-    for file_path in glob.glob("data/issues/*_issues.csv"):
-        if os.path.exists(file_path):
-            issues_list.append(pd.read_csv(file_path))
-        else:
-            print(f"File not found: {file_path}")
-
-    if issues_list:
-        issues_df = pd.concat(issues_list, ignore_index=True)
-        issues_df.drop_duplicates(subset="key", inplace=True)
-        issues_df.to_csv("data/issues/0all.csv", index=False)
+    # Merge the issues files extracted since the last merge into the dataset
+    issues_files = sorted(glob.glob("data/issues/*_issues.csv"))
+    if issues_files:
+        merge_exports(issues_files, ISSUES_DATASET_PATH, ["key"], "project")
     else:
         print("No issues files to merge.")
 
+    get_sonar_client().print_latency_stats()
+
 
 def run_sonarqube_snippets_part():
     # define the issues in each df for each file in data/issues/all_issues.csv
 
-    issues_df = pd.read_csv("data/issues/0all_nondup.csv")
-    # for index, row in issues_df.iterrows():
-    #     issue_key = row['key']
-    #     sample_name = row['component']
-    #     print(f'Extracting code snippets for {issue_key}')
-    #     extract_code_snippets(issue_key, sample_name)
+    issues_df = read_merged_dataset(
+        ISSUES_DATASET_PATH, columns=["key", "component", "project", "textRange"]
+    )
 
-    num_threads = 124
+    num_threads = NUM_SNIPPET_THREADS
     print(f"Number of threads: {num_threads}")
 
-    # processed_keys = set()
-    #
-    # with ThreadPoolExecutor(max_workers=num_threads) as executor:
-    #     for row in issues_df.itertuples(index=False):
-    #         if row.key not in processed_keys:
-    #             executor.submit(extract_code_snippets_parallel, row)
-    #             processed_keys.add(row.key)
-
-    # Merge all the code snippets into one csv file
-    print("Merging all code snippets into one csv file")
-    snippets_list = []
-
-    for issue_key in issues_df["key"]:
-        try:
-            snippets_df = pd.read_csv(
-                f"data/code_snippets/{issue_key}_code_snippets.csv"
+    # Stream the code snippets into one parquet dataset, skipping issues already extracted
+    with time_stage("snippet_fetch") as event:
+        if SNIPPETS_MODE == "component":
+            text_ranges = issues_df["textRange"].apply(
+                lambda text_range: (
+                    ast.literal_eval(text_range)
+                    if isinstance(text_range, str)
+                    else None
+                )
             )
-            snippets_list.append(snippets_df)
-        except Exception as e:
-            print(f"Error processing {issue_key}: {e}")
-            continue
+            store = extract_snippets_by_component(
+                get_sonar_client(),
+                zip(
+                    issues_df["key"],
+                    issues_df["component"],
+                    issues_df["project"],
+                    text_ranges,
+                ),
+                concurrency=num_threads,
+            )
+        else:
+            store = extract_snippets(
+                get_sonar_client(),
+                zip(issues_df["key"], issues_df["component"]),
+                concurrency=num_threads,
+            )
+        event["issues"] = len(issues_df)
+    print(f"Code snippets stored in {store.path}")
+    # one line per row, an issue without snippet only has a resume marker without line
+    merge_exports(
+        store.get_part_files(),
+        SNIPPETS_MERGED_PATH,
+        ["issue_key", "line"],
+        "component_project",
+    )
 
-    if snippets_list:
-        merged_snippets_df = pd.concat(snippets_list, ignore_index=True)
-        merged_snippets_df.to_csv(
-            "data/code_snippets/0all_code_snippets.csv", index=False
-        )
-    else:
-        print("No code snippets to merge.")
+    get_sonar_client().print_latency_stats()
 
 
 # create the main function to run the Git part and SonarQube part
@@ -339,8 +778,18 @@ def main():
     # Get the number of CPU cores available
     num_cores = os.cpu_count()
     print(f"Number of cores: {num_cores}")
+    if ISOLATED_SCANNER_HOMES:
+        warm_up_scanner_cache()
+    metrics = StageMetrics(STAGE_EVENTS_FILE)
+    stopped = start_summary_reporter(
+        metrics, SUMMARY_INTERVAL, prometheus_file=PROMETHEUS_TEXTFILE
+    )
     with Pool(processes=num_cores) as pool:
         pool.map(run_git_part, [row for _, row in samples_df.iterrows()])
+    stopped.set()
+    report_summary(metrics, prometheus_file=PROMETHEUS_TEXTFILE)
+    if ISOLATED_SCANNER_HOMES:
+        harvest_scanner_homes()
 
     # run_sonarqube_issues_part()
     # run_sonarqube_snippets_part()
@@ -0,0 +1,85 @@
+import os
+import shutil
+import subprocess
+
+MIRRORS_FOLDER = os.path.join(
+    os.path.expanduser("~"), ".cache", "sonarqube-analysis", "mirrors"
+)
+# fetch only branches and tags, --mirror would also bring every refs/pull/* from GitHub
+MIRROR_REFSPECS = ("+refs/heads/*:refs/heads/*", "+refs/tags/*:refs/tags/*")
+
+
+def run_git(args, cwd=None):
+    result = subprocess.run(
+        ["git", *args], cwd=cwd, capture_output=True, text=True, check=False
+    )
+    if result.returncode != 0:
+        print(f"git {' '.join(args)} failed: {result.stderr.strip()}")
+    return result
+
+
+def get_repository_name(github_address):
+    return github_address.rstrip("/").split("/")[-1].replace(".git", "")
+
+
+def get_mirror_path(github_address, mirrors_folder=MIRRORS_FOLDER):
+    owner = github_address.rstrip("/").split("/")[-2]
+    return os.path.join(
+        mirrors_folder, owner, f"{get_repository_name(github_address)}.git"
+    )
+
+
+# clone the bare mirror once and only fetch new commits on later runs
+def update_mirror(github_address, mirrors_folder=MIRRORS_FOLDER, partial=False):
+    mirror_path = get_mirror_path(github_address, mirrors_folder)
+    if os.path.exists(os.path.join(mirror_path, "HEAD")):
+        print(f"Fetching new commits into mirror {mirror_path}")
+        run_git(["fetch", "--prune", "--tags", "origin"], cwd=mirror_path)
+        return mirror_path
+
+    print(f"Creating mirror of {github_address} in {mirror_path}")
+    os.makedirs(os.path.dirname(mirror_path), exist_ok=True)
+    clone_args = ["clone", "--bare"]
+    if partial:
+        # blobless clone, file contents are fetched on demand at checkout
+        clone_args.append("--filter=blob:none")
+    result = run_git([*clone_args, github_address, mirror_path])
+    if result.returncode != 0:
+        shutil.rmtree(mirror_path, ignore_errors=True)
+        return None
+
+    run_git(
+        ["config", "--replace-all", "remote.origin.fetch", MIRROR_REFSPECS[0]],
+        cwd=mirror_path,
+    )
+    for refspec in MIRROR_REFSPECS[1:]:
+        run_git(["config", "--add", "remote.origin.fetch", refspec], cwd=mirror_path)
+    return mirror_path
+
+
+# create a detached worktree of the mirror, sharing its object store
+def create_working_copy(mirror_path, work_path, revision="HEAD"):
+    remove_working_copy(mirror_path, work_path)
+    os.makedirs(os.path.dirname(work_path), exist_ok=True)
+    result = run_git(
+        ["worktree", "add", "--force", "--detach", work_path, revision],
+        cwd=mirror_path,
+    )
+    return result.returncode == 0
+
+
+def remove_working_copy(mirror_path, work_path):
+    if os.path.exists(work_path):
+        run_git(["worktree", "remove", "--force", work_path], cwd=mirror_path)
+        shutil.rmtree(work_path, ignore_errors=True)
+    run_git(["worktree", "prune"], cwd=mirror_path)
+
+
+# update the mirror and check out a working copy of it in work_path
+def prepare_repository(
+    github_address, work_path, mirrors_folder=MIRRORS_FOLDER, partial=False
+):
+    mirror_path = update_mirror(github_address, mirrors_folder, partial=partial)
+    if mirror_path is None or not create_working_copy(mirror_path, work_path):
+        return None
+    return mirror_path
@@ -0,0 +1,158 @@
+import os
+import sqlite3
+import time
+
+RUN_STATE_FILE = "data/run_state.sqlite"
+# stages of a commit, in the order they are completed
+STAGES = ("checked_out", "scanned", "ce_done", "issues_fetched")
+
+
+def get_timestamp():
+    return time.strftime("%Y-%m-%d %H:%M:%S")
+
+
+# checkpoint database of the analyzed (sample, commit) pairs, shared by the Pool workers
+class RunState:
+    def __init__(self, path=RUN_STATE_FILE):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.create_tables()
+
+    def create_tables(self):
+        stage_columns = ", ".join(f"{stage}_at TEXT" for stage in STAGES)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS samples ("
+            "sample TEXT PRIMARY KEY, project_created_at TEXT, "
+            "started_at TEXT, finished_at TEXT)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS commits ("
+            "sample TEXT, commit_hash TEXT, position INTEGER, stage TEXT, "
+            f"{stage_columns}, ce_task_id TEXT, ce_status TEXT, error TEXT, "
+            "inherited_from TEXT, updated_at TEXT, PRIMARY KEY (sample, commit_hash))"
+        )
+        # state files created before a column was added
+        columns = {
+            row[1] for row in self.connection.execute("PRAGMA table_info(commits)")
+        }
+        if "inherited_from" not in columns:
+            self.connection.execute(
+                "ALTER TABLE commits ADD COLUMN inherited_from TEXT"
+            )
+
+    def close(self):
+        self.connection.close()
+
+    def is_project_created(self, sample):
+        row = self.connection.execute(
+            "SELECT project_created_at FROM samples WHERE sample = ?", (sample,)
+        ).fetchone()
+        return bool(row and row[0])
+
+    def mark_project_created(self, sample):
+        self.connection.execute(
+            "INSERT INTO samples (sample, project_created_at) VALUES (?, ?) "
+            "ON CONFLICT(sample) DO UPDATE SET "
+            "project_created_at = excluded.project_created_at",
+            (sample, get_timestamp()),
+        )
+
+    def mark_sample_started(self, sample):
+        self.connection.execute(
+            "INSERT INTO samples (sample, started_at) VALUES (?, ?) "
+            "ON CONFLICT(sample) DO UPDATE SET "
+            "started_at = COALESCE(samples.started_at, excluded.started_at), "
+            "finished_at = NULL",
+            (sample, get_timestamp()),
+        )
+
+    def mark_sample_finished(self, sample):
+        self.connection.execute(
+            "UPDATE samples SET finished_at = ? WHERE sample = ?",
+            (get_timestamp(), sample),
+        )
+
+    def is_sample_finished(self, sample):
+        row = self.connection.execute(
+            "SELECT finished_at FROM samples WHERE sample = ?", (sample,)
+        ).fetchone()
+        return bool(row and row[0])
+
+    def mark_stage(self, sample, commit_hash, stage, position=None, **values):
+        timestamp = get_timestamp()
+        columns = {"stage": stage, f"{stage}_at": timestamp, "updated_at": timestamp}
+        if position is not None:
+            columns["position"] = position
+        columns.update(values)
+        assignments = ", ".join(f"{column} = excluded.{column}" for column in columns)
+        self.connection.execute(
+            f"INSERT INTO commits (sample, commit_hash, {', '.join(columns)}) "
+            f"VALUES (?, ?, {', '.join('?' * len(columns))}) "
+            f"ON CONFLICT(sample, commit_hash) DO UPDATE SET {assignments}",
+            (sample, commit_hash, *columns.values()),
+        )
+
+    def mark_error(self, sample, commit_hash, error, **values):
+        columns = {"error": str(error), "updated_at": get_timestamp(), **values}
+        assignments = ", ".join(f"{column} = excluded.{column}" for column in columns)
+        self.connection.execute(
+            f"INSERT INTO commits (sample, commit_hash, {', '.join(columns)}) "
+            f"VALUES (?, ?, {', '.join('?' * len(columns))}) "
+            f"ON CONFLICT(sample, commit_hash) DO UPDATE SET {assignments}",
+            (sample, commit_hash, *columns.values()),
+        )
+
+    def get_commit(self, sample, commit_hash):
+        cursor = self.connection.execute(
+            "SELECT * FROM commits WHERE sample = ? AND commit_hash = ?",
+            (sample, commit_hash),
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([column[0] for column in cursor.description], row))
+
+    def get_stage(self, sample, commit_hash):
+        commit = self.get_commit(sample, commit_hash)
+        return commit["stage"] if commit else None
+
+    def has_reached(self, sample, commit_hash, stage):
+        current_stage = self.get_stage(sample, commit_hash)
+        if current_stage not in STAGES:
+            return False
+        return STAGES.index(current_stage) >= STAGES.index(stage)
+
+    # hashes of the commits of a sample that reached the given stage
+    def get_commits_at_stage(self, sample, stage=STAGES[-1]):
+        stages = STAGES[STAGES.index(stage) :]
+        rows = self.connection.execute(
+            f"SELECT commit_hash FROM commits WHERE sample = ? "
+            f"AND stage IN ({', '.join('?' * len(stages))})",
+            (sample, *stages),
+        ).fetchall()
+        return {row[0] for row in rows}
+
+    # whether every given commit of a sample reached the stage, the inherited ones included
+    def has_completed(self, sample, commit_hashes, stage=STAGES[-1]):
+        return not set(commit_hashes) - self.get_commits_at_stage(sample, stage)
+
+    # position of the latest commit of a sample that reached the given stage
+    def get_last_position(self, sample, stage=STAGES[-1]):
+        stages = STAGES[STAGES.index(stage) :]
+        row = self.connection.execute(
+            f"SELECT MAX(position) FROM commits WHERE sample = ? "
+            f"AND stage IN ({', '.join('?' * len(stages))})",
+            (sample, *stages),
+        ).fetchone()
+        return row[0] if row and row[0] is not None else -1
+
+    def get_stage_counts(self, sample=None):
+        query = "SELECT stage, COUNT(*) FROM commits"
+        params = ()
+        if sample is not None:
+            query += " WHERE sample = ?"
+            params = (sample,)
+        return dict(self.connection.execute(f"{query} GROUP BY stage", params))
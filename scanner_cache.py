@@ -0,0 +1,93 @@
+import os
+import shutil
+import subprocess
+import tempfile
+
+SCANNER_HOMES_FOLDER = os.path.join(
+    os.path.expanduser("~"), ".cache", "sonarqube-analysis", "scanner-homes"
+)
+# user home whose plugin and JRE cache seeds the worker homes
+SEED_USER_HOME = os.environ.get(
+    "SONAR_USER_HOME", os.path.join(os.path.expanduser("~"), ".sonar")
+)
+CACHE_FOLDER = "cache"
+# throwaway project scanned once into the seed home before the workers start
+WARM_UP_PROJECT_KEY = "scanner-cache-warm-up"
+
+
+# copy the cached files missing in target, hard linked when possible
+def copy_cache(source, target):
+    copied = 0
+    for root, _, files in os.walk(source):
+        target_root = os.path.join(target, os.path.relpath(root, source))
+        for file_name in files:
+            # skip the partial downloads and lock files of a running scanner
+            if file_name.startswith("_") or file_name.endswith((".lock", ".tmp")):
+                continue
+            target_path = os.path.join(target_root, file_name)
+            if os.path.exists(target_path):
+                continue
+            os.makedirs(target_root, exist_ok=True)
+            try:
+                os.link(os.path.join(root, file_name), target_path)
+            except OSError:
+                shutil.copy2(os.path.join(root, file_name), target_path)
+            copied += 1
+    return copied
+
+
+# scan a project with an empty file of every extension into the seed home, so it holds the
+# scanner engine and the plugins of every language before the worker homes are seeded
+def warm_up_seed_cache(command, extensions, seed_user_home=SEED_USER_HOME):
+    with tempfile.TemporaryDirectory(prefix="scanner-warm-up-") as project_path:
+        for extension in set(extensions):
+            file_name = (
+                f"warm_up{extension}" if extension.startswith(".") else extension
+            )
+            open(os.path.join(project_path, file_name), "w").close()
+        result = subprocess.run(
+            command,
+            shell=True,
+            check=False,
+            cwd=project_path,
+            env=dict(os.environ, SONAR_USER_HOME=seed_user_home),
+        )
+    if result.returncode != 0:
+        print("Scanner warm-up failed, the workers download their own cache")
+    return result.returncode == 0
+
+
+# user home of a worker, warmed from the seed cache the first time it is used in a run
+def get_scanner_home(
+    name=None, homes_folder=SCANNER_HOMES_FOLDER, seed_user_home=SEED_USER_HOME
+):
+    scanner_home = os.path.join(homes_folder, name or f"worker-{os.getpid()}")
+    if not os.path.isdir(scanner_home):
+        copy_cache(
+            os.path.join(seed_user_home, CACHE_FOLDER),
+            os.path.join(scanner_home, CACHE_FOLDER),
+        )
+        os.makedirs(scanner_home, exist_ok=True)
+    return scanner_home
+
+
+# environment of a scanner run, SONAR_USER_HOME is honoured by both scanners
+def get_scanner_env(name=None):
+    return dict(os.environ, SONAR_USER_HOME=get_scanner_home(name))
+
+
+# move what the workers downloaded into the seed cache and remove their homes
+def harvest_scanner_homes(
+    homes_folder=SCANNER_HOMES_FOLDER, seed_user_home=SEED_USER_HOME
+):
+    if not os.path.isdir(homes_folder):
+        return
+    copied = 0
+    for entry in os.scandir(homes_folder):
+        if entry.is_dir():
+            copied += copy_cache(
+                os.path.join(entry.path, CACHE_FOLDER),
+                os.path.join(seed_user_home, CACHE_FOLDER),
+            )
+            shutil.rmtree(entry.path, ignore_errors=True)
+    print(f"Added {copied} files to the scanner cache {seed_user_home}")
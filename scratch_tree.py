@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+
+from repository_cache import create_working_copy, remove_working_copy, run_git
+
+# RAM-backed when /dev/shm is available
+SCRATCH_ROOT = os.path.join(
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),
+    "sonarqube-analysis",
+)
+SCRATCH_MAX_BYTES = 2 * 1024**3
+
+
+# worktree in a scratch directory each commit is checked out to, reused between commits
+class ScratchTree:
+    def __init__(
+        self, repository_path, name, root=SCRATCH_ROOT, max_bytes=SCRATCH_MAX_BYTES
+    ):
+        self.repository_path = repository_path
+        self.path = os.path.join(root, name)
+        self.max_bytes = max_bytes
+        # the repository the scratch worktree belongs to, None until it is created
+        self.attached_to = None
+
+    def get_tree_size(self, commit_hash):
+        result = run_git(
+            ["ls-tree", "-r", "-l", "--full-tree", commit_hash],
+            cwd=self.repository_path,
+        )
+        size = 0
+        for line in result.stdout.splitlines():
+            fields = line.split(None, 4)
+            # submodules have no size
+            if len(fields) == 5 and fields[3].isdigit():
+                size += int(fields[3])
+        return size
+
+    # check out the commit without touching the working copy, None when it is above the cap
+    # a worktree keeps the content of a checkout (no export-ignore or export-subst) and
+    # the .git the scanner blames
+    def export(self, commit_hash):
+        tree_size = self.get_tree_size(commit_hash)
+        if tree_size > self.max_bytes:
+            print(
+                f"Tree of {commit_hash} has {tree_size} bytes, above the "
+                f"{self.max_bytes} bytes scratch cap"
+            )
+            return None
+
+        repository_path = os.path.abspath(self.repository_path)
+        if self.attached_to != repository_path:
+            self.remove()
+            if not create_working_copy(repository_path, self.path, commit_hash):
+                print(f"Failed to create the scratch worktree {self.path}")
+                return None
+            self.attached_to = repository_path
+            return self.path
+
+        checkout = run_git(
+            ["checkout", "--force", "--detach", commit_hash], cwd=self.path
+        )
+        # untracked and ignored files, like build outputs, are not part of the commit
+        clean = run_git(["clean", "-ffdxq"], cwd=self.path)
+        if checkout.returncode != 0 or clean.returncode != 0:
+            print(f"Failed to check out {commit_hash} in {self.path}")
+            self.remove()
+            return None
+        return self.path
+
+    def remove(self):
+        if self.attached_to is not None:
+            remove_working_copy(self.attached_to, self.path)
+            self.attached_to = None
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+# remove the scratch trees left by worker processes
+def remove_scratch_trees(prefix="worker-", root=SCRATCH_ROOT):
+    if os.path.isdir(root):
+        for entry in os.scandir(root):
+            if entry.name.startswith(prefix):
+                shutil.rmtree(entry.path, ignore_errors=True)
@@ -1,17 +1,81 @@
 from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import requests
 import os
 import subprocess
 import time
-import csv
 from requests.exceptions import JSONDecodeError
 
+from commit_log import iter_commit_log
+from commit_sampling import BISECT_CHECKPOINTS, bisect_commits, sample_commits
+from commit_scheduler import CommitScheduler
+from commit_selection import SOURCE_EXTENSIONS, select_commits
+from issue_deltas import ISSUE_STATE_FILE, IssueStateIndex, diff_issues, is_closed
+from issue_store import ISSUE_STORE_PATH, IssueStore
+from run_state import RUN_STATE_FILE, RunState
+from scanner_cache import (
+    WARM_UP_PROJECT_KEY,
+    get_scanner_env,
+    harvest_scanner_homes,
+    warm_up_seed_cache,
+)
+from scratch_tree import ScratchTree, remove_scratch_trees
+from sonarqube_ce import (
+    CE_TASK_TIMEOUT,
+    clear_report_task,
+    get_report_task_id,
+    wait_for_ce_task,
+)
+from repository_cache import (
+    get_repository_name,
+    prepare_repository,
+    remove_working_copy,
+    update_mirror,
+)
+from sonarqube_client import get_client
+from sonarqube_issues import fetch_all_issues, fetch_changed_issues
+from stage_metrics import (
+    STAGE_EVENTS_FILE,
+    SUMMARY_INTERVAL,
+    StageMetrics,
+    report_summary,
+    stage_timer,
+    start_summary_reporter,
+)
 
 SONAR_URL = ""
 SONAR_LOGIN = ""
 SONAR_PASSWORD = ""
-COMMITS_REPORT_FILE = "../../commits_report.csv"
+SONAR_POOL_SIZE = 16
+PARTIAL_CLONE = False
+# "commit" schedules every (sample, commit) over the workers, "repository" runs one sample per worker
+SCHEDULER_MODE = "commit"
+MAX_CE_PENDING = 8
+MIRROR_UPDATE_THREADS = 8
+# scan commits checked out in a worktree in a RAM-backed scratch directory instead of
+# checking them out in the working copy
+EXPORT_COMMITS = False
+# commits without source changes, or with a tree already scanned, inherit a previous result
+SKIP_UNCHANGED_COMMITS = True
+# "all", "nth", "day", "week", "tags", "first_parent", or "bisect" to scan checkpoints and
+# only bisect between the ones whose issues differ
+COMMIT_SAMPLING = "all"
+# bisection probes go back in history, so they are scanned into a throwaway project
+# with this suffix and only the commits they select are scanned in order into the sample
+BISECT_PROBE_SUFFIX = "-bisect"
+# every worker scans with its own SONAR_USER_HOME, seeded from a warmed ~/.sonar/cache
+ISOLATED_SCANNER_HOMES = True
+# workers write every commit to its own shard, merged per sample in commit order
+SHARDED_OUTPUT = True
+# also write the live progress summary to this Prometheus textfile, None disables it
+PROMETHEUS_TEXTFILE = None
+# "full" stores every issue of every commit, "delta" fetches and stores only the issues
+# opened, fixed, reopened or changed since the previous analysis
+ISSUE_RETRIEVAL = "full"
+# a delta only follows functional changes, issues that moved with the code keep their
+# previous line, textRange and hash until every issue is fetched again at least this often
+ISSUE_FULL_SNAPSHOT_EVERY = 20
 
 
 samples_df = pd.read_csv(
@@ -23,10 +87,15 @@ samples_df = pd.read_csv(
 
 script_dir = os.path.dirname(os.path.abspath(__file__))
 samples_folder = os.path.join(script_dir, "samples")
+ISSUE_STORE_PATH = os.path.join(script_dir, ISSUE_STORE_PATH)
+RUN_STATE_FILE = os.path.join(script_dir, RUN_STATE_FILE)
+STAGE_EVENTS_FILE = os.path.join(script_dir, STAGE_EVENTS_FILE)
 
 
-def run_shell_command(command):
-    result = subprocess.run(command, shell=True, capture_output=True, text=True)
+def run_shell_command(command, cwd=None, env=None):
+    result = subprocess.run(
+        command, shell=True, capture_output=True, text=True, cwd=cwd, env=env
+    )
     return result.stdout.strip()
 
 
@@ -54,19 +123,30 @@ def get_main_branch():
         return None
 
 
+# time a stage of a sample or commit into the stage events file
+def time_stage(stage, sample_name=None, commit_hash=None):
+    return stage_timer(stage, sample_name, commit_hash, STAGE_EVENTS_FILE)
+
+
+def get_sonar_client():
+    return get_client(
+        SONAR_URL, auth=(SONAR_LOGIN, SONAR_PASSWORD), pool_size=SONAR_POOL_SIZE
+    )
+
+
 def create_sonarqube_project(sample_name):
     print(f"Creating SonarQube project for {sample_name}")
 
-    url = f"{SONAR_URL}/api/projects/create"
     data = {"name": f"{sample_name}", "project": f"{sample_name}"}
-    response = requests.post(url, data=data, auth=(SONAR_LOGIN, SONAR_PASSWORD))
+    response = get_sonar_client().post("api/projects/create", data=data)
     print(response.text)
     return response
 
 
 def clone_repository(github_address):
-    os.system(
-        f'git clone {github_address} {samples_folder}/{github_address.split("/")[-1].replace(".git", "")}'
+    repository_name = get_repository_name(github_address)
+    return prepare_repository(
+        github_address, f"{samples_folder}/{repository_name}", partial=PARTIAL_CLONE
     )
 
 
@@ -79,21 +159,24 @@ def git_checkout(commit_hash):
     return True
 
 
-def create_sonar_scanner_config(sample_name, token):
-    print(f"Creating sonar-scanner configuration file for {sample_name}")
-    with open("sonar-project.properties", "w") as f:
-        f.write(
-            f"sonar.projectKey={sample_name}\nsonar.sources=.\nsonar.host.url={SONAR_URL}\nsonar.token={token}"
-        )
-
-
-def run_sonar_scanner(commit_hash, commit_date, project_key, token):
-    result = run_shell_command(
+def get_sonar_scanner_command(commit_hash, commit_date, project_key, token):
+    command = (
         f"sonar-scanner -Dsonar.projectKey={project_key} "
         f"-Dsonar.sources=. -Dsonar.host.url={SONAR_URL} "
         f"-Dsonar.token={token} "
-        f"-Dsonar.projectVersion={commit_hash} "
-        f"-Dsonar.projectDate={commit_date}"
+        f"-Dsonar.projectVersion={commit_hash}"
+    )
+    # SonarQube rejects a project date older than the last analysis
+    if commit_date:
+        command += f" -Dsonar.projectDate={commit_date}"
+    return command
+
+
+def run_sonar_scanner(commit_hash, commit_date, project_key, token, cwd=None):
+    result = run_shell_command(
+        get_sonar_scanner_command(commit_hash, commit_date, project_key, token),
+        cwd=cwd,
+        env=get_scanner_env() if ISOLATED_SCANNER_HOMES else None,
     )
 
     if "error" in result.lower():
@@ -101,14 +184,27 @@ def run_sonar_scanner(commit_hash, commit_date, project_key, token):
         print(result)
 
 
+def get_issue_search_params(project_key):
+    return {
+        "components": project_key,
+        "s": "FILE_LINE",
+        "issueStatuses": "ACCEPTED,CONFIRMED,FALSE_POSITIVE,FIXED,OPEN",
+        "facets": "cleanCodeAttributeCategories,impactSoftwareQualities,codeVariants",
+        "additionalFields": "_all",
+        "timeZone": "America/Sao_Paulo",
+    }
+
+
 def get_issues_detected(project_key, token):
     print(f"Getting issues for project {project_key} - {token}")
-    url = f"{SONAR_URL}/api/issues/search?components={project_key}&s=FILE_LINE&issueStatuses=ACCEPTED,CONFIRMED,FALSE_POSITIVE,FIXED,OPEN&ps=500&facets=cleanCodeAttributeCategories,impactSoftwareQualities,codeVariants&additionalFields=_all&timeZone=America/Sao_Paulo"
     headers = {"Authorization": f"Bearer {token}"}
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        issues = response.json()
+        issues = fetch_all_issues(
+            get_sonar_client(),
+            get_issue_search_params(project_key),
+            max_workers=SONAR_POOL_SIZE,
+            headers=headers,
+        )
         return issues
     except JSONDecodeError as e:
         print(f"Erro ao decodificar a resposta JSON: {e}")
@@ -118,13 +214,64 @@ def get_issues_detected(project_key, token):
         return None
 
 
+def use_issue_deltas():
+    return ISSUE_RETRIEVAL == "delta"
+
+
+worker_state_indexes = {}
+
+
+# issue state index of the current process, shared by the commits it analyzes
+def get_issue_state_index():
+    key = (os.getpid(), ISSUE_STORE_PATH)
+    if key not in worker_state_indexes:
+        worker_state_indexes[key] = IssueStateIndex(
+            os.path.join(ISSUE_STORE_PATH, ISSUE_STATE_FILE)
+        )
+    return worker_state_indexes[key]
+
+
+# the issues updated since the previous analysis, None when the store does not hold the
+# issues of that analysis, when too many changed or when a full snapshot is due, so every
+# issue must be fetched
+def get_issues_changed(project_key, token, commit_hash, index):
+    sample_state = index.get_sample_state(project_key)
+    if sample_state is None or sample_state["deltas"] >= ISSUE_FULL_SNAPSHOT_EVERY:
+        return None
+    headers = {"Authorization": f"Bearer {token}"}
+    try:
+        response = get_sonar_client().get(
+            "api/project_analyses/search",
+            params={"project": project_key, "ps": 2},
+            headers=headers,
+        )
+        response.raise_for_status()
+        analyses = response.json().get("analyses", [])
+        if (
+            len(analyses) < 2
+            or analyses[0].get("projectVersion") != commit_hash
+            or analyses[1].get("projectVersion") != sample_state["state_of"]
+        ):
+            return None
+        print(f"Getting issues changed since {analyses[1]['date']} for {project_key}")
+        return fetch_changed_issues(
+            get_sonar_client(),
+            get_issue_search_params(project_key),
+            analyses[1]["date"],
+            headers=headers,
+        )
+    except (JSONDecodeError, requests.RequestException) as e:
+        print(f"Failed to get the issues changed in {project_key}: {e}")
+        return None
+
+
 def generate_sonarqube_token(project_key):
     print(f"Generating token for project {project_key}")
 
     token_name = f"token_{project_key}"
 
-    url_list = f"{SONAR_URL}/api/user_tokens/search"
-    response_list = requests.get(url_list, auth=(SONAR_LOGIN, SONAR_PASSWORD))
+    client = get_sonar_client()
+    response_list = client.get("api/user_tokens/search")
 
     if response_list.status_code == 200:
         existing_tokens = response_list.json().get("userTokens", [])
@@ -133,10 +280,9 @@ def generate_sonarqube_token(project_key):
             if token["name"] == token_name:
                 print(f"Token '{token_name}' já existe. Excluindo o token antigo...")
 
-                url_revoke = f"{SONAR_URL}/api/user_tokens/revoke"
                 data_revoke = {"name": token_name}
-                response_revoke = requests.post(
-                    url_revoke, data=data_revoke, auth=(SONAR_LOGIN, SONAR_PASSWORD)
+                response_revoke = client.post(
+                    "api/user_tokens/revoke", data=data_revoke
                 )
 
                 if response_revoke.status_code == 204:
@@ -145,11 +291,8 @@ def generate_sonarqube_token(project_key):
                     print(f"Falha ao excluir o token: {response_revoke.text}")
                     return None
 
-        url_generate = f"{SONAR_URL}/api/user_tokens/generate"
         data = {"name": token_name, "login": SONAR_LOGIN}
-        response_generate = requests.post(
-            url_generate, data=data, auth=(SONAR_LOGIN, SONAR_PASSWORD)
-        )
+        response_generate = client.post("api/user_tokens/generate", data=data)
 
         if response_generate.status_code == 200:
             token = response_generate.json().get("token")
@@ -163,78 +306,619 @@ def generate_sonarqube_token(project_key):
         return None
 
 
-def delete_repository(repository_name):
-    os.system(f"rm -rf {repository_name}")
+def delete_repository(mirror_path, repository_name):
+    remove_working_copy(mirror_path, repository_name)
+
+
+worker_scratch_trees = {}
+
+
+# scratch tree of the current process, reused for every commit it analyzes
+def get_scratch_tree(repository_path):
+    pid = os.getpid()
+    if pid not in worker_scratch_trees:
+        worker_scratch_trees[pid] = ScratchTree(repository_path, f"worker-{pid}")
+    scratch_tree = worker_scratch_trees[pid]
+    scratch_tree.repository_path = repository_path
+    return scratch_tree
+
+
+# check the commit out in the scratch tree, or in the working copy when exporting is
+# disabled or not possible
+def materialize_commit(commit_hash):
+    if EXPORT_COMMITS:
+        work_dir = get_scratch_tree(os.getcwd()).export(commit_hash)
+        if work_dir is not None:
+            print(f"Checked out {commit_hash} in {work_dir}")
+            return work_dir
+    git_checkout(commit_hash)
+    return "."
+
+
+# the (position, hash) pairs of a sample still to analyze
+def get_pending_commits(sample_name, commits, run_state):
+    # analyses must reach SonarQube in commit order, so resume from the last scanned commit;
+    # the commits before it are only those that ended in an error, they are retried
+    last_position = run_state.get_last_position(sample_name, "scanned")
+    if last_position >= 0:
+        print(f"Resuming {sample_name} at commit {last_position + 1}/{len(commits)}")
+    analyzed_commits = run_state.get_commits_at_stage(sample_name, "issues_fetched")
+    return [
+        (position, commit_hash)
+        for position, commit_hash in enumerate(commits)
+        if commit_hash not in analyzed_commits
+    ]
+
+
+# record a commit that was not scanned with the issues of the commit it inherits
+def inherit_commit(
+    sample_name, commit_hash, position, source_hash, run_state, store, commit_date=None
+):
+    commit_date = commit_date or get_commit_date(commit_hash)
+    current_date = time.strftime("%Y-%m-%d %H:%M:%S")
+    index = get_issue_state_index() if use_issue_deltas() else None
+    sample_state = index.get_sample_state(sample_name) if index else None
+    if sample_state and source_hash in (
+        sample_state["state_of"],
+        sample_state["last_commit"],
+    ):
+        # same issues as the previous commit, an empty delta
+        store.append_delta(
+            sample_name,
+            commit_hash,
+            commit_date,
+            current_date,
+            [],
+            position,
+            inherited_from=source_hash,
+            previous_hash=sample_state["last_commit"],
+        )
+        index.update(sample_name, commit_hash, sample_state["state_of"])
+    else:
+        issues = store.append_inherited_commit(
+            sample_name, commit_hash, commit_date, current_date, source_hash, position
+        )
+        if issues is None:
+            print(
+                f"Skipping commit {commit_hash}: no result of {source_hash} to inherit"
+            )
+            run_state.mark_error(
+                sample_name,
+                commit_hash,
+                f"no result of {source_hash} to inherit",
+                position=position,
+            )
+            return False
+        if index:
+            index.update(sample_name, commit_hash, source_hash, issues, full=True)
+    print(f"Commit {commit_hash} inherits the issues of {source_hash}")
+    run_state.mark_stage(
+        sample_name,
+        commit_hash,
+        "issues_fetched",
+        position=position,
+        inherited_from=source_hash,
+    )
+    return True
+
+
+# analyze one commit of the repository in the current directory
+def analyze_commit(
+    sample_name,
+    token,
+    commit_hash,
+    position,
+    run_state,
+    store,
+    inherited_from=None,
+    commit_date=None,
+):
+    with time_stage("commit", sample_name, commit_hash) as event:
+        event["inherited"] = inherited_from is not None
+        event["ok"] = run_commit_stages(
+            sample_name,
+            token,
+            commit_hash,
+            position,
+            run_state,
+            store,
+            inherited_from,
+            commit_date,
+        )
+    return event["ok"]
+
+
+# checkout, scan, CE wait, issue fetch and write of a commit, each one timed
+def run_commit_stages(
+    sample_name,
+    token,
+    commit_hash,
+    position,
+    run_state,
+    store,
+    inherited_from=None,
+    commit_date=None,
+):
+    if inherited_from is not None:
+        with time_stage("write", sample_name, commit_hash):
+            return inherit_commit(
+                sample_name,
+                commit_hash,
+                position,
+                inherited_from,
+                run_state,
+                store,
+                commit_date,
+            )
+
+    commit_state = run_state.get_commit(sample_name, commit_hash) or {}
+
+    commit_date = commit_date or get_commit_date(commit_hash)
+    print(f"Commit date: {commit_date}")
+
+    # a commit interrupted while SonarQube was processing it is not scanned again, unless
+    # a later commit was scanned since, its analysis is then no longer the latest one
+    task_id = commit_state.get("ce_task_id")
+    retried = position < run_state.get_last_position(sample_name, "scanned")
+    if (
+        retried
+        or commit_state.get("stage") not in ("scanned", "ce_done")
+        or commit_state.get("ce_status") not in (None, "SUCCESS")
+    ):
+        with time_stage("checkout", sample_name, commit_hash):
+            work_dir = materialize_commit(commit_hash)
+        run_state.mark_stage(sample_name, commit_hash, "checked_out", position=position)
+
+        clear_report_task(work_dir)
+        with time_stage("scanner", sample_name, commit_hash) as event:
+            # SonarQube refuses an analysis dated before the latest one, a retried
+            # commit keeps the current date like the bisection probes
+            run_sonar_scanner(
+                commit_hash,
+                None if retried else commit_date,
+                sample_name,
+                token,
+                cwd=work_dir,
+            )
+            task_id = get_report_task_id(work_dir)
+            event["ok"] = task_id is not None
+        run_state.mark_stage(
+            sample_name,
+            commit_hash,
+            "scanned",
+            ce_task_id=task_id,
+            ce_status=None,
+            error=None,
+        )
 
+    if retried or commit_state.get("stage") != "ce_done":
+        print("Waiting for SonarQube to process analysis...")
+        with time_stage("ce_wait", sample_name, commit_hash) as event:
+            ce_status = (
+                wait_for_ce_task(
+                    get_sonar_client(), task_id, token, timeout=CE_TASK_TIMEOUT
+                )
+                if task_id
+                else None
+            )
+            event["ok"] = ce_status == "SUCCESS"
+        if ce_status != "SUCCESS":
+            print(f"Skipping issues for commit {commit_hash}: {ce_status}")
+            run_state.mark_error(
+                sample_name,
+                commit_hash,
+                f"CE task status {ce_status}",
+                ce_status=ce_status or "TIMEOUT",
+            )
+            return False
+        run_state.mark_stage(sample_name, commit_hash, "ce_done", ce_status=ce_status)
+
+    index = get_issue_state_index() if use_issue_deltas() else None
+    with time_stage("issue_fetch", sample_name, commit_hash) as event:
+        changed_issues = (
+            get_issues_changed(sample_name, token, commit_hash, index)
+            if index
+            else None
+        )
+        issues_detected = (
+            get_issues_detected(sample_name, token) if changed_issues is None else {}
+        )
+        event["ok"] = issues_detected is not None
+        event["delta"] = changed_issues is not None
+        event["issues"] = len(
+            changed_issues
+            if changed_issues is not None
+            else (issues_detected or {}).get("issues", [])
+        )
+    if issues_detected is None:
+        print(f"Skipping commit {commit_hash}: issues not retrieved")
+        run_state.mark_error(sample_name, commit_hash, "issues not retrieved")
+        return False
+    current_date = time.strftime("%Y-%m-%d %H:%M:%S")
+
+    with time_stage("write", sample_name, commit_hash):
+        if changed_issues is not None:
+            sample_state = index.get_sample_state(sample_name)
+            changes = diff_issues(
+                index.get_issues(
+                    sample_name, (issue["key"] for issue in changed_issues)
+                ),
+                changed_issues,
+            )
+            store.append_delta(
+                sample_name,
+                commit_hash,
+                commit_date,
+                current_date,
+                changes,
+                position,
+                previous_hash=sample_state["last_commit"],
+            )
+            index.update(sample_name, commit_hash, commit_hash, changes)
+        else:
+            store.append_commit(
+                sample_name,
+                commit_hash,
+                commit_date,
+                current_date,
+                issues_detected,
+                position,
+            )
+            if index:
+                index.update(
+                    sample_name,
+                    commit_hash,
+                    commit_hash,
+                    issues_detected.get("issues", []),
+                    full=True,
+                )
+    run_state.mark_stage(sample_name, commit_hash, "issues_fetched")
+    return True
 
-def analyze_commits(sample_name, token):
-    print(f"Analyzing commits for {sample_name}")
 
-    commits = run_shell_command("git rev-list --all --reverse").splitlines()
-    count = 0
-    num_commits = len(commits)
-    print("Number of commits:", num_commits)
+def analyze_commits(sample_name, token, run_state):
+    print(f"Analyzing commits for {sample_name}")
 
-    with open(COMMITS_REPORT_FILE, mode="w", newline="") as file:
-        writer = csv.writer(file)
-        writer.writerow(["Sample", "Commit Hash", "Date", "Analysis Date", "Issues"])
+    with time_stage("enumerate_commits", sample_name) as event:
+        records = {record.hash: record for record in iter_commit_log(".")}
+        commits = list(records)
+        num_commits = len(commits)
+        print("Number of commits:", num_commits)
+        if COMMIT_SAMPLING != "bisect":
+            commits = sample_commits(".", commits, COMMIT_SAMPLING)
+            num_commits = len(commits)
+            inherited_commits = (
+                select_commits(".", commits, records=records)
+                if SKIP_UNCHANGED_COMMITS
+                else {}
+            )
+            pending_commits = get_pending_commits(sample_name, commits, run_state)
+            event["commits"] = len(pending_commits)
+
+    store = IssueStore(ISSUE_STORE_PATH, sharded=SHARDED_OUTPUT)
+    if COMMIT_SAMPLING == "bisect":
+        return analyze_commits_by_bisection(
+            sample_name, token, records, run_state, store
+        )
 
-        for commit_hash in commits:
-            try:
+    for position, commit_hash in pending_commits:
+        try:
+            print(f"Analyzing commit {position + 1}/{num_commits} {commit_hash}...")
+            analyze_commit(
+                sample_name,
+                token,
+                commit_hash,
+                position,
+                run_state,
+                store,
+                inherited_commits.get(commit_hash),
+                records[commit_hash].date,
+            )
+        except Exception as e:
+            print(f"Erro ao analisar o commit {commit_hash}: {str(e)}")
+            run_state.mark_error(sample_name, commit_hash, e)
+    return run_state.has_completed(sample_name, commits)
+
+
+# what identifies an open issue by the code it is found in rather than by its key, which
+# depends on the analyses made before in the same project
+def get_open_issue_fingerprints(issues):
+    return frozenset(
+        (
+            issue.get("rule"),
+            issue.get("component", "").split(":", 1)[-1],
+            issue.get("hash") or issue.get("line"),
+            issue.get("message"),
+        )
+        for issue in issues
+        if not is_closed(issue)
+    )
 
-                git_checkout(commit_hash)
 
-                count += 1
-                print(f"Analyzing commit {count}/{num_commits} {commit_hash}...")
+# scan a commit into the throwaway bisection project, its issues or None when it failed
+def probe_commit(probe_key, probe_token, commit_hash):
+    work_dir = materialize_commit(commit_hash)
+    clear_report_task(work_dir)
+    # the probes go back in history, their analyses keep the current date
+    run_sonar_scanner(commit_hash, None, probe_key, probe_token, cwd=work_dir)
+    task_id = get_report_task_id(work_dir)
+    ce_status = (
+        wait_for_ce_task(
+            get_sonar_client(), task_id, probe_token, timeout=CE_TASK_TIMEOUT
+        )
+        if task_id
+        else None
+    )
+    if ce_status != "SUCCESS":
+        print(f"Bisection probe of {commit_hash} failed: {ce_status}")
+        return None
+    issues_detected = get_issues_detected(probe_key, probe_token)
+    return issues_detected.get("issues", []) if issues_detected else None
 
-                commit_date = get_commit_date(commit_hash)
-                print(f"Commit date: {commit_date}")
 
-                run_sonar_scanner(commit_hash, commit_date, sample_name, token)
+def delete_sonarqube_project(project_key):
+    response = get_sonar_client().post(
+        "api/projects/delete", data={"project": project_key}
+    )
+    if not response.ok:
+        print(f"Failed to delete project {project_key}: {response.text}")
+    return response
 
-                print("Waiting for SonarQube to process analysis...")
-                time.sleep(15)
 
-                issues_detected = get_issues_detected(sample_name, token)
-                current_date = time.strftime("%Y-%m-%d %H:%M:%S")
+# the workers are seeded from ~/.sonar/cache, so one scan fills it before they start
+# instead of every worker downloading the scanner engine and plugins on its first scan
+def warm_up_scanner_cache():
+    create_sonarqube_project(WARM_UP_PROJECT_KEY)
+    token = generate_sonarqube_token(WARM_UP_PROJECT_KEY)
+    if token is None:
+        print("Failed to generate the scanner warm-up token")
+        return False
+    with time_stage("scanner_warm_up") as event:
+        event["ok"] = warm_up_seed_cache(
+            get_sonar_scanner_command("warm-up", None, WARM_UP_PROJECT_KEY, token),
+            SOURCE_EXTENSIONS,
+        )
+    delete_sonarqube_project(WARM_UP_PROJECT_KEY)
+    return event["ok"]
+
+
+# probe checkpoints and bisect between the ones whose open issues differ, then scan the
+# selected commits in commit order, so SonarQube tracks the issues of the sample as if
+# those were its only commits
+def analyze_commits_by_bisection(sample_name, token, records, run_state, store):
+    commits = list(records)
+    probe_key = f"{sample_name}{BISECT_PROBE_SUFFIX}"
+    create_sonarqube_project(probe_key)
+    probe_token = generate_sonarqube_token(probe_key)
+    fingerprints = {}
+
+    def probe(position, commit_hash):
+        # a commit scanned in order by a previous run already has its snapshot
+        if run_state.has_reached(sample_name, commit_hash, "issues_fetched"):
+            issues = store.get_commit_issues(sample_name, commit_hash)
+        else:
+            print(f"Probing commit {position + 1}/{len(commits)} {commit_hash}...")
+            with time_stage("bisect_probe", sample_name, commit_hash) as event:
+                issues = probe_commit(probe_key, probe_token, commit_hash)
+                event["ok"] = issues is not None
+        if issues is None:
+            return False
+        fingerprints[commit_hash] = get_open_issue_fingerprints(issues)
+        return True
 
-                writer.writerow(
-                    [
-                        sample_name,
-                        commit_hash,
-                        commit_date,
-                        current_date,
-                        issues_detected,
-                    ]
-                )
-            except Exception as e:
-                print(f"Erro ao analisar o commit {commit_hash}: {str(e)}")
+    try:
+        selected_commits = bisect_commits(
+            commits, probe, fingerprints.get, BISECT_CHECKPOINTS
+        )
+    finally:
+        delete_sonarqube_project(probe_key)
+
+    positions = {commit_hash: position for position, commit_hash in enumerate(commits)}
+    for commit_hash in selected_commits:
+        if run_state.has_reached(sample_name, commit_hash, "issues_fetched"):
+            continue
+        position = positions[commit_hash]
+        print(f"Analyzing commit {position + 1}/{len(commits)} {commit_hash}...")
+        try:
+            analyze_commit(
+                sample_name,
+                token,
+                commit_hash,
+                position,
+                run_state,
+                store,
+                commit_date=records[commit_hash].date,
+            )
+        except Exception as e:
+            print(f"Erro ao analisar o commit {commit_hash}: {str(e)}")
+            run_state.mark_error(sample_name, commit_hash, e)
+    return run_state.has_completed(sample_name, selected_commits)
 
 
 def run_git_part(row):
     sample_name, github_address = row["sample_name"], row["github_address"]
-    create_sonarqube_project(sample_name)
+    run_state = RunState(RUN_STATE_FILE)
+    if run_state.is_sample_finished(sample_name):
+        print(f"Skipping {sample_name}, already analyzed")
+        run_state.close()
+        return
+    run_state.mark_sample_started(sample_name)
+
+    if not run_state.is_project_created(sample_name):
+        response = create_sonarqube_project(sample_name)
+        if response.ok or "already exists" in response.text:
+            run_state.mark_project_created(sample_name)
     token = generate_sonarqube_token(sample_name)
     print(f"Running SonarQube git clone for {sample_name}")
-    clone_repository(github_address)
+    with time_stage("clone", sample_name) as event:
+        mirror_path = clone_repository(github_address)
+        event["ok"] = mirror_path is not None
+    if mirror_path is None:
+        print(f"Failed to clone {github_address}")
+        run_state.close()
+        return
     repository_name = github_address.split("/")[-1].replace(".git", "")
     os.chdir(f"{samples_folder}/{repository_name}")
     print(f"cd  {samples_folder}/{repository_name}")
-    create_sonar_scanner_config(sample_name, token)
 
-    analyze_commits(sample_name, token)
+    completed = analyze_commits(sample_name, token, run_state)
+    IssueStore(ISSUE_STORE_PATH).merge_shards([sample_name])
+    # a sample with failed commits is resumed by the next run
+    if completed:
+        run_state.mark_sample_finished(sample_name)
+    else:
+        print(f"{sample_name} has failed commits, left to the next run")
+    run_state.close()
+    get_sonar_client().print_latency_stats()
+    if os.getpid() in worker_scratch_trees:
+        worker_scratch_trees.pop(os.getpid()).remove()
 
     os.chdir(samples_folder)
     print(f"Deleting repository directory: {samples_folder}/{repository_name}")
-    delete_repository(f"{samples_folder}/{repository_name}")
+    delete_repository(mirror_path, f"{samples_folder}/{repository_name}")
+
+
+# prepare a sample for the commit scheduler and return its commits and its pending
+# commit tasks
+def prepare_sample(row, mirror_path, run_state):
+    sample_name, github_address = row["sample_name"], row["github_address"]
+    if mirror_path is None:
+        print(f"Failed to clone {github_address}")
+        return [], []
+    run_state.mark_sample_started(sample_name)
+    if not run_state.is_project_created(sample_name):
+        response = create_sonarqube_project(sample_name)
+        if response.ok or "already exists" in response.text:
+            run_state.mark_project_created(sample_name)
+    token = generate_sonarqube_token(sample_name)
+
+    with time_stage("enumerate_commits", sample_name) as event:
+        records = {record.hash: record for record in iter_commit_log(mirror_path)}
+        commits = sample_commits(mirror_path, list(records), COMMIT_SAMPLING)
+        print(f"Number of commits for {sample_name}: {len(commits)}")
+        inherited_commits = (
+            select_commits(mirror_path, commits, records=records)
+            if SKIP_UNCHANGED_COMMITS
+            else {}
+        )
+        pending_commits = get_pending_commits(sample_name, commits, run_state)
+        event["commits"] = len(pending_commits)
+    return commits, [
+        {
+            "sample": sample_name,
+            "position": position,
+            "commit_hash": commit_hash,
+            "commit_date": records[commit_hash].date,
+            "num_commits": len(commits),
+            "token": token,
+            "mirror_path": mirror_path,
+            "repository_name": get_repository_name(github_address),
+            "inherited_from": inherited_commits.get(commit_hash),
+        }
+        for position, commit_hash in pending_commits
+    ]
+
+
+worker_run_state = {}
+# the store of each worker keeps the last snapshots for the commits inheriting them
+worker_stores = {}
+
+
+# run by the scheduler workers, in the working copy of the task sample
+def analyze_scheduled_commit(task):
+    pid = os.getpid()
+    if pid not in worker_run_state:
+        worker_run_state[pid] = RunState(RUN_STATE_FILE)
+    run_state = worker_run_state[pid]
+    if pid not in worker_stores:
+        worker_stores[pid] = IssueStore(ISSUE_STORE_PATH, sharded=SHARDED_OUTPUT)
+    sample_name, commit_hash = task["sample"], task["commit_hash"]
+    print(
+        f"Analyzing {sample_name} commit "
+        f"{task['position'] + 1}/{task['num_commits']} {commit_hash}..."
+    )
+    try:
+        return analyze_commit(
+            sample_name,
+            task["token"],
+            commit_hash,
+            task["position"],
+            run_state,
+            worker_stores[pid],
+            task.get("inherited_from"),
+            task.get("commit_date"),
+        )
+    except Exception as e:
+        print(f"Erro ao analisar o commit {commit_hash}: {str(e)}")
+        run_state.mark_error(sample_name, commit_hash, e)
+        return False
+
+
+# schedule (sample, commit) tasks of every sample over the workers
+def run_commit_scheduler(rows, num_workers):
+    run_state = RunState(RUN_STATE_FILE)
+    rows = [row for row in rows if not run_state.is_sample_finished(row["sample_name"])]
+
+    def update_sample_mirror(row):
+        with time_stage("clone", row["sample_name"]) as event:
+            mirror_path = update_mirror(row["github_address"], partial=PARTIAL_CLONE)
+            event["ok"] = mirror_path is not None
+        return mirror_path
+
+    # the mirrors are updated concurrently, the rest of the preparation is light
+    with ThreadPoolExecutor(max_workers=MIRROR_UPDATE_THREADS) as executor:
+        mirror_paths = list(executor.map(update_sample_mirror, rows))
+
+    scheduler = CommitScheduler(
+        analyze_scheduled_commit,
+        os.path.join(samples_folder, "workers"),
+        num_workers=num_workers,
+        client=get_sonar_client(),
+        max_ce_pending=MAX_CE_PENDING,
+        metrics=StageMetrics(STAGE_EVENTS_FILE),
+        prometheus_file=PROMETHEUS_TEXTFILE,
+    )
+    commits_by_sample = {}
+    for row, mirror_path in zip(rows, mirror_paths):
+        commits, tasks = prepare_sample(row, mirror_path, run_state)
+        commits_by_sample[row["sample_name"]] = commits
+        scheduler.add_sample(row["sample_name"], tasks)
+    scheduler.run()
+    if EXPORT_COMMITS:
+        remove_scratch_trees()
+    IssueStore(ISSUE_STORE_PATH).merge_shards([row["sample_name"] for row in rows])
+
+    # a sample with failed commits is resumed by the next run
+    for row, mirror_path in zip(rows, mirror_paths):
+        commits = commits_by_sample[row["sample_name"]]
+        if mirror_path is not None and run_state.has_completed(
+            row["sample_name"], commits
+        ):
+            run_state.mark_sample_finished(row["sample_name"])
+    run_state.close()
 
 
 def main():
     print("start at", time.strftime("%Y-%m-%d %H:%M:%S"))
     num_cores = os.cpu_count()
     print(f"Number of cores: {num_cores}")
-    with Pool(processes=num_cores) as pool:
-        pool.map(run_git_part, [row for _, row in samples_df.iterrows()])
+    rows = [row for _, row in samples_df.iterrows()]
+    if ISOLATED_SCANNER_HOMES:
+        warm_up_scanner_cache()
+    # bisection picks the next commits from the issues found, one sample per worker
+    if SCHEDULER_MODE == "commit" and COMMIT_SAMPLING != "bisect":
+        run_commit_scheduler(rows, num_cores)
+    else:
+        metrics = StageMetrics(STAGE_EVENTS_FILE)
+        stopped = start_summary_reporter(
+            metrics, SUMMARY_INTERVAL, prometheus_file=PROMETHEUS_TEXTFILE
+        )
+        with Pool(processes=num_cores) as pool:
+            pool.map(run_git_part, rows)
+        stopped.set()
+        report_summary(metrics, prometheus_file=PROMETHEUS_TEXTFILE)
+    if ISOLATED_SCANNER_HOMES:
+        harvest_scanner_homes()
     print("end at", time.strftime("%Y-%m-%d %H:%M:%S"))
 
 
@@ -0,0 +1,97 @@
+import os
+import time
+
+import requests
+from requests.exceptions import JSONDecodeError
+
+REPORT_TASK_FILE = os.path.join(".scannerwork", "report-task.txt")
+CE_TASK_TIMEOUT = 900
+CE_POLL_INITIAL_DELAY = 0.5
+CE_POLL_MAX_DELAY = 10
+CE_POLL_BACKOFF = 1.5
+CE_FINAL_STATUSES = ("SUCCESS", "FAILED", "CANCELED")
+
+
+# read the report-task.txt written by the scanner after submitting the analysis
+def read_report_task(work_dir="."):
+    report_task_path = os.path.join(work_dir, REPORT_TASK_FILE)
+    if not os.path.exists(report_task_path):
+        return {}
+
+    report_task = {}
+    with open(report_task_path, "r") as f:
+        for line in f:
+            if "=" not in line:
+                continue
+            key, value = line.strip().split("=", 1)
+            report_task[key] = value
+    return report_task
+
+
+def get_report_task_id(work_dir="."):
+    return read_report_task(work_dir).get("ceTaskId")
+
+
+# remove the report-task.txt from the previous analysis so a failed scan is not mistaken for a new one
+def clear_report_task(work_dir="."):
+    report_task_path = os.path.join(work_dir, REPORT_TASK_FILE)
+    if os.path.exists(report_task_path):
+        os.remove(report_task_path)
+
+
+def get_ce_task(client, task_id, token):
+    headers = {"Authorization": f"Bearer {token}"}
+    try:
+        response = client.get("api/ce/task", params={"id": task_id}, headers=headers)
+        response.raise_for_status()
+        return response.json().get("task", {})
+    except JSONDecodeError as e:
+        print(f"Failed to decode CE task response: {e}")
+        return None
+    except requests.RequestException as e:
+        print(f"Failed to get CE task {task_id}: {e}")
+        return None
+
+
+# poll the Compute Engine task with adaptive backoff until it reaches a final status or the timeout expires
+def wait_for_ce_task(client, task_id, token, timeout=CE_TASK_TIMEOUT):
+    start = time.monotonic()
+    delay = CE_POLL_INITIAL_DELAY
+
+    while True:
+        task = get_ce_task(client, task_id, token)
+        status = task.get("status") if task else None
+        if status in CE_FINAL_STATUSES:
+            elapsed = time.monotonic() - start
+            print(f"CE task {task_id} finished with {status} in {elapsed:.1f}s")
+            if status != "SUCCESS":
+                print(f"CE task {task_id} error: {task.get('errorMessage', '')}")
+            return status
+
+        elapsed = time.monotonic() - start
+        if elapsed >= timeout:
+            print(f"Timed out after {timeout}s waiting for CE task {task_id}")
+            return None
+
+        time.sleep(min(delay, timeout - elapsed))
+        delay = min(delay * CE_POLL_BACKOFF, CE_POLL_MAX_DELAY)
+
+
+# wait for the analysis submitted by the last scanner run in work_dir
+def wait_for_analysis(client, token, work_dir=".", timeout=CE_TASK_TIMEOUT):
+    task_id = get_report_task_id(work_dir)
+    if not task_id:
+        print(f"No report task found in {work_dir}, the scanner did not submit")
+        return None
+    return wait_for_ce_task(client, task_id, token, timeout=timeout)
+
+
+# number of pending and in progress tasks in the Compute Engine queue
+def get_ce_activity_status(client):
+    try:
+        response = client.get("api/ce/activity_status")
+        response.raise_for_status()
+        return response.json()
+    except (JSONDecodeError, requests.RequestException) as e:
+        print(f"Failed to get CE activity status: {e}")
+        return None
@@ -0,0 +1,168 @@
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_POOL_SIZE = 32
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_BASE = 0.5
+DEFAULT_BACKOFF_MAX = 30
+DEFAULT_REQUESTS_PER_SECOND = 50
+DEFAULT_TIMEOUT = 60
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# a POST that reached the server may have been applied, e.g. a token generated twice
+RETRY_METHODS = ("GET", "HEAD")
+
+
+# token bucket shared by every thread of the process using the client
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class SonarQubeClient:
+    def __init__(
+        self,
+        base_url,
+        auth=None,
+        pool_size=DEFAULT_POOL_SIZE,
+        max_retries=DEFAULT_MAX_RETRIES,
+        requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+        timeout=DEFAULT_TIMEOUT,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.auth = auth
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.rate_limiter = (
+            TokenBucket(requests_per_second) if requests_per_second else None
+        )
+
+        # basic auth is passed per request, a session auth would replace the
+        # Authorization header of the calls made with a project token
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.stats_lock = threading.Lock()
+        self.latency_stats = {}
+
+    def record_latency(self, endpoint, elapsed, failed):
+        with self.stats_lock:
+            stats = self.latency_stats.setdefault(
+                endpoint,
+                {"count": 0, "errors": 0, "retries": 0, "total": 0.0, "max": 0.0},
+            )
+            stats["count"] += 1
+            stats["errors"] += int(failed)
+            stats["total"] += elapsed
+            stats["max"] = max(stats["max"], elapsed)
+
+    def record_retry(self, endpoint):
+        with self.stats_lock:
+            stats = self.latency_stats.setdefault(
+                endpoint,
+                {"count": 0, "errors": 0, "retries": 0, "total": 0.0, "max": 0.0},
+            )
+            stats["retries"] += 1
+
+    def get_backoff(self, attempt, response=None):
+        if response is not None and response.headers.get("Retry-After", "").isdigit():
+            return int(response.headers["Retry-After"])
+        # full jitter so retrying threads do not hit the server at the same time
+        return random.uniform(
+            0, min(DEFAULT_BACKOFF_MAX, DEFAULT_BACKOFF_BASE * 2**attempt)
+        )
+
+    # send a request, retrying connection errors and 429/5xx responses of idempotent
+    # requests with jittered backoff
+    def request(self, method, endpoint, **kwargs):
+        url = f"{self.base_url}/{endpoint.lstrip('/')}"
+        kwargs.setdefault("timeout", self.timeout)
+        if "Authorization" not in (kwargs.get("headers") or {}):
+            kwargs.setdefault("auth", self.auth)
+        max_retries = self.max_retries if method.upper() in RETRY_METHODS else 0
+
+        for attempt in range(max_retries + 1):
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+
+            start = time.monotonic()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.record_latency(endpoint, time.monotonic() - start, True)
+                if attempt == max_retries:
+                    raise
+                print(f"Request to {endpoint} failed ({e}), retrying...")
+                self.record_retry(endpoint)
+                time.sleep(self.get_backoff(attempt))
+                continue
+
+            failed = response.status_code in RETRY_STATUS_CODES
+            self.record_latency(endpoint, time.monotonic() - start, failed)
+            if not failed or attempt == max_retries:
+                return response
+
+            print(f"Request to {endpoint} returned {response.status_code}, retrying...")
+            self.record_retry(endpoint)
+            time.sleep(self.get_backoff(attempt, response))
+
+    def get(self, endpoint, **kwargs):
+        return self.request("GET", endpoint, **kwargs)
+
+    def post(self, endpoint, **kwargs):
+        return self.request("POST", endpoint, **kwargs)
+
+    def get_latency_stats(self):
+        with self.stats_lock:
+            return {
+                endpoint: dict(
+                    stats, mean=stats["total"] / stats["count"] if stats["count"] else 0
+                )
+                for endpoint, stats in self.latency_stats.items()
+            }
+
+    def print_latency_stats(self):
+        for endpoint, stats in sorted(self.get_latency_stats().items()):
+            print(
+                f"{endpoint}: {stats['count']} requests, {stats['errors']} errors, "
+                f"{stats['retries']} retries, mean {stats['mean'] * 1000:.0f}ms, "
+                f"max {stats['max'] * 1000:.0f}ms"
+            )
+
+
+clients = {}
+clients_lock = threading.Lock()
+
+
+# return the client shared by the current process for this server and credentials
+def get_client(base_url, auth=None, **kwargs):
+    # a forked worker must not reuse the connections of its parent
+    key = (os.getpid(), base_url, auth)
+    with clients_lock:
+        if key not in clients:
+            clients[key] = SonarQubeClient(base_url, auth=auth, **kwargs)
+        return clients[key]
@@ -0,0 +1,211 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+PAGE_SIZE = 500
+SEARCH_LIMIT = 10000
+MAX_PAGE_WORKERS = 8
+# facets used, in order, to split a query whose result is above the search limit
+PARTITION_FACETS = ("impactSoftwareQualities", "severities", "rules")
+SONAR_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
+
+
+def search_issues_page(client, params, page=1, page_size=PAGE_SIZE, **request_kwargs):
+    page_params = dict(params, p=page, ps=page_size)
+    response = client.get("api/issues/search", params=page_params, **request_kwargs)
+    response.raise_for_status()
+    return response.json()
+
+
+def get_total(response):
+    return int(response.get("paging", {}).get("total", response.get("total", 0)))
+
+
+def get_facet_values(response, facet):
+    for current_facet in response.get("facets", []):
+        if current_facet.get("property") == facet:
+            return [
+                (value["val"], int(value.get("count", 0)))
+                for value in current_facet.get("values", [])
+            ]
+    return []
+
+
+# fetch all the pages of a query that fits in the search limit, in parallel
+def fetch_pages(client, params, first_response, max_workers, **request_kwargs):
+    total = min(get_total(first_response), SEARCH_LIMIT)
+    total_pages = (total + PAGE_SIZE - 1) // PAGE_SIZE
+    issues = list(first_response.get("issues", []))
+    if total_pages <= 1:
+        return issues
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        responses = executor.map(
+            lambda page: search_issues_page(client, params, page, **request_kwargs),
+            range(2, total_pages + 1),
+        )
+        for response in responses:
+            issues.extend(response.get("issues", []))
+    return issues
+
+
+def parse_sonar_date(value):
+    return datetime.strptime(value, SONAR_DATE_FORMAT)
+
+
+def format_sonar_date(value):
+    return value.strftime(SONAR_DATE_FORMAT)
+
+
+# get the creation date of the oldest and newest issue matching the query
+def get_creation_date_range(client, params, **request_kwargs):
+    dates = []
+    for ascending in ("true", "false"):
+        sorted_params = dict(params, s="CREATION_DATE", asc=ascending)
+        sorted_params.pop("facets", None)
+        response = search_issues_page(
+            client, sorted_params, page_size=1, **request_kwargs
+        )
+        issues = response.get("issues", [])
+        if not issues:
+            return None
+        dates.append(parse_sonar_date(issues[0]["creationDate"]))
+    return dates[0], dates[1] + timedelta(seconds=1)
+
+
+# split a query by creation date until each range fits in the search limit
+def collect_by_date(
+    client, params, start, end, max_workers, issues_by_key, **request_kwargs
+):
+    range_params = dict(
+        params,
+        createdAfter=format_sonar_date(start),
+        createdBefore=format_sonar_date(end),
+    )
+    range_params.pop("facets", None)
+    response = search_issues_page(client, range_params, **request_kwargs)
+    total = get_total(response)
+    if total == 0:
+        return
+
+    if total > SEARCH_LIMIT and end - start > timedelta(seconds=1):
+        middle = start + (end - start) / 2
+        middle = middle.replace(microsecond=0)
+        collect_by_date(
+            client,
+            params,
+            start,
+            middle,
+            max_workers,
+            issues_by_key,
+            **request_kwargs,
+        )
+        collect_by_date(
+            client, params, middle, end, max_workers, issues_by_key, **request_kwargs
+        )
+        return
+
+    if total > SEARCH_LIMIT:
+        print(f"{total} issues created in the same second, only {SEARCH_LIMIT} fetched")
+    for issue in fetch_pages(
+        client, range_params, response, max_workers, **request_kwargs
+    ):
+        issues_by_key[issue["key"]] = issue
+
+
+def collect_issues(
+    client, params, facets, max_workers, issues_by_key, **request_kwargs
+):
+    response = search_issues_page(client, params, **request_kwargs)
+    total = get_total(response)
+    if total <= SEARCH_LIMIT:
+        for issue in fetch_pages(
+            client, params, response, max_workers, **request_kwargs
+        ):
+            issues_by_key[issue["key"]] = issue
+        return response
+
+    for index, facet in enumerate(facets):
+        if facet in params:
+            continue
+        facet_params = dict(params, facets=facet)
+        facet_response = search_issues_page(
+            client, facet_params, page_size=1, **request_kwargs
+        )
+        values = [
+            (value, count)
+            for value, count in get_facet_values(facet_response, facet)
+            if count
+        ]
+        # the facet is only usable when its values cover every issue of the query
+        if len(values) < 2 or sum(count for _, count in values) < total:
+            continue
+        print(f"{total} issues above the search limit, partitioning by {facet}")
+        for value, _ in values:
+            collect_issues(
+                client,
+                dict(params, **{facet: value}),
+                facets[index + 1 :],
+                max_workers,
+                issues_by_key,
+                **request_kwargs,
+            )
+        return response
+
+    date_range = get_creation_date_range(client, params, **request_kwargs)
+    if date_range:
+        print(f"{total} issues above the search limit, partitioning by creation date")
+        collect_by_date(
+            client,
+            params,
+            date_range[0],
+            date_range[1],
+            max_workers,
+            issues_by_key,
+            **request_kwargs,
+        )
+    return response
+
+
+# fetch every issue matching params, beyond the search limit, de-duplicated by key
+def fetch_all_issues(client, params, max_workers=MAX_PAGE_WORKERS, **request_kwargs):
+    issues_by_key = {}
+    first_response = collect_issues(
+        client,
+        params,
+        PARTITION_FACETS,
+        max_workers,
+        issues_by_key,
+        **request_kwargs,
+    )
+    result = dict(first_response)
+    result["issues"] = list(issues_by_key.values())
+    result["total"] = len(issues_by_key)
+    result["p"] = 1
+    result["ps"] = len(issues_by_key)
+    result["paging"] = {
+        "pageIndex": 1,
+        "pageSize": len(issues_by_key),
+        "total": len(issues_by_key),
+    }
+    return result
+
+
+# issues updated at or after since, newest first, paging only until an older one is seen;
+# None when more than the search limit changed, the caller then fetches every issue
+def fetch_changed_issues(client, params, since, page_size=PAGE_SIZE, **request_kwargs):
+    params = {key: value for key, value in params.items() if key != "facets"}
+    params.update(s="UPDATE_DATE", asc="false")
+    since = parse_sonar_date(since)
+    issues = []
+    page = 1
+    while page * page_size <= SEARCH_LIMIT:
+        response = search_issues_page(client, params, page, page_size, **request_kwargs)
+        page_issues = response.get("issues", [])
+        for issue in page_issues:
+            if parse_sonar_date(issue["updateDate"]) < since:
+                return issues
+            issues.append(issue)
+        if len(page_issues) < page_size:
+            return issues
+        page += 1
+    return None
@@ -0,0 +1,357 @@
+import asyncio
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+SNIPPETS_DATASET_PATH = "data/code_snippets/dataset"
+SNIPPETS_BATCH_SIZE = 5000
+SNIPPETS_CONCURRENCY = 32
+SNIPPET_CONTEXT_LINES = 5
+SOURCES_CACHE_PATH = "data/code_snippets/sources"
+SOURCES_CACHE_MAX_LINES = 2000000
+
+SNIPPETS_SCHEMA = pa.schema(
+    [
+        ("issue_key", pa.string()),
+        ("component_key", pa.string()),
+        ("component_project", pa.string()),
+        ("line", pa.int64()),
+        ("code", pa.string()),
+        ("scmRevision", pa.string()),
+        ("scmAuthor", pa.string()),
+        ("scmDate", pa.string()),
+        ("duplicated", pa.bool_()),
+        ("isNew", pa.bool_()),
+    ]
+)
+
+
+# append-only parquet dataset, one part file per flushed batch
+class SnippetStore:
+    def __init__(self, path=SNIPPETS_DATASET_PATH, batch_size=SNIPPETS_BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.rows = []
+        self.part = 0
+        os.makedirs(path, exist_ok=True)
+
+    def get_part_files(self):
+        return sorted(glob.glob(os.path.join(self.path, "*.parquet")))
+
+    # issue keys already written by a previous run, so it can resume
+    def get_processed_keys(self):
+        processed_keys = set()
+        for part_file in self.get_part_files():
+            table = pq.read_table(part_file, columns=["issue_key"])
+            processed_keys.update(table.column("issue_key").to_pylist())
+        return processed_keys
+
+    def append(self, rows):
+        self.rows.extend(rows)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        table = pa.Table.from_pylist(
+            [
+                {field: row.get(field) for field in SNIPPETS_SCHEMA.names}
+                for row in self.rows
+            ],
+            schema=SNIPPETS_SCHEMA,
+        )
+        file_name = f"part-{time.time_ns()}-{os.getpid()}-{self.part}.parquet"
+        tmp_path = os.path.join(self.path, f".{file_name}.tmp")
+        pq.write_table(table, tmp_path)
+        # rename so a crash never leaves a half written part in the dataset
+        os.replace(tmp_path, os.path.join(self.path, file_name))
+        self.part += 1
+        self.rows = []
+
+    def read(self, columns=None):
+        part_files = self.get_part_files()
+        if not part_files:
+            return SNIPPETS_SCHEMA.empty_table().to_pandas()
+        snippets_df = pq.ParquetDataset(part_files).read(columns=columns).to_pandas()
+        if "line" in snippets_df:
+            snippets_df = snippets_df[snippets_df["line"].notna()]
+        return snippets_df
+
+
+def fetch_issue_snippets(client, issue_key, component):
+    response = client.get("api/sources/issue_snippets", params={"issueKey": issue_key})
+    response.raise_for_status()
+    snippets = response.json().get(component, [])
+    if not snippets:
+        # keep a row without line so the issue is not requested again on resume
+        return [{"issue_key": issue_key, "component_key": component}]
+
+    component_key = snippets["component"]["key"]
+    component_project = snippets["component"]["project"]
+    return [
+        dict(
+            source,
+            issue_key=issue_key,
+            component_key=component_key,
+            component_project=component_project,
+        )
+        for source in snippets["sources"]
+    ]
+
+
+async def extract_issue_snippets(client, executor, semaphore, issue_key, component):
+    async with semaphore:
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                executor, fetch_issue_snippets, client, issue_key, component
+            )
+        except Exception as e:
+            print(f"Error extracting code snippets for {issue_key}: {e}")
+            return None
+
+
+# extract the snippets of every (issue key, component) pair not yet in the store
+async def extract_snippets_async(
+    client, issues, store=None, concurrency=SNIPPETS_CONCURRENCY
+):
+    store = store or SnippetStore()
+    processed_keys = store.get_processed_keys()
+    pending = {}
+    for issue_key, component in issues:
+        if issue_key not in processed_keys:
+            pending.setdefault(issue_key, component)
+    print(f"Extracting code snippets for {len(pending)} issues")
+
+    semaphore = asyncio.Semaphore(concurrency)
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    tasks = [
+        asyncio.create_task(
+            extract_issue_snippets(client, executor, semaphore, issue_key, component)
+        )
+        for issue_key, component in pending.items()
+    ]
+
+    done = failed = 0
+    try:
+        for task in asyncio.as_completed(tasks):
+            rows = await task
+            done += 1
+            if rows is None:
+                failed += 1
+                continue
+            store.append(rows)
+            if done % 1000 == 0:
+                print(f"Extracted code snippets for {done}/{len(tasks)} issues")
+    finally:
+        store.flush()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    print(f"Extracted code snippets for {done - failed} issues, {failed} failed")
+    return store
+
+
+def extract_snippets(client, issues, store=None, concurrency=SNIPPETS_CONCURRENCY):
+    return asyncio.run(
+        extract_snippets_async(client, issues, store=store, concurrency=concurrency)
+    )
+
+
+# size-bounded LRU of component sources backed by an on-disk cache keyed by component and revision
+class SourceCache:
+    def __init__(self, path=SOURCES_CACHE_PATH, max_lines=SOURCES_CACHE_MAX_LINES):
+        self.path = path
+        self.max_lines = max_lines
+        self.sources = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def get_file_path(self, component, revision):
+        digest = hashlib.sha1(f"{component}@{revision}".encode()).hexdigest()
+        return os.path.join(self.path, f"{digest}.json")
+
+    def get(self, component, revision):
+        key = (component, revision)
+        with self.lock:
+            if key in self.sources:
+                self.sources.move_to_end(key)
+                return self.sources[key]
+
+        file_path = self.get_file_path(component, revision)
+        if not os.path.exists(file_path):
+            return None
+        with open(file_path, "r") as f:
+            sources = json.load(f)
+        self.remember(key, sources)
+        return sources
+
+    def put(self, component, revision, sources):
+        file_path = self.get_file_path(component, revision)
+        tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(sources, f)
+        os.replace(tmp_path, file_path)
+        self.remember((component, revision), sources)
+
+    def remember(self, key, sources):
+        with self.lock:
+            if key in self.sources:
+                return
+            self.sources[key] = sources
+            self.size += len(sources)
+            while self.size > self.max_lines and len(self.sources) > 1:
+                _, evicted = self.sources.popitem(last=False)
+                self.size -= len(evicted)
+
+
+# the analysis version the sources of a project currently belong to
+def get_analysis_version(client, project):
+    response = client.get(
+        "api/project_analyses/search", params={"project": project, "ps": 1}
+    )
+    response.raise_for_status()
+    analyses = response.json().get("analyses", [])
+    if not analyses:
+        return ""
+    return analyses[0].get("revision") or analyses[0].get("projectVersion", "")
+
+
+def fetch_component_sources(client, component):
+    response = client.get("api/sources/lines", params={"key": component})
+    response.raise_for_status()
+    return response.json().get("sources", [])
+
+
+def get_component_sources(client, cache, component, revision):
+    sources = cache.get(component, revision)
+    if sources is None:
+        sources = fetch_component_sources(client, component)
+        cache.put(component, revision, sources)
+    return sources
+
+
+# cut the lines around the issue text range out of the component sources
+def slice_snippet(sources, text_range, context=SNIPPET_CONTEXT_LINES):
+    if not text_range:
+        return []
+    start_line = max(1, text_range["startLine"] - context)
+    end_line = text_range.get("endLine", text_range["startLine"]) + context
+    return [source for source in sources if start_line <= source["line"] <= end_line]
+
+
+def extract_component_snippets(client, cache, component, project, revision, issues):
+    sources = get_component_sources(client, cache, component, revision)
+    rows = []
+    for issue_key, text_range in issues:
+        snippet = slice_snippet(sources, text_range)
+        if not snippet:
+            rows.append({"issue_key": issue_key, "component_key": component})
+            continue
+        rows.extend(
+            dict(
+                source,
+                issue_key=issue_key,
+                component_key=component,
+                component_project=project,
+            )
+            for source in snippet
+        )
+    return rows
+
+
+async def extract_component_snippets_async(
+    client, executor, semaphore, cache, component, project, revision, issues
+):
+    async with semaphore:
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                executor,
+                extract_component_snippets,
+                client,
+                cache,
+                component,
+                project,
+                revision,
+                issues,
+            )
+        except Exception as e:
+            print(f"Error extracting code snippets for {component}: {e}")
+            return None
+
+
+# extract the snippets fetching each component source once and slicing them locally
+async def extract_snippets_by_component_async(
+    client, issues, store=None, cache=None, concurrency=SNIPPETS_CONCURRENCY
+):
+    store = store or SnippetStore()
+    cache = cache or SourceCache()
+    processed_keys = store.get_processed_keys()
+
+    components = {}
+    for issue_key, component, project, text_range in issues:
+        if issue_key in processed_keys:
+            continue
+        components.setdefault((component, project), {})[issue_key] = text_range
+
+    versions = {}
+    for project in {project for _, project in components}:
+        versions[project] = get_analysis_version(client, project)
+    print(
+        f"Extracting code snippets for {sum(map(len, components.values()))} issues "
+        f"in {len(components)} components"
+    )
+
+    semaphore = asyncio.Semaphore(concurrency)
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    tasks = [
+        asyncio.create_task(
+            extract_component_snippets_async(
+                client,
+                executor,
+                semaphore,
+                cache,
+                component,
+                project,
+                versions[project],
+                list(component_issues.items()),
+            )
+        )
+        for (component, project), component_issues in components.items()
+    ]
+
+    done = failed = 0
+    try:
+        for task in asyncio.as_completed(tasks):
+            rows = await task
+            done += 1
+            if rows is None:
+                failed += 1
+                continue
+            store.append(rows)
+            if done % 100 == 0:
+                print(f"Extracted code snippets for {done}/{len(tasks)} components")
+    finally:
+        store.flush()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    print(f"Extracted code snippets for {done - failed} components, {failed} failed")
+    return store
+
+
+def extract_snippets_by_component(
+    client, issues, store=None, cache=None, concurrency=SNIPPETS_CONCURRENCY
+):
+    return asyncio.run(
+        extract_snippets_by_component_async(
+            client, issues, store=store, cache=cache, concurrency=concurrency
+        )
+    )
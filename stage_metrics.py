@@ -0,0 +1,217 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+STAGE_EVENTS_FILE = os.path.join("data", "metrics", "stage_events.jsonl")
+SUMMARY_INTERVAL = 30
+# the event recorded once per (sample, commit), used for the throughput and the ETA
+COMMIT_STAGE = "commit"
+# the event of a sample whose "commits" field is the number of commits to analyze
+ENUMERATE_STAGE = "enumerate_commits"
+PROMETHEUS_PREFIX = "sonarqube_analysis"
+
+
+# append one event as a single write, so the lines of concurrent workers do not interleave
+def record_event(event, events_file=STAGE_EVENTS_FILE):
+    os.makedirs(os.path.dirname(events_file) or ".", exist_ok=True)
+    fd = os.open(events_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, (json.dumps(event, default=str) + "\n").encode())
+    finally:
+        os.close(fd)
+
+
+# time the block and record it as a stage event, the yielded dict takes extra fields
+@contextmanager
+def stage_timer(stage, sample=None, commit_hash=None, events_file=STAGE_EVENTS_FILE):
+    event = {"stage": stage, "sample": sample, "commit": commit_hash, "ok": True}
+    start = time.perf_counter()
+    try:
+        yield event
+    except BaseException:
+        event["ok"] = False
+        raise
+    finally:
+        event["seconds"] = round(time.perf_counter() - start, 4)
+        event["time"] = time.time()
+        event["pid"] = os.getpid()
+        record_event(event, events_file)
+
+
+def get_percentile(sorted_values, percentile):
+    if not sorted_values:
+        return 0
+    index = round(percentile / 100 * (len(sorted_values) - 1))
+    return sorted_values[index]
+
+
+# reads the events appended since it was created and aggregates them per stage
+class StageMetrics:
+    def __init__(self, events_file=STAGE_EVENTS_FILE, total_commits=None):
+        self.events_file = events_file
+        self.total_commits = total_commits
+        # events of previous runs are history, not progress of this run
+        self.offset = os.path.getsize(events_file) if os.path.exists(events_file) else 0
+        self.started_at = time.time()
+        self.durations = {}
+        self.failures = {}
+        self.enumerated_commits = 0
+        self.commits_done = 0
+        self.lock = threading.Lock()
+
+    # read the complete lines appended since the last update
+    def update(self):
+        if not os.path.exists(self.events_file):
+            return 0
+        with self.lock, open(self.events_file, "rb") as f:
+            f.seek(self.offset)
+            data = f.read()
+            # a line still being written is read by the next update
+            end = data.rfind(b"\n") + 1
+            self.offset += end
+            lines = data[:end].splitlines()
+            for line in lines:
+                try:
+                    self.add_event(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        return len(lines)
+
+    def add_event(self, event):
+        stage = event.get("stage")
+        self.durations.setdefault(stage, []).append(event.get("seconds", 0))
+        if not event.get("ok", True):
+            self.failures[stage] = self.failures.get(stage, 0) + 1
+        if stage == COMMIT_STAGE:
+            self.commits_done += 1
+        elif stage == ENUMERATE_STAGE:
+            self.enumerated_commits += event.get("commits", 0)
+
+    def get_summary(self, queue_depths=None):
+        with self.lock:
+            elapsed = time.time() - self.started_at
+            total = self.total_commits or self.enumerated_commits
+            rate = self.commits_done / elapsed * 60 if elapsed else 0
+            remaining = max(total - self.commits_done, 0)
+            stages = {}
+            for stage, durations in self.durations.items():
+                durations = sorted(durations)
+                stages[stage] = {
+                    "count": len(durations),
+                    "failed": self.failures.get(stage, 0),
+                    "total": round(sum(durations), 2),
+                    "p50": round(get_percentile(durations, 50), 3),
+                    "p95": round(get_percentile(durations, 95), 3),
+                }
+            return {
+                "elapsed": round(elapsed, 1),
+                "commits_done": self.commits_done,
+                "commits_total": total,
+                "commits_per_minute": round(rate, 2),
+                "eta_seconds": (
+                    round(remaining / rate * 60) if rate and total else None
+                ),
+                "stages": stages,
+                "queues": dict(queue_depths or {}),
+            }
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "unknown"
+    hours, seconds = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s"
+
+
+def format_summary(summary):
+    lines = [
+        f"Progress: {summary['commits_done']}/{summary['commits_total']} commits, "
+        f"{summary['commits_per_minute']} commits/min, "
+        f"ETA {format_duration(summary['eta_seconds'])}"
+    ]
+    if summary["queues"]:
+        lines.append(
+            "Queues: "
+            + ", ".join(f"{name} {depth}" for name, depth in summary["queues"].items())
+        )
+    for stage, stats in sorted(
+        summary["stages"].items(), key=lambda item: -item[1]["total"]
+    ):
+        lines.append(
+            f"  {stage}: {stats['count']} runs, {stats['failed']} failed, "
+            f"p50 {stats['p50']}s, p95 {stats['p95']}s, total {stats['total']}s"
+        )
+    return "\n".join(lines)
+
+
+# the summary in the Prometheus text format, written for the node exporter textfile collector
+def write_prometheus_textfile(summary, path):
+    lines = [
+        f"# TYPE {PROMETHEUS_PREFIX}_commits_done gauge",
+        f"{PROMETHEUS_PREFIX}_commits_done {summary['commits_done']}",
+        f"# TYPE {PROMETHEUS_PREFIX}_commits_total gauge",
+        f"{PROMETHEUS_PREFIX}_commits_total {summary['commits_total']}",
+        f"# TYPE {PROMETHEUS_PREFIX}_commits_per_minute gauge",
+        f"{PROMETHEUS_PREFIX}_commits_per_minute {summary['commits_per_minute']}",
+    ]
+    if summary["eta_seconds"] is not None:
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_eta_seconds gauge")
+        lines.append(f"{PROMETHEUS_PREFIX}_eta_seconds {summary['eta_seconds']}")
+    lines.append(f"# TYPE {PROMETHEUS_PREFIX}_stage_seconds summary")
+    for stage, stats in sorted(summary["stages"].items()):
+        for quantile, key in (("0.5", "p50"), ("0.95", "p95")):
+            lines.append(
+                f'{PROMETHEUS_PREFIX}_stage_seconds{{stage="{stage}",quantile="{quantile}"}} '
+                f"{stats[key]}"
+            )
+        lines.append(
+            f'{PROMETHEUS_PREFIX}_stage_seconds_sum{{stage="{stage}"}} {stats["total"]}'
+        )
+        lines.append(
+            f'{PROMETHEUS_PREFIX}_stage_seconds_count{{stage="{stage}"}} {stats["count"]}'
+        )
+    lines.append(f"# TYPE {PROMETHEUS_PREFIX}_stage_failures gauge")
+    for stage, stats in sorted(summary["stages"].items()):
+        lines.append(
+            f'{PROMETHEUS_PREFIX}_stage_failures{{stage="{stage}"}} {stats["failed"]}'
+        )
+    if summary["queues"]:
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_queue_depth gauge")
+        for name, depth in sorted(summary["queues"].items()):
+            lines.append(f'{PROMETHEUS_PREFIX}_queue_depth{{queue="{name}"}} {depth}')
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # the collector must never read a half written file
+    with open(f"{path}.tmp", "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(f"{path}.tmp", path)
+
+
+def report_summary(metrics, queue_depths=None, prometheus_file=None):
+    metrics.update()
+    summary = metrics.get_summary(queue_depths)
+    print(format_summary(summary))
+    if prometheus_file:
+        write_prometheus_textfile(summary, prometheus_file)
+    return summary
+
+
+# print the summary every interval from a background thread until the returned event is set
+def start_summary_reporter(
+    metrics, interval=SUMMARY_INTERVAL, get_queue_depths=None, prometheus_file=None
+):
+    stopped = threading.Event()
+
+    def run():
+        while not stopped.wait(interval):
+            report_summary(
+                metrics,
+                get_queue_depths() if get_queue_depths else None,
+                prometheus_file,
+            )
+
+    threading.Thread(target=run, daemon=True).start()
+    return stopped
@@ -0,0 +1,164 @@
+import csv
+import random
+import sys
+from datetime import date, timedelta
+
+REPORT_COLUMNS = ["Sample", "Commit Hash", "Date", "Analysis Date", "Issues"]
+NUM_SAMPLES = 3
+COMMITS_PER_SAMPLE = 100
+ISSUES_PER_COMMIT = 200
+# fraction of the open issues fixed by each commit, replaced by new ones
+CHURN_RATE = 0.05
+# fraction of the rows written with a missing field or a truncated issue list
+MALFORMED_FRACTION = 0.01
+START_DATE = date(2020, 1, 1)
+
+SEVERITIES = ("INFO", "MINOR", "MAJOR", "CRITICAL", "BLOCKER")
+ISSUE_TYPES = ("CODE_SMELL", "BUG", "VULNERABILITY")
+SOFTWARE_QUALITIES = ("MAINTAINABILITY", "RELIABILITY", "SECURITY")
+
+
+def create_issue(rng, sample, number, issue_date):
+    start_line = rng.randint(1, 500)
+    return {
+        "key": f"{sample}-{number:08d}",
+        "rule": f"python:S{100 + rng.randrange(40)}",
+        "severity": rng.choice(SEVERITIES),
+        "component": f"{sample}:src/module_{rng.randrange(100)}.py",
+        "project": sample,
+        "line": start_line,
+        "textRange": {
+            "startLine": start_line,
+            "endLine": start_line + rng.randint(0, 4),
+            "startOffset": 0,
+            "endOffset": 10,
+        },
+        "flows": [],
+        "status": "OPEN",
+        "issueStatus": "OPEN",
+        "message": "Synthetic issue",
+        "effort": "5min",
+        "debt": "5min",
+        "author": "synthetic@example.com",
+        "tags": [],
+        "transitions": [],
+        "actions": [],
+        "comments": [],
+        "creationDate": f"{issue_date}T00:00:00-0300",
+        "updateDate": f"{issue_date}T00:00:00-0300",
+        "type": rng.choice(ISSUE_TYPES),
+        "quickFixAvailable": False,
+        "cleanCodeAttribute": "CONVENTIONAL",
+        "cleanCodeAttributeCategory": "CONSISTENT",
+        "impacts": [
+            {"softwareQuality": rng.choice(SOFTWARE_QUALITIES), "severity": "MEDIUM"}
+        ],
+    }
+
+
+# (commit hash, commit date, issues) of one sample, each commit fixes part of the open issues
+# and opens new ones; the issues fixed by a commit are listed once with the FIXED status, as
+# SonarQube does
+def iter_sample_commits(rng, sample, num_commits, issues_per_commit, churn):
+    open_issues = {}
+    next_number = 0
+    for position in range(num_commits):
+        commit_date = START_DATE + timedelta(days=position)
+        fixed = rng.sample(sorted(open_issues), int(len(open_issues) * churn))
+        fixed_issues = [
+            dict(open_issues.pop(key), status="CLOSED", issueStatus="FIXED")
+            for key in fixed
+        ]
+        while len(open_issues) < issues_per_commit:
+            issue = create_issue(rng, sample, next_number, commit_date)
+            open_issues[issue["key"]] = issue
+            next_number += 1
+
+        issues = list(open_issues.values()) + fixed_issues
+        yield f"{rng.getrandbits(160):040x}", commit_date, issues
+
+
+# rows of one sample in the commits report
+def iter_sample_rows(rng, sample, num_commits, issues_per_commit, churn):
+    for commit_hash, commit_date, issues in iter_sample_commits(
+        rng, sample, num_commits, issues_per_commit, churn
+    ):
+        yield [
+            sample,
+            commit_hash,
+            str(commit_date),
+            f"{commit_date} 12:00:00",
+            str({"total": len(issues), "issues": issues}),
+        ]
+
+
+def make_malformed(rng, row):
+    if rng.random() < 0.5:
+        # a field lost, as when the writer was interrupted
+        return row[:-1]
+    return row[:-1] + [row[-1][: len(row[-1]) // 2]]
+
+
+# write a commits_report.csv shaped like the one of the analysis, returns the row count
+def generate_commits_report(
+    file_path,
+    num_samples=NUM_SAMPLES,
+    commits_per_sample=COMMITS_PER_SAMPLE,
+    issues_per_commit=ISSUES_PER_COMMIT,
+    churn=CHURN_RATE,
+    malformed_fraction=MALFORMED_FRACTION,
+    seed=0,
+):
+    rng = random.Random(seed)
+    rows = malformed = 0
+    with open(file_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(REPORT_COLUMNS)
+        for sample_number in range(num_samples):
+            for row in iter_sample_rows(
+                rng,
+                f"sample_{sample_number}",
+                commits_per_sample,
+                issues_per_commit,
+                churn,
+            ):
+                if rng.random() < malformed_fraction:
+                    row = make_malformed(rng, row)
+                    malformed += 1
+                writer.writerow(row)
+                rows += 1
+    print(f"Generated {rows} rows in {file_path}, {malformed} malformed")
+    return rows
+
+
+# write the same commits straight into an issue store, for sizes whose report would be too
+# big to go through the csv, returns the commit count
+def generate_issue_store(
+    store,
+    num_samples=NUM_SAMPLES,
+    commits_per_sample=COMMITS_PER_SAMPLE,
+    issues_per_commit=ISSUES_PER_COMMIT,
+    churn=CHURN_RATE,
+    seed=0,
+):
+    rng = random.Random(seed)
+    commits = 0
+    for sample_number in range(num_samples):
+        sample = f"sample_{sample_number}"
+        for commit_hash, commit_date, issues in iter_sample_commits(
+            rng, sample, commits_per_sample, issues_per_commit, churn
+        ):
+            store.append_commit(
+                sample,
+                commit_hash,
+                str(commit_date),
+                f"{commit_date} 12:00:00",
+                {"total": len(issues), "issues": issues},
+            )
+            commits += 1
+    print(f"Generated {commits} commits in {store.path}")
+    return commits
+
+
+if __name__ == "__main__":
+    generate_commits_report(sys.argv[1] if len(sys.argv) > 1 else "commits_report.csv")